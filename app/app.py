@@ -10,31 +10,57 @@
 from flask import Flask
 from flask import request
 from flask import jsonify
+from flask import Response
+from flask import stream_with_context
+from flask import g
+from flask import send_file
 from urllib import parse        # check if url is valid
 from citation import Citation   # provides a way to save quote and upload json
 from lib.citeit_quote_context.url import URL
 from lib.citeit_quote_context.canonical_url import Canonical_URL
 from lib.citeit_quote_context.document import Document
 from lib.citeit_quote_context.quote import Quote
-from lib.citeit_quote_context.misc.utils import publish_file
-from lib.citeit_quote_context.misc.utils import escape_json
-from models import Request
-from models import Domain
+from request_log import request_log
+from database import Session
+from database import session_scope
+from database import init_app
+from database import init_db
+from persistence import get_domain_id
+from persistence import stored_citations
+from persistence import save_citation_results
+from queries import posts_citing
+from queries import posts_cited_by
+from queries import archives_of_url
+from queries import parse_date
+from queries import search_citations
+import batch
+from crawl import crawl_cli
+from response_cache import cached_response
+from response_cache import dont_cache
+from rate_limit import client_key
+from rate_limit import check_client
+from rate_limit import limiter
+from database import engine
+import metrics
+import profiling
+import worker_pool
+from structured_logging import configure_logging
+from structured_logging import set_correlation_id
+from structured_logging import get_correlation_id
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.declarative import declarative_base
 
 
 import urllib3
 import hashlib
 import settings
 import json
+import math
 import os
 
 import logging
 
+logger = logging.getLogger(__name__)
 
 WEBSERVICE_VERSION = "0.4"
 
@@ -49,14 +75,13 @@ ADMINS = ['citeit@openpolitics.com']
 
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_DATABASE_URI'] = settings.SQLALCHEMY_DATABASE_URI
 app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
 
-engine = create_engine(SA_URL(**settings.DB_URL))
-Base = declarative_base()
+init_app(app)   # close each request's database session
+app.cli.add_command(crawl_cli)     # flask citeit crawl
+init_db()
 
-logging.basicConfig(filename='error.log',level=logging.DEBUG)
+configure_logging()     # JSON lines, see settings.LOG_*
 
 if not app.debug:
     from logging.handlers import SMTPHandler
@@ -74,6 +99,131 @@ if not app.debug:
 def about():
     return 'Hello, This is the CiteIt.net api! version: ' + WEBSERVICE_VERSION
 
+
+@app.before_request
+def start_correlation_id():
+    """ Log messages of this request (and of its pool tasks) carry its id """
+    set_correlation_id(request.headers.get('X-Request-ID'))
+
+
+@app.before_request
+def start_profile():
+    """ Requested by an admin (?profile=1) or sampled: see profiling.py """
+    mode = profiling.requested_mode(request.args, request.headers)
+    if mode or profiling.sampled():
+        g.profile_mode = mode or 'save'
+        g.profiler = profiling.start()
+
+
+@app.before_request
+def start_request_metrics():
+    """ Runs before the rate limit, so refused requests are counted too """
+    g.metrics_started = True
+    metrics.add_gauge('citeit_requests_in_progress', 1)
+    metrics.set_gauge('citeit_worker_threads', int(os.getenv('GUNICORN_THREADS', '1')))
+
+
+@app.after_request
+def count_request(response):
+    metrics.inc('citeit_requests_total', endpoint=request.endpoint or 'none', status=response.status_code)
+    response.headers['X-Request-ID'] = get_correlation_id()
+    return response
+
+
+@app.after_request
+def finish_profile(response):
+    """ Runs before count_request: a profile=text report replaces the response """
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+
+    profiler.disable()
+    profile_id = get_correlation_id()
+    profiling.save(profiler, profile_id)
+    if g.pop('profile_mode', None) == 'text':
+        response = Response(profiling.report(profiler), mimetype='text/plain')
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+@app.teardown_request
+def stop_profile(exception=None):
+    """ The view raised: after_request didn't run """
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+@app.teardown_request
+def finish_request_metrics(exception=None):
+    if g.pop('metrics_started', False):
+        metrics.add_gauge('citeit_requests_in_progress', -1)
+
+    pool = engine.pool
+    if hasattr(pool, 'checkedout'):
+        metrics.set_gauge('citeit_db_connections_in_use', pool.checkedout())
+        metrics.set_gauge('citeit_db_pool_size', pool.size())
+    metrics.set_gauge('citeit_worker_pool_pending', worker_pool.pending())
+    metrics.flush(force=True)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """ Prometheus text format: every worker process of this machine """
+    total = metrics.collect()
+    for (name, count) in limiter.throttle_counts().items():
+        total['counters'][metrics.series('citeit_throttled_total', {'name': name})] = count
+    return Response(metrics.render(total), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/v' + WEBSERVICE_VERSION + '/profile/<profile_id>', methods=['GET'])
+def profile_download(profile_id):
+    """ A saved request profile (admin token in the X-Admin-Token header)
+
+        USAGE: /v0.4/profile/<X-Profile-Id>               pstats file
+               /v0.4/profile/<X-Profile-Id>?format=text   slowest functions
+    """
+    if not profiling.is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({'error': "Admin token required"}), 403
+
+    path = profiling.profile_path(profile_id)
+    if not path or not os.path.exists(path):
+        return jsonify({'error': "Unknown profile: " + profile_id}), 404
+
+    if request.args.get('format') == 'text':
+        return Response(profiling.report(path), mimetype='text/plain')
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     attachment_filename=profile_id + '.prof')
+
+
+# Internal endpoints (monitoring, operators): not counted against a client
+UNLIMITED_ENDPOINTS = ['about', 'metrics_endpoint', 'profile_download', 'static']
+
+
+@app.before_request
+def limit_client_rate():
+    """ Token bucket per client: API key (X-API-Key header) or IP address """
+    if request.endpoint in UNLIMITED_ENDPOINTS:
+        return
+
+    key = client_key(request.remote_addr, request.headers.get('X-API-Key'))
+    retry_after = check_client(key)
+    if retry_after:
+        response = jsonify({'error': "Too many requests: retry in %.1f seconds" % retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+        return response
+
+
+@app.errorhandler(worker_pool.WorkerPoolBusy)
+def worker_pool_busy(error):
+    """ The worker pool is saturated: see worker_pool.py """
+    response = jsonify({'error': "Server busy: retry later"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(math.ceil(max(settings.WORKER_POOL_WAIT, 1))))
+    return response
+
+
 @app.route('/', methods=['GET', 'POST'])
 @app.route('/v' + WEBSERVICE_VERSION + '/url/', methods=['GET', 'POST'])
 def post_url():
@@ -85,15 +235,22 @@ def post_url():
         Upload json file to cloud
 
         USAGE: http://localhost:5000/v0.4/url?url=https://www.citeit.net/
+        format: (default) summary dict of sha256: quote
+                list:     list of the JSON of every quote
+                ndjson:   one line of JSON per quote, streamed as each is ready
+        verbose: list and ndjson formats: add the seconds spent in each stage
+                 ('timings') of the quotes that were computed
     """
 
     # GET URL Parameters
     if request.method == "POST":
         url_string = request.form.get('url', '')
         format = request.form.get('format', '')
+        verbose = request.form.get('verbose', '')
     else:
         url_string = request.args.get('url', '')
         format = request.args.get('format', '')
+        verbose = request.args.get('verbose', '')
 
     if (format == 'list'):
         saved_citations = []  # return full JSON list
@@ -109,87 +266,145 @@ def post_url():
     if not is_url:
         saved_citations['error'] = "Specify a valid URL of the form: https://api.citeit.net/?url=http://example.com/page_name"
     else:
+        # Lookup Domain: usually served from the in-process cache.
+        # A new domain is committed in a transaction of its own, before the
+        # page is fetched: the request row references it even if the page
+        # has no new citations, and no lock is held while quotes download.
+        with session_scope() as domain_session:
+            domain_id = get_domain_id(domain_session, domain_url)
+
+        # Request-scoped session: closed when the request ends
+        session = Session()
 
-        from sqlalchemy.orm import sessionmaker
-        from sqlalchemy.ext.declarative import declarative_base
+        # Log Request: written in the background, in batches
+        request_id = request_log.log(
+            ip_address=request.remote_addr,
+            request_type='post-url',
+            request_url=url_string,
+            domain_id=domain_id,
+            user_agent=request.headers.get('User-Agent', '')
+        )
 
-        # create session
-        Session = sessionmaker()
-        Session.configure(bind=engine)
-        session = Session()
+        url = URL(url_string)
+        lookup = lambda sha256_list: stored_citations(session, sha256_list)
 
-        # Lookup Domain
-        domain = session.query(Domain).filter_by(domain_url=domain_url).first()
-        if not domain:          
-            domain = Domain(domain_url=domain_url)
+        # Stream each citation as a line of JSON as soon as it is ready
+        if (format == 'ndjson'):
+            return Response(
+                stream_with_context(stream_citations(session, url, lookup, request_id, verbose)),
+                mimetype='application/x-ndjson'
+            )
 
-        # Save Request     
-        r = Request(ip_address=request.remote_addr, request_type='post-url', request_url=url_string, domain_id=domain.id, user_agent=request.headers.get('User-Agent') )
-        
-        session.add(r)
-        session.commit()
+        # Get all citations on this page:
+        # unchanged quotes are returned from the database without recomputing
+        citations = url.citations(lookup=lookup)
 
-        url = URL(url_string)
+        # Save all new citations to the database in one transaction
+        save_citation_results(session, citations, request_id)
 
-        # Get all citations on this page
-        citations = url.citations()
         for n, citation in enumerate(citations):
-            print(n, ": saving citation.")
-            c = Citation(citation)  # lookup citation
-            c.db_save()             # save citation to database
-
-            # Save JSON Context to file
-            quote_json = {}
-            quote_json['citing_quote'] = escape_json(c.data['citing_quote'])
-            quote_json['sha256'] = c.data['sha256']
-            quote_json['citing_url'] = c.data['citing_url']
-            quote_json['cited_url'] = c.data['cited_url']
-            quote_json['citing_context_before'] = escape_json(c.data['citing_context_before'])
-            quote_json['cited_context_before'] = escape_json(c.data['cited_context_before'])
-            quote_json['citing_context_after'] = escape_json(c.data['citing_context_after'])
-            quote_json['cited_context_after'] = escape_json(c.data['cited_context_after'])
-            quote_json['cited_quote'] = escape_json(c.data['cited_quote'])
-            quote_json['hashkey'] = c.data['hashkey']
-
-            # Setting up Json settings locally ..
-            json_file = json.dumps(quote_json)
-            json_filename = ''.join([c.data['sha256'], '.json'])
-            json_full_filepath = os.path.join(settings.JSON_FILE_PATH, json_filename)
-
-            # Setting up Json settings with Cloud"
-            shard = json_filename[:2]
-            remote_path= ''.join(["quote/sha256/0.4/", str(shard), "/", json_filename])
-            print("JSON Path: " + json_file)
-            print("Remote path: " + remote_path)
-
-            # Publish JSON to Cloud, save copy locally
-            publish_file(
-                '',
-                json_file,
-                json_full_filepath,
-                remote_path,
-                "application/json"
-            )
+            logger.debug("Publishing citation %s", n)
+            quote_json = Citation(citation).publish_json()
+            if verbose and citation.get('timings'):
+                quote_json['timings'] = citation['timings']
 
             if (format == 'list'):
                 saved_citations.append(quote_json)
             else:
                 # Output simple summary:
-                saved_citations[c.data['sha256']] = c.data['citing_quote']
-                print(c.data['sha256'], ' ', c.data['hashkey'], ' ', c.data['citing_quote'])
-
-            print("File Uploaded")
+                saved_citations[citation['sha256']] = citation['citing_quote']
 
     return jsonify(saved_citations)
 
+
+def stream_citations(session, url, lookup, request_id, verbose=False):
+    """ format=ndjson: yield one line of JSON per citation, in the order
+        they are computed.  Citations are saved in batches of
+        settings.STREAM_SAVE_BATCH_SIZE, so memory use doesn't grow with
+        the number of quotes on the page.
+        Citations already published are saved even if the client
+        disconnects.  The headers are sent before the worker pool is used,
+        so a busy pool ends the stream with a line of JSON: {"error": ..}
+    """
+    batch = []
+    try:
+        for n, citation in url.iter_citations(lookup=lookup):
+            quote_json = Citation(citation).publish_json()
+            batch.append(citation)
+            if verbose and citation.get('timings'):
+                quote_json['timings'] = citation['timings']
+            yield json.dumps(quote_json) + "\n"
+
+            if len(batch) >= settings.STREAM_SAVE_BATCH_SIZE:
+                save_citation_results(session, batch, request_id)
+                batch = []
+
+    except worker_pool.WorkerPoolBusy:
+        logger.warning("Worker pool busy: stream of %s ended early", url.url)
+        yield json.dumps({'error': "Server busy: retry later"}) + "\n"
+
+    finally:
+        save_citation_results(session, batch, request_id)
+
+
+@app.route('/v' + WEBSERVICE_VERSION + '/url/batch', methods=['POST'])
+def post_url_batch():
+    """
+        Submit many citing urls at once.  Cited sources shared by the pages
+        are only downloaded once.  Returns a job id: poll the status_url
+        for the progress of each url.
+
+        USAGE: POST /v0.4/url/batch
+               JSON: {"urls": ["https://www.example.com/post-1", ..]}
+               or form field 'urls': one url per line
+    """
+    if request.is_json:
+        urls = (request.get_json(silent=True) or {}).get('urls', [])
+    else:
+        urls = request.form.get('urls', '').split()
+
+    urls = [url.strip() for url in urls if url.strip()]
+    invalid = [url for url in urls if not parse.urlparse(url).scheme]
+    if invalid:
+        return jsonify({'error': "Invalid urls: " + ', '.join(invalid[:10])}), 400
+
+    request_id = request_log.log(
+        ip_address=request.remote_addr,
+        request_type='post-url-batch',
+        request_url=request.url,
+        user_agent=request.headers.get('User-Agent', '')
+    )
+    try:
+        job_id = batch.submit(urls, request_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': '/v' + WEBSERVICE_VERSION + '/url/batch/' + job_id,
+    }), 202
+
+
+@app.route('/v' + WEBSERVICE_VERSION + '/url/batch/<job_id>', methods=['GET'])
+def url_batch_status(job_id):
+    """ Progress of a batch job: status of each url, and sources fetched """
+    job_status = batch.status(Session(), job_id)
+    if job_status is None:
+        return jsonify({'error': "Unknown job: " + job_id}), 404
+    return jsonify(job_status)
+
+
 @app.route('/url/encoding', methods=['GET', 'POST'])
 @app.route('/v' + WEBSERVICE_VERSION + '/url/encoding', methods=['GET'])
+@cached_response
 def url_encoding():
 
     citing_url = request.args.get('url', '')
-    url = URL(citing_url)
-    #print(url.doc().encoding_lookup())
-    return jsonify({'encoding': url.doc().encoding_lookup()})
+    doc = URL(citing_url).doc()
+    encoding = doc.encoding_lookup()
+    if doc.fetch_failed():
+        dont_cache()
+    return jsonify({'encoding': encoding})
 
 @app.route('/url/hashkeys', methods=['GET', 'POST'])
 @app.route('/v' + WEBSERVICE_VERSION + '/url/hashkeys', methods=['GET'])
@@ -223,11 +438,14 @@ def quote_hashkeys():
     return hash_text
 
 @app.route('/v' + WEBSERVICE_VERSION + '/url/canonical-url', methods=['GET'])
+@cached_response
 def canonical_url():
     # Lookup the Canonical URL of a page
     url = request.args.get('url', '')
     http = urllib3.PoolManager()
     r = http.request('GET', url)
+    if r.status >= 400:
+        dont_cache()
     html = r.data
     canonical_url = Canonical_URL(html, url)
     return  jsonify({url : canonical_url.citeit_url()})
@@ -235,6 +453,7 @@ def canonical_url():
 
 @app.route('/url/text-version', methods=['GET'])
 @app.route('/v' + WEBSERVICE_VERSION + '/url/text-version', methods=['GET'])
+@cached_response
 def document_text_version():
     url = request.args.get('url', '')
     line_separator = request.args.get('line_separator', '')
@@ -248,18 +467,117 @@ def document_text_version():
 
     response = app.make_response(d.text())
     response.mimetype = "text"
+    if d.fetch_failed():
+        dont_cache()
     return response
 
 
 @app.route('/v' + WEBSERVICE_VERSION + '/url/meta-data', methods=['GET'])
+@cached_response
 def document_meta_data():
     url = request.args.get('url', '')
     verbose_view = request.args.get('verbose', True)
     d = Document(url)
     document_data = d.data(verbose_view=verbose_view)
+    if d.fetch_failed():
+        dont_cache()
     return  jsonify(document_data)
 
 
+
+@app.route('/v' + WEBSERVICE_VERSION + '/url/posts-citing', methods=['GET'])
+def url_posts_citing():
+    """
+        Posts that cite this url, newest first
+        USAGE: /v0.4/url/posts-citing?url=https://www.citeit.net/&search_type=domain-subdomains
+        Parameters: url, search_type (url, domain, domain-subdomains),
+                    citation_terms, context_terms, document_terms,
+                    start_date, end_date, max_results, after (the 'next' value of the previous page)
+    """
+    return url_query('posts-citing', posts_citing, search_type=True)
+
+
+@app.route('/v' + WEBSERVICE_VERSION + '/url/posts-cited-by', methods=['GET'])
+def url_posts_cited_by():
+    """
+        Posts cited by this url, newest first:  same parameters as posts-citing
+    """
+    return url_query('posts-cited-by', posts_cited_by, search_type=True)
+
+
+@app.route('/v' + WEBSERVICE_VERSION + '/url/archives', methods=['GET'])
+def url_archives():
+    """
+        Stored versions of this url, newest first
+        Parameters: url, start_date, end_date, max_results, after
+    """
+    return url_query('archives-of-url', archives_of_url)
+
+
+@app.route('/v' + WEBSERVICE_VERSION + '/search', methods=['GET'])
+def citation_search():
+    """
+        Citations matching the search terms, best match first
+        USAGE: /v0.4/search?citation_terms=free+speech
+        Parameters: citation_terms (the quotes), context_terms (text around the quotes),
+                    document_terms (text of the citing or cited page), max_results
+    """
+    request_log.log(
+        ip_address=request.remote_addr,
+        request_type='search',
+        request_url=request.url,
+        user_agent=request.headers.get('User-Agent', '')
+    )
+
+    try:
+        results = search_citations(
+            Session(),
+            citation_terms=request.args.get('citation_terms'),
+            context_terms=request.args.get('context_terms'),
+            document_terms=request.args.get('document_terms'),
+            max_results=request.args.get('max_results'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(results)
+
+
+def url_query(request_type, query_function, search_type=False):
+    url_string = request.args.get('url', '')
+    if not parse.urlparse(url_string).scheme:
+        return jsonify({'error': "Specify a valid URL of the form: http://example.com/page_name"}), 400
+
+    session = Session()
+    request_log.log(
+        ip_address=request.remote_addr,
+        request_type=request_type,
+        request_url=url_string,
+        user_agent=request.headers.get('User-Agent', '')
+    )
+
+    options = {}
+    if search_type:
+        options['search_type'] = request.args.get('search_type', 'url')
+        for field in ['citation_terms', 'context_terms', 'document_terms']:
+            options[field] = request.args.get(field)
+
+    try:
+        results = query_function(
+            session,
+            url_string,
+            start_date=parse_date(request.args.get('start_date')),
+            end_date=parse_date(request.args.get('end_date')),
+            max_results=request.args.get('max_results'),
+            after=request.args.get('after'),
+            **options
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(results)
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=80, debug=True)
 
@@ -0,0 +1,274 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from lib.citeit_quote_context.url import URL
+from lib.citeit_quote_context.url import prefetch_document
+from lib.citeit_quote_context.url import load_numbered_quote_data
+from lib.citeit_quote_context.url import join_texts
+from lib.citeit_quote_context.misc.timing import record_quote_timings
+from citation import Citation
+from database import session_scope
+from models import BatchJob, BatchJobUrl
+from persistence import stored_citations, save_citation_results
+from structured_logging import set_correlation_id
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import os
+import socket
+import uuid
+import worker_pool
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Batch submission of many citing urls (sitemap imports, migrations)
+
+    Posts on the same site tend to quote the same sources, so a job is
+    processed as a whole rather than page by page:
+
+        1. fetch each citing page and split its citations into stored
+           ones (returned as-is) and ones to compute
+        2. download each distinct cited url once, across all pages
+        3. compute every remaining citation in the worker pool
+           (worker_pool.py); a page is saved as soon as its last
+           citation is done
+
+    A citation that fails marks its page as failed: the other pages of
+    the job carry on.
+
+    Progress is saved in the batch_job and batch_job_url tables, so any
+    worker process can report on a job.  Jobs run in a background thread
+    of the process that accepted them, at most BATCH_MAX_RUNNING at once.
+    When that process exits with jobs left (a recycled server worker),
+    recover_jobs() marks them as failed.
+"""
+
+executor = ThreadPoolExecutor(max_workers=settings.BATCH_MAX_RUNNING, thread_name_prefix='batch')
+
+
+def submit(urls, request_id=None):
+    """ Queue a batch job.  Returns the job id """
+    job_id = create(urls, request_id)
+    executor.submit(run, job_id, urls, request_id)
+    return job_id
+
+
+def create(urls, request_id=None):
+    """ Save a new job and its urls, ready for run().  Returns the job id """
+    if not urls:
+        raise ValueError("Specify at least one url")
+    if len(urls) > settings.BATCH_MAX_URLS:
+        raise ValueError("A batch is limited to %s urls" % settings.BATCH_MAX_URLS)
+
+    job_id = uuid.uuid4().hex
+    with session_scope() as session:
+        session.add(BatchJob(id=job_id, request_id=request_id, status='queued',
+                             url_count=len(urls), worker=worker_name()))
+        session.add_all([
+            BatchJobUrl(job_id=job_id, position=n, url=url, status='queued')
+            for (n, url) in enumerate(urls)
+        ])
+    return job_id
+
+
+def status(session, job_id):
+    """ Progress of a job, or None if there is no such job """
+    job = session.query(BatchJob).get(job_id)
+    if job is None:
+        return None
+
+    pages = session.query(BatchJobUrl) \
+        .filter(BatchJobUrl.job_id == job_id) \
+        .order_by(BatchJobUrl.position)
+
+    return {
+        'job_id': job.id,
+        'status': job.status.code,
+        'create_date': job.create_date.isoformat(),
+        'finish_date': job.finish_date.isoformat() if job.finish_date else None,
+        'sources': {'distinct': job.source_count, 'fetched': job.sources_fetched},
+        'urls': [{
+            'url': page.url,
+            'status': page.status.code,
+            'citations': page.citation_count,
+            'error': page.error,
+        } for page in pages],
+    }
+
+
+def run(job_id, urls, request_id=None):
+    """ Process a job: see the module notes above """
+    set_correlation_id(job_id)      # log messages of this job carry its id
+    try:
+        with session_scope() as session:
+            update_job(session, job_id, status='running')
+            process(session, job_id, urls, request_id)
+            update_job(session, job_id, status='done', finish_date=datetime.utcnow())
+    except Exception:
+        logger.exception("Batch job %s failed", job_id)
+        with session_scope() as session:
+            fail_jobs(session, [job_id], "Batch job failed")
+
+
+def process(session, job_id, urls, request_id):
+    lookup = lambda sha256_list: stored_citations(session, sha256_list)
+
+    # 1. Citing pages
+    results = {}        # position of the url -> {position on page: quote data}
+    remaining = {}      # position of the url -> number of citations still being computed
+    tasks = []          # ((url position, position on page), quote keys)
+
+    for (page, url) in enumerate(urls):
+        try:
+            ready, recompute = URL(url).prepare_citations(lookup)
+        except Exception as e:
+            logger.exception("Batch job %s: unable to load %s", job_id, url)
+            update_page(session, job_id, page, status='error', error=str(e)[:2048])
+            continue
+
+        results[page] = dict(ready)
+        remaining[page] = len(recompute)
+        tasks.extend(((page, n), quote) for (n, quote) in recompute)
+        if not recompute:
+            finish_page(session, job_id, page, results.pop(page), request_id)
+        else:
+            update_page(session, job_id, page, status='running')
+
+    # 2. Each distinct cited source, once
+    sources = sorted(set(quote['cited_url'] for (key, quote) in tasks))
+    update_job(session, job_id, source_count=len(sources))
+
+    # A job waits for room in the pool rather than failing: see worker_pool.py
+    fetches = worker_pool.imap_unordered(fetch_source, sources, wait=None, batch=True)
+    for (fetched, url) in enumerate(fetches, 1):
+        if fetched % settings.BATCH_PROGRESS_INTERVAL == 0 or fetched == len(sources):
+            update_job(session, job_id, sources_fetched=fetched)
+
+    # 3. Every citation of every page
+    for ((page, n), quote_data, error) in worker_pool.imap_unordered(compute_quote, tasks, wait=None, batch=True):
+        if page not in results:         # the page has already failed
+            continue
+        if error:
+            del results[page]
+            update_page(session, job_id, page, status='error', error=error[:2048])
+            continue
+
+        record_quote_timings(quote_data)
+        results[page][n] = join_texts(quote_data)
+        remaining[page] = remaining[page] - 1
+        if remaining[page] == 0:
+            finish_page(session, job_id, page, results.pop(page), request_id)
+
+
+def fetch_source(url):
+    """ Runs in the pool: a source that can't be downloaded fails the
+        citations that quote it, not the whole job
+    """
+    try:
+        return prefetch_document(url)
+    except Exception:
+        logger.exception("Unable to fetch %s", url)
+        return url
+
+
+def compute_quote(task):
+    """ Runs in the pool: returns (key, quote data, error message or None) """
+    try:
+        key, quote_data = load_numbered_quote_data(task)
+        return key, quote_data, None
+    except Exception as e:
+        logger.exception("Unable to compute quote %s", task[0])
+        return task[0], None, str(e) or e.__class__.__name__
+
+
+def finish_page(session, job_id, page, page_results, request_id):
+    citations = [page_results[n] for n in sorted(page_results.keys())]
+    try:
+        save_citation_results(session, citations, request_id)
+        for citation in citations:
+            Citation(citation).publish_json()
+    except Exception as e:
+        logger.exception("Batch job %s: unable to save page %s", job_id, page)
+        session.rollback()
+        update_page(session, job_id, page, status='error', error=str(e)[:2048])
+        return
+
+    update_page(session, job_id, page, status='done', citation_count=len(citations))
+
+
+def recover_jobs():
+    """ Mark as failed the jobs of this host whose process has exited
+        (a recycled server worker, an interrupted crawl), which would
+        otherwise stay queued or running.  Called when a server worker
+        starts (gunicorn.conf.py).  Returns the ids of the jobs failed
+    """
+    hostname = socket.gethostname()
+    with session_scope() as session:
+        jobs = session.query(BatchJob.id, BatchJob.worker) \
+            .filter(BatchJob.status.in_(['queued', 'running']))
+
+        orphans = []
+        for (job_id, worker) in jobs:
+            host, _, pid = (worker or '').rpartition(':')
+            if host == hostname and pid.isdigit() and not process_running(int(pid)):
+                orphans.append(job_id)
+
+        if orphans:
+            logger.warning("Failing %s batch jobs left by exited processes", len(orphans))
+            fail_jobs(session, orphans, "Interrupted: the process running the job exited")
+    return orphans
+
+
+def fail_jobs(session, job_ids, error):
+    """ Mark jobs as failed, with the pages they hadn't finished """
+    session.query(BatchJobUrl) \
+        .filter(BatchJobUrl.job_id.in_(job_ids), BatchJobUrl.status.in_(['queued', 'running'])) \
+        .update({'status': 'error', 'error': error}, synchronize_session=False)
+    session.query(BatchJob) \
+        .filter(BatchJob.id.in_(job_ids)) \
+        .update({'status': 'error', 'finish_date': datetime.utcnow()}, synchronize_session=False)
+    session.commit()
+
+
+def worker_name():
+    """ The process running a job: host:pid """
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def process_running(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:     # another user's process
+        return True
+    return True
+
+
+def update_job(session, job_id, **values):
+    session.query(BatchJob).filter(BatchJob.id == job_id).update(values, synchronize_session=False)
+    session.commit()
+
+
+def update_page(session, job_id, page, **values):
+    session.query(BatchJobUrl) \
+        .filter(BatchJobUrl.job_id == job_id, BatchJobUrl.position == page) \
+        .update(values, synchronize_session=False)
+    session.commit()
@@ -0,0 +1,119 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import pickle
+
+import pytest
+
+import fixture_site
+from lib.citeit_quote_context import text_store
+from lib.citeit_quote_context.url import TEXT_FIELDS
+from lib.citeit_quote_context.url import URL
+from lib.citeit_quote_context.url import join_texts
+
+# A long citing page: 1 MB of text, quoting 50 sources
+PAGE_LENGTH = 1000000
+PAGE_QUOTES = 50
+
+
+def bench_url_citations(benchmark, site, offline):
+    """ Citations of the corpus essay: 4 quotes of 3 sources
+        (html, pdf text and transcript), one of them cited twice
+    """
+    url = site + '/corpus/essay.html'
+    benchmark.group = 'citations'
+
+    citations = benchmark.pedantic(
+        lambda page: page.citations(),
+        setup=lambda: ((URL(url),), {}),
+        rounds=5
+    )
+    benchmark.extra_info['citations'] = len(citations)
+    assert len(citations) == 4
+
+
+def bench_post_url(benchmark, new_post, offline):
+    """ End to end: GET /v0.4/url/ for a new post, each time
+        (download, quote context, save to the database, publish the JSON)
+    """
+    from app import app
+    client = app.test_client()
+    benchmark.group = 'citations'
+
+    response = benchmark.pedantic(
+        lambda url: client.get('/v0.4/url/', query_string={'url': url, 'format': 'list'}),
+        setup=lambda: ((new_post(),), {}),
+        rounds=5
+    )
+    benchmark.extra_info['citations'] = fixture_site.CITATIONS
+    assert response.status_code == 200
+    assert len(response.get_json()) == fixture_site.CITATIONS
+
+
+@pytest.mark.parametrize('citing_text', ['shared', 'copied'])
+def bench_citation_tasks(benchmark, corpus, offline, monkeypatch, citing_text):
+    """ Pickling the tasks of a long page for the pool: the citing text and
+        html are passed by key (text_store.py), rather than copied into
+        each task as they were before
+    """
+    tasks = long_page_tasks(corpus, monkeypatch)
+    if citing_text == 'copied':
+        text, raw = str(tasks[0][1]['citing_text']), str(tasks[0][1]['citing_raw'])
+        tasks = [(n, dict(quote, citing_text=text, citing_raw=raw)) for (n, quote) in tasks]
+    benchmark.group = 'citation tasks'
+
+    # The pool pickles each task on its own
+    pickled = benchmark(lambda: [pickle.dumps(task) for task in tasks])
+    benchmark.extra_info['bytes'] = sum(len(task) for task in pickled)
+    assert len(tasks) == PAGE_QUOTES
+
+
+@pytest.mark.parametrize('texts', ['shared', 'copied'])
+def bench_citation_results(benchmark, corpus, offline, monkeypatch, texts):
+    """ The results of the same tasks, back to the parent: pickled by the
+        worker, unpickled and joined (url.join_texts()) by the parent.
+        The texts are returned by key (load_quote_data()), rather than
+        copied into each result as they were before
+    """
+    tasks = long_page_tasks(corpus, monkeypatch)
+    cited_text = text_store.store(corpus('river-report.txt') * 20)
+    results = [
+        (n, dict(quote, cited_text=cited_text, cited_raw=cited_text))
+        for (n, quote) in tasks
+    ]
+    if texts == 'copied':
+        results = [
+            (n, dict(quote_data, **{field: str(quote_data[field]) for field in TEXT_FIELDS}))
+            for (n, quote_data) in results
+        ]
+    benchmark.group = 'citation results'
+
+    def send():
+        pickled = [pickle.dumps(result) for result in results]
+        return pickled, [join_texts(pickle.loads(result)[1]) for result in pickled]
+
+    pickled, joined = benchmark(send)
+    benchmark.extra_info['bytes'] = sum(len(result) for result in pickled)
+    assert joined[-1]['cited_text'] == str(cited_text)
+
+
+def long_page_tasks(corpus, monkeypatch):
+    """ Tasks of a long citing page: PAGE_QUOTES quotes of a PAGE_LENGTH page """
+    filler = corpus('river-report.txt')
+    paragraphs = (filler * (PAGE_LENGTH // len(filler) + 1))[:PAGE_LENGTH].split('. ')
+    quotes = ''.join(
+        '<blockquote cite="http://127.0.0.1/source/%s">%s</blockquote>' % (n, paragraphs[n * 10])
+        for n in range(PAGE_QUOTES)
+    )
+    html = '<html><body><p>%s</p>%s</body></html>' % ('. '.join(paragraphs), quotes)
+
+    monkeypatch.setattr(URL, 'raw', lambda self: html)
+    monkeypatch.setattr(URL, 'text', lambda self: html[12:-14])
+    monkeypatch.setattr(URL, 'doc_type', lambda self: 'html')
+    return list(enumerate(URL('http://127.0.0.1/long-post').citations_list_dict()))
@@ -0,0 +1,29 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import pytest
+
+from lib.citeit_quote_context.document import Document
+
+# html article, text of a long pdf, video transcript
+SOURCES = ('declaration.html', 'river-report.txt', 'gettysburg-transcript.txt')
+
+
+@pytest.mark.parametrize('filename', SOURCES)
+def bench_document_text(benchmark, site, offline, filename):
+    """ Download (from the local site) and text conversion of a new Document """
+    url = '%s/corpus/%s' % (site, filename)
+    benchmark.group = 'document text'
+
+    text = benchmark.pedantic(
+        lambda document: document.text(),
+        setup=lambda: ((Document(url),), {}),
+        rounds=20
+    )
+    assert len(text) > 1000
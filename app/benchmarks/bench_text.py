@@ -0,0 +1,50 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import pytest
+
+from lib.citeit_quote_context.quote_context import QuoteContext
+from lib.citeit_quote_context.text_convert import escape_text
+from lib.citeit_quote_context.canonical_url import Canonical_URL
+
+# Characters of text searched for a quote
+LOCATE_LENGTHS = (10000, 50000, 250000)
+
+QUOTE = (
+    "A Prince whose character is thus marked by every act which may define "
+    "a Tyrant, is unfit to be the ruler of a free people."
+)
+
+
+def text_of_length(filler, length, quote):
+    """ filler repeated to length characters, quote inserted 3/4 of the way through """
+    text = (filler * (length // len(filler) + 1))[:length]
+    position = length * 3 // 4
+    return text[:position] + ' ' + quote + ' ' + text[position:]
+
+
+@pytest.mark.parametrize('length', LOCATE_LENGTHS)
+def bench_quote_context_locate(benchmark, corpus, length):
+    context = QuoteContext(QUOTE, text_of_length(corpus('river-report.txt'), length, QUOTE))
+    benchmark.group = 'quote_context locate'
+    benchmark.extra_info['text_length'] = context.text_length()
+
+    position = benchmark(context.quote_start_position)
+    assert abs(position - length * 3 // 4) < 10
+
+
+def bench_escape_text(benchmark, corpus):
+    text = corpus('river-report.txt')
+    assert benchmark(escape_text, text)
+
+
+def bench_canonical_url(benchmark, corpus):
+    html = corpus('declaration.html').replace('{site}', 'http://127.0.0.1')
+    citeit_url = benchmark(lambda: Canonical_URL(html, 'http://127.0.0.1/declaration').citeit_url())
+    assert citeit_url == '127.0.0.1/corpus/declaration.html'
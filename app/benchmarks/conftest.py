@@ -0,0 +1,84 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+"""
+    Benchmarks of the citation lookup, run with pytest-benchmark:
+
+        cd app/
+        python -m pytest benchmarks
+        python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:20%
+
+    Each run is saved to app/.benchmarks/; --benchmark-compare compares
+    with the last saved run (of the same machine and Python).
+
+    Pages and sources are served by a local fixture site
+    (benchmarks/fixture_site.py, benchmarks/corpus/), so the results
+    don't depend on the network.  Nothing is uploaded or archived.
+"""
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Modules import each other relative to app/: (import settings, from lib.citeit_quote_context ..)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(__file__))
+
+os.environ.setdefault(
+    'SQLALCHEMY_DATABASE_URI',
+    'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'citeit-benchmark.db')
+)
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+os.environ.setdefault('METRICS_ENABLED', '0')
+
+import fixture_site     # noqa: E402  (after sys.path)
+
+_names = itertools.count()
+
+
+@pytest.fixture(scope='session')
+def site():
+    """ Url of the local fixture site; sources are served without delay """
+    fixture_site.SOURCE_LATENCY = 0
+    server = fixture_site.start()
+    yield 'http://%s:%s' % server.server_address
+    server.shutdown()
+
+
+@pytest.fixture
+def new_post(site):
+    """ new_post(): url of a fixture post (and sources) no cache has seen """
+    def url():
+        return '%s/post/bench%s-%s' % (site, os.getpid(), next(_names))
+    return url
+
+
+@pytest.fixture
+def corpus():
+    """ corpus('essay.html'): text of a benchmarks/corpus/ file """
+    return fixture_site.corpus
+
+
+@pytest.fixture
+def offline(monkeypatch, tmpdir):
+    """ Keep the published files local: no uploads to S3.
+        Documents write their cache directories relative to the working
+        directory: use a temporary one.
+    """
+    import settings
+    from lib.citeit_quote_context.misc import utils
+
+    monkeypatch.setattr(settings, 'SAVE_DOWNLOADS_TO_FILE', False)
+    monkeypatch.setattr(utils, 'save_file_to_cloud', lambda *args, **kwargs: None)
+    monkeypatch.chdir(tmpdir)
@@ -0,0 +1,126 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import os
+import threading
+import time
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    A local site of citing posts and cited sources, so that benchmarks
+    don't depend on (or load) real websites:
+
+        /post/<name>:           a post with CITATIONS blockquotes,
+                                each citing /source/<name>/<n>
+        /source/<name>/<n>:     a source containing the quote,
+                                served after SOURCE_LATENCY seconds
+        /corpus/<file>:         a file of benchmarks/corpus/: representative
+                                pages and sources ({site} is replaced by
+                                the url of this site)
+
+    Every post and source name is valid, so each request can use a new url
+    and miss the webservice's caches.
+"""
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+CORPUS_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.txt': 'text/plain; charset=utf-8',
+}
+
+CITATIONS = 5
+SOURCE_LATENCY = 0.05
+PARAGRAPHS = 40
+
+FILLER = (
+    "The committee met on a Tuesday to consider the proposal in detail. "
+    "Members raised questions about the budget, the schedule and the "
+    "consequences for the towns along the river. "
+)
+
+
+def quote(name, n):
+    return "Quotation %s of %s: the river must remain open to everyone who lives along it." % (n, name)
+
+
+def post_html(host, name):
+    quotes = ''.join(
+        '<p>%s</p><blockquote cite="http://%s/source/%s/%s">%s</blockquote>'
+        % (FILLER, host, name, n, quote(name, n))
+        for n in range(CITATIONS)
+    )
+    return '<html><head><title>Post %s</title></head><body>%s</body></html>' % (name, quotes)
+
+
+def source_html(name, n):
+    paragraphs = ['<p>%s</p>' % (FILLER * 3)] * PARAGRAPHS
+    paragraphs.insert(PARAGRAPHS // 2, '<p>%s %s %s</p>' % (FILLER, quote(name, n), FILLER))
+    return '<html><head><title>Source %s</title></head><body>%s</body></html>' % (name, ''.join(paragraphs))
+
+
+def corpus(filename):
+    with open(os.path.join(CORPUS_DIR, filename), 'r', encoding='utf-8') as corpus_file:
+        return corpus_file.read()
+
+
+def corpus_type(filename):
+    """ Content-Type of a corpus file, None if there is no such file """
+    if filename not in os.listdir(CORPUS_DIR):
+        return None
+    return CORPUS_TYPES.get(os.path.splitext(filename)[1])
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        content_type = 'text/html; charset=utf-8'
+        if parts[0] == 'post' and len(parts) == 2:
+            body = post_html(self.headers.get('Host'), parts[1])
+        elif parts[0] == 'source' and len(parts) == 3:
+            time.sleep(SOURCE_LATENCY)
+            body = source_html(parts[1], parts[2])
+        elif parts[0] == 'corpus' and len(parts) == 2 and corpus_type(parts[1]):
+            body = corpus(parts[1]).replace('{site}', 'http://' + self.headers.get('Host'))
+            content_type = corpus_type(parts[1])
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start(port=0):
+    """ Serve the fixture site in a background thread.
+        Returns the server: server.server_address, server.shutdown()
+    """
+    server = FixtureServer(('127.0.0.1', port), FixtureHandler)
+    thread = threading.Thread(target=server.serve_forever, name='fixture-site', daemon=True)
+    thread.start()
+    return server
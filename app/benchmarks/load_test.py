@@ -0,0 +1,164 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import argparse
+import itertools
+import os
+import signal
+import subprocess
+import sys
+import time
+import requests
+import fixture_site
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Load test of the production server, used to pick the defaults
+    of gunicorn.conf.py:
+
+        cd app/
+        python benchmarks/load_test.py --workers 2,4,8 --threads 1,4,8
+
+    For each combination of workers and threads, gunicorn is started
+    on a local port and sent --requests requests, --concurrency at once.
+    Each request asks for a new post of the local fixture site
+    (benchmarks/fixture_site.py), so no request is served from a cache.
+    Rate limits are turned off for the server under test.
+
+    --path /v0.4/url/text-version    one download and text conversion
+    --path /v0.4/url/                the post and each cited source
+                                     (saves to the configured database)
+"""
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare gunicorn worker and thread counts")
+    parser.add_argument('--workers', default='2,4', help="comma-separated worker counts")
+    parser.add_argument('--threads', default='1,4,8', help="comma-separated thread counts")
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--path', default='/v0.4/url/text-version')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=fixture_site.SOURCE_LATENCY,
+                        help="seconds before the fixture site answers for a source")
+    args = parser.parse_args()
+
+    fixture_site.SOURCE_LATENCY = args.latency
+    site = fixture_site.start()
+    site_url = 'http://%s:%s' % site.server_address
+
+    print("%7s %7s %9s %8s %8s %8s %7s" % ('workers', 'threads', 'req/s', 'p50', 'p95', 'p99', 'errors'))
+    run_ids = itertools.count()
+    for workers in parse_counts(args.workers):
+        for threads in parse_counts(args.threads):
+            server = start_server(workers, threads, args.port)
+            try:
+                result = run(
+                    'http://127.0.0.1:%s%s' % (args.port, args.path),
+                    '%s/post/run%s-' % (site_url, next(run_ids)),
+                    args.requests, args.concurrency
+                )
+            finally:
+                stop_server(server)
+
+            print("%7s %7s %9.1f %7.0fms %7.0fms %7.0fms %7s" % (
+                workers, threads, result['throughput'],
+                result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000,
+                result['errors']
+            ))
+
+    site.shutdown()
+
+
+def parse_counts(counts):
+    return [int(count) for count in counts.split(',') if count]
+
+
+def start_server(workers, threads, port):
+    env = dict(
+        os.environ,
+        GUNICORN_BIND='127.0.0.1:%s' % port,
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        GUNICORN_ACCESS_LOG='/dev/null',
+        RATE_LIMIT_ENABLED='0',
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'wsgi:application'],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            requests.get('http://127.0.0.1:%s/about' % port, timeout=1)
+            return server
+        except requests.exceptions.ConnectionError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+
+    stop_server(server)
+    raise RuntimeError("gunicorn did not start: run it in app/ to see the error")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def run(endpoint, post_url, count, concurrency):
+    """ Send count requests, each for a new post.
+        Returns throughput (requests/second), latency percentiles and errors
+    """
+    def timed_request(n):
+        start = time.time()
+        try:
+            r = requests.get(endpoint + '?url=' + quote(post_url + str(n), safe=''), timeout=600)
+            ok = r.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        return time.time() - start, ok
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_request, range(count)))
+    elapsed = time.time() - start
+
+    latencies = sorted(latency for (latency, ok) in results)
+    return {
+        'throughput': count / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'errors': len([ok for (latency, ok) in results if not ok]),
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from collections import OrderedDict
+import threading
+import time
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+class TTLCache:
+    """ In-process cache with a maximum size and a time-to-live.
+        The least recently used entry is dropped when the cache is full;
+        entries older than ttl seconds are treated as missing.
+        Safe to share between the threads of a worker process.
+
+        Usage:
+            cache = TTLCache(maxsize=10000, ttl=3600)
+            cache.set('www.citeit.net', 42)
+            cache.get('www.citeit.net')  # 42
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key: (expires, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses = self.misses + 1
+                return default
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.misses = self.misses + 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
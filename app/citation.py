@@ -7,7 +7,13 @@
 # The code for this server library is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license
 
+from database import session_scope
+from persistence import save_citations
+from lib.citeit_quote_context.misc.utils import publish_file
+from lib.citeit_quote_context.misc.utils import escape_json
+from lib.citeit_quote_context.misc.timing import timed
 import json
+import logging
 import boto3
 import settings
 import os
@@ -18,6 +24,8 @@ __copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
 __license__ = "MIT"
 __version__ = "0.4"
 
+logger = logging.getLogger(__name__)
+
 
 class Citation:
     """ Filter list of citation data
@@ -37,110 +45,69 @@ class Citation:
         self.json_upload(debug)
         self.db_save(debug)
 
-    def db_save(self, debug=False):
+    def db_save(self, debug=False, session=None):
         # Save Quote data to database, using SQLAlchemy
-        # Credit: https://gist.github.com/malexer/0647b208b2f1c48ec93e1bd157dc67c0
-
-        """
-
-        citation = Citation(id=session.data.sha256)
-        merged = session.merge(citation)
-        session.flush()
-
-
-        def update_citation(data, extended_data, tags)
-
-            citation_exists = db.session.query(Citations.id).filter_by(sha256=self.data.sha256).scalar() is not None
-
-            if citation_exists:
-                stmt = update(Citation).where(sha256 == self.data.sha256).\
-                       values(
-                            citing_url = self.data.citing_url
-                            citing_quote = self.data.citing_quote
-
-                            // can we pass a dictionary to an update?
-                       )
-            else:
-                citations.insert().values(name="some name")  # can we pass dictionary?
-
-
-            update_extended_data(extended_data)
-            update_citation_tag(citation_id, citation_tag_id)
-
-
-
-        def update_extended_data(extended_data)
-            pass
-
-
-        def update_citation_tag(citation_id, citation_tag_id)
-            pass
-
+        # To save all the citations on a page at once: persistence.save_citations()
+        if session is None:
+            with session_scope() as session:
+                save_citations(session, [self.data], self.data.get('request_id', 0))
+        else:
+            save_citations(session, [self.data], self.data.get('request_id', 0))
 
+        if debug:
+            logger.debug("Saved to db: %s", self.data['sha256'])
 
-        class Citation(Base):
-            __tablename__ = 'citation'
-
-            id = Column(BigInteger, primary_key=True)
-            sha256 = Column(String)
-            citing_url = Column(URLType)
-            citing_quote = Column(UnicodeText)
-            citing_context_before = Column(UnicodeText)
-            citing_context_after = Column(UnicodeText)
-            cited_url = Column(URLType)
-            cited_quote = Column(UnicodeText)
-            cited_context_before = Column(UnicodeText)
-            cited_context_after = Column(UnicodeText)
-            created = Column(DateTime)
-            updated = Column(DateTime)
-
-
-        class CitationTag(Base):
-            __tablename__ = 'citation_tag'
-            
-            id = Column(BigInteger, primary_key=True)            
-            citation_id = Column(BigInteger, primary_key=True)
-            citation_tag_id = Column(BigInteger, primary_key=True)
-            created = Column(DateTime)
-
-
-        class Tag(Base):
-            __tablename__ = 'tag'
-        
-            id = Column(BigInteger, primary_key=True)
-            tag = Column(Unicode)
-            created = Column(DateTime)
-
-
-        class Request(Base):
-            __tablename__ = 'request'
-
-            id = Column(BigInteger, primary_key=True)
-            request_url = Column(URLType)
-            request_type = Column(String)
-            created = Column(DateTime)
-            user_agent = Column(String)
-            ip_source = Column(IPAddressType)
-
-
-        class Document(Base):
-            __tablename__ = 'document'
-
-            id = Column(BigInteger, primary_key=True)
-            document_url = Column(URLType)
-            title = Column(Unicode)
-            body_html = Column(UnicodeText)
-            body_text = Column(UnicodeText)
-            content_type = Column(String)
-            encoding = Column(UnicodeText)
-            language = Column(UnicodeText)
-            created = Column(DateTime)
-            updated = Column(DateTime)
-
+    def publish_json(self):
+        """ Save JSON Context to file and upload it to the cloud
+            Returns the published fields
         """
+        # Not computed (the cited document couldn't be downloaded): nothing to publish
+        if self.data.get('error'):
+            return {
+                'sha256': self.data['sha256'],
+                'citing_quote': escape_json(self.data['citing_quote']),
+                'cited_url': self.data['cited_url'],
+                'error': self.data['error'],
+            }
 
-        if debug:
-            print("Stub: saving to db ..")
+        quote_json = {}
+        quote_json['citing_quote'] = escape_json(self.data['citing_quote'])
+        quote_json['sha256'] = self.data['sha256']
+        quote_json['citing_url'] = self.data['citing_url']
+        quote_json['cited_url'] = self.data['cited_url']
+        quote_json['citing_context_before'] = escape_json(self.data['citing_context_before'])
+        quote_json['cited_context_before'] = escape_json(self.data['cited_context_before'])
+        quote_json['citing_context_after'] = escape_json(self.data['citing_context_after'])
+        quote_json['cited_context_after'] = escape_json(self.data['cited_context_after'])
+        quote_json['cited_quote'] = escape_json(self.data['cited_quote'])
+        quote_json['hashkey'] = self.data['hashkey']
+        if 'cited_timestamp' in self.data:
+            quote_json['cited_timestamp'] = self.data['cited_timestamp']   # seconds into the video
+
+        # Stored citations were published when they were computed
+        if self.data.get('cached'):
+            return quote_json
+
+        # Setting up Json settings locally ..
+        json_file = json.dumps(quote_json)
+        json_filename = self.json_filename()
+        json_full_filepath = os.path.join(settings.JSON_FILE_PATH, json_filename)
+
+        # Setting up Json settings with Cloud"
+        shard = json_filename[:2]
+        remote_path= ''.join(["quote/sha256/0.4/", str(shard), "/", json_filename])
+        logger.debug("Publishing %s", remote_path)
+
+        # Publish JSON to Cloud, save copy locally
+        with timed('request.publish'):
+            publish_file(
+                '',
+                json_file,
+                json_full_filepath,
+                remote_path,
+                "application/json"
+            )
+        return quote_json
 
     def file_key(self) :
         json_filename = ''.join([self.data['sha256'], '.json'])
@@ -183,12 +150,11 @@ class Citation:
             json.dump(self.json_data(), outfile)
 
         if debug:
-            print("saving json locally")
-            print(local_filename)
+            logger.debug("Saved JSON locally: %s", local_filename)
 
     def json_upload(self, debug=False):
         # Upload json file to cloud
-        print("Saving JSON to Cloud ..")
+        logger.debug("Uploading JSON: %s", self.file_key())
 
         s3 = boto3.resource('s3')
         s3.meta.client.upload_file(
@@ -201,4 +167,4 @@ class Citation:
             }
         )
         if debug: # Output simple summary
-            print(self.data['sha256'], ' ', self.data['citing_quote'])
+            logger.debug("Uploaded %s", self.data['sha256'])
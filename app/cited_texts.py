@@ -0,0 +1,62 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from lib.citeit_quote_context.url import read_cited_text
+from lib.citeit_quote_context import text_store
+from database import session_scope
+from persistence import save_citations
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import worker_pool
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Citations of PDFs, saved once the whole PDF is read
+
+    A quote is located in a PDF page by page (quote_context.locate_in_pages()):
+    the request returns its context without reading the rest of the PDF,
+    and its cited_text is None (Quote.data()).  The cited document is saved
+    with its full text, so save_citation_results() hands these citations
+    to save_later(): the text is read in the worker pool, as a batch task,
+    in a background thread of this process.
+"""
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cited-text')
+
+
+def save_later(citations, request_id):
+    """ Read the full text of each cited document in the background,
+        then save the citations
+    """
+    # Copies: the caller may still be publishing the citations
+    return executor.submit(save, [dict(c) for c in citations], request_id)
+
+
+def save(citations, request_id):
+    """ Returns the list of sha256 keys saved """
+    urls = sorted(set(c['cited_url'] for c in citations))
+    try:
+        texts = dict(worker_pool.imap_unordered(read_cited_text, urls, wait=None, batch=True))
+        for citation in citations:
+            citation['cited_text'] = text_store.text(texts[citation['cited_url']])
+
+        with session_scope() as session:
+            return save_citations(session, citations, request_id)
+
+    except Exception:
+        logger.exception("Unable to save the citations of %s", ', '.join(urls))
+        return []
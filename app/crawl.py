@@ -0,0 +1,162 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from flask.cli import AppGroup
+from database import session_scope
+from feeds import discover_urls
+from datetime import datetime
+import batch
+import click
+import hashlib
+import json
+import os
+import time
+import worker_pool
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Backfill a whole site from its sitemap or RSS feed:
+
+        export FLASK_APP=app.py
+        flask citeit crawl https://www.example.com/sitemap.xml
+
+    The pages listed in the feed (see feeds.py) are processed in batches
+    of --batch-size pages, each run as a batch job (see batch.py): a
+    source cited by several pages is only downloaded once per batch.
+    --processes bounds the number of downloads at once and --delay
+    pauses between batches, to control the load on the sites crawled.
+
+    Progress is checkpointed to a JSON state file after each batch.
+    Running the same command again resumes the crawl: pages that are done
+    (or failed, unless --retry-failed) are skipped.
+"""
+
+crawl_cli = AppGroup('citeit', help="CiteIt maintenance commands")
+
+
+@crawl_cli.command('crawl')
+@click.argument('feed_url')
+@click.option('--state', 'state_path', default=None,
+              help="Checkpoint file (default: CRAWL_STATE_DIR/crawl-<hash of feed url>.json)")
+@click.option('--batch-size', default=settings.CRAWL_BATCH_SIZE, show_default=True,
+              help="Pages per batch job")
+@click.option('--processes', default=settings.NUM_DOWNLOAD_PROCESSES, show_default=True,
+              help="Documents downloaded at once")
+@click.option('--delay', default=settings.CRAWL_DELAY, show_default=True,
+              help="Seconds to wait between batches")
+@click.option('--limit', default=0, help="Stop after this many pages (0: no limit)")
+@click.option('--retry-failed', is_flag=True, help="Process pages that failed in an earlier run")
+def crawl_command(feed_url, state_path, batch_size, processes, delay, limit, retry_failed):
+    """ Look up the citations of every page in a sitemap or RSS/Atom feed """
+    state_path = state_path or default_state_path(feed_url)
+    state = load_state(state_path, feed_url)
+
+    click.echo("Reading %s" % feed_url)
+    pending = pending_urls(discover_urls(feed_url), state, retry_failed)
+    if limit:
+        pending = pending[:limit]
+    click.echo("%s pages to process, %s already done (state: %s)"
+               % (len(pending), len(state['done']), state_path))
+
+    worker_pool.start(processes)
+    crawl(pending, state, state_path, batch_size, delay, echo=click.echo)
+    click.echo("Done: %s pages, %s failed" % (len(state['done']), len(state['failed'])))
+
+
+def crawl(urls, state, state_path, batch_size, delay=0, echo=print):
+    """ Process urls in batches, saving the state after each batch """
+    batch_size = max(1, min(batch_size, settings.BATCH_MAX_URLS))
+
+    for start in range(0, len(urls), batch_size):
+        if start and delay:
+            time.sleep(delay)
+
+        urls_batch = urls[start:start + batch_size]
+        job_id = batch.create(urls_batch)
+        batch.run(job_id, urls_batch)
+
+        with session_scope() as session:
+            job = batch.status(session, job_id)
+        record_job(state, job)
+        save_state(state_path, state)
+
+        echo("%s/%s pages: job %s %s, %s sources" % (
+            min(start + batch_size, len(urls)), len(urls),
+            job['job_id'], job['status'], job['sources']['distinct']
+        ))
+
+    return state
+
+
+def record_job(state, job):
+    """ Pages that are done or failed are skipped on resume.  Pages of a
+        job that failed are marked as failed (see batch.fail_jobs), so
+        they aren't submitted again and again: use --retry-failed.
+    """
+    for page in job['urls']:
+        if page['status'] == 'done':
+            state['done'][page['url']] = page['citations']
+            state['failed'].pop(page['url'], None)
+        elif page['status'] == 'error':
+            state['failed'][page['url']] = page['error']
+    state['jobs'].append(job['job_id'])
+
+
+def pending_urls(urls, state, retry_failed=False):
+    skip = set(state['done'].keys())
+    if not retry_failed:
+        skip.update(state['failed'].keys())
+    return [url for url in urls if url not in skip]
+
+
+def default_state_path(feed_url):
+    name = hashlib.sha1(feed_url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(settings.CRAWL_STATE_DIR, 'crawl-%s.json' % name)
+
+
+def load_state(state_path, feed_url):
+    """ State of an earlier crawl of this feed, or a new state """
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as state_file:
+            state = json.load(state_file)
+        if state.get('feed_url') != feed_url:
+            raise click.ClickException(
+                "%s is the state of a crawl of %s" % (state_path, state.get('feed_url'))
+            )
+        return state
+
+    return {
+        'feed_url': feed_url,
+        'start_date': datetime.utcnow().isoformat(),
+        'done': {},         # url -> number of citations
+        'failed': {},       # url -> error message
+        'jobs': [],         # batch job ids
+    }
+
+
+def save_state(state_path, state):
+    """ Write to a temporary file first: an interrupted crawl
+        never leaves a truncated state file
+    """
+    state['update_date'] = datetime.utcnow().isoformat()
+    directory = os.path.dirname(state_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
+    os.replace(temp_path, state_path)
@@ -0,0 +1,126 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+def create_db_engine(database_uri=None):
+    """ Create the single engine used by the webservice.
+
+        Connections are held in a QueuePool so that each request borrows
+        a connection rather than opening a new one.  The pool is sized
+        in settings.py:
+            * DATABASE_POOL_SIZE:     connections kept open
+            * DATABASE_MAX_OVERFLOW:  extra connections allowed under load
+            * DATABASE_POOL_TIMEOUT:  seconds to wait for a free connection
+            * DATABASE_POOL_RECYCLE:  seconds before a connection is replaced
+              (MySQL closes idle connections after wait_timeout)
+        pool_pre_ping tests each connection before it is handed out,
+        so a restarted database server doesn't surface as a request error.
+    """
+    if database_uri is None:
+        database_uri = settings.SQLALCHEMY_DATABASE_URI
+
+    # An in-memory SQLite database only exists on the connection that
+    # created it, so it can't be spread across a pool
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        return sqlite_pragmas(create_engine(database_uri))
+
+    # Pooled SQLite connections (local development) are shared between threads
+    connect_args = {}
+    if database_uri.startswith('sqlite'):
+        connect_args['check_same_thread'] = False
+
+    pooled_engine = create_engine(
+        database_uri,
+        connect_args=connect_args,
+        poolclass=QueuePool,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    if database_uri.startswith('sqlite'):
+        return sqlite_pragmas(pooled_engine)
+    return pooled_engine
+
+
+def sqlite_pragmas(sqlite_engine):
+    """ INSERT OR REPLACE only fires delete triggers when recursive_triggers
+        is on: the search index triggers (search.py) rely on them
+    """
+    @event.listens_for(sqlite_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA recursive_triggers = ON')
+
+    return sqlite_engine
+
+
+engine = create_db_engine()
+
+# Each thread (and so each Flask request) gets its own session.
+# init_app() calls Session.remove() when the request ends, which closes
+# the session and returns its connection to the pool.
+Session = scoped_session(sessionmaker(bind=engine))
+
+
+def init_app(app):
+    """ Close the request's session once Flask has sent the response,
+        even if the view raised an exception
+    """
+    @app.teardown_appcontext
+    def shutdown_session(exception=None):
+        Session.remove()
+
+
+@contextmanager
+def session_scope():
+    """ Provide a transactional scope for work done outside of a
+        Flask request (command-line jobs, background threads):
+
+            with session_scope() as session:
+                session.add(domain)
+    """
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        Session.remove()
+
+
+def init_db():
+    """ Create any missing tables and search indexes, and fill in
+        columns added since existing rows were saved
+    """
+    from models import Base
+    from search import create_search_indexes
+    from persistence import backfill_reversed_domains, backfill_url_hashes
+    Base.metadata.create_all(engine)
+    create_search_indexes(engine)
+
+    with session_scope() as session:
+        backfill_reversed_domains(session)
+        backfill_url_hashes(session)
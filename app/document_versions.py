@@ -0,0 +1,203 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from lib.google_diff_match_patch.diff_match_patch import diff_match_patch
+from models import Document
+from sqlalchemy import or_
+from sqlalchemy.orm import load_only
+from datetime import datetime
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Document version store
+
+    Only the current version of a url (end_date is NULL) keeps its full
+    body_text and body_html.  When a new version is saved, the previous
+    one is archived: its end_date is set.  The compaction job (compact())
+    later replaces its text by a diff_match_patch delta (diff_toDelta)
+    that turns the next newer version back into it:
+
+        version 3 (current):  full text
+        version 2 (archived): delta against version 3
+        version 1 (archived): delta against version 2
+
+    reconstruct() follows the delta_base_id chain back from the full text.
+    Frequently re-crawled sources change little between versions, so
+    each archived copy shrinks to the size of its changes.
+    body_binary (pdf) can't be diffed as text and is kept as-is.
+
+    Diffing takes up to DOCUMENT_DELTA_TIMEOUT seconds per field, so it
+    isn't done while a request saves documents: an archived version keeps
+    its full text until the next compaction
+        python document_versions.py      (run periodically: cron)
+"""
+
+TEXT_FIELDS = ['body_text', 'body_html']
+
+# Versions are loaded without body_binary, which isn't diffed
+VERSION_COLUMNS = ['id', 'url', 'create_date', 'end_date', 'delta_base_id'] \
+    + TEXT_FIELDS + [field + '_delta' for field in TEXT_FIELDS]
+
+
+def make_delta(newer, older):
+    """ Delta that converts the newer text into the older text """
+    dmp = diff_match_patch()
+    dmp.Diff_Timeout = settings.DOCUMENT_DELTA_TIMEOUT
+    diffs = dmp.diff_main(newer or '', older or '')
+    dmp.diff_cleanupEfficiency(diffs)
+    return dmp.diff_toDelta(diffs)
+
+
+def apply_delta(newer, delta):
+    """ Recreate the older text from the newer text and its delta """
+    dmp = diff_match_patch()
+    return dmp.diff_text2(dmp.diff_fromDelta(newer or '', delta))
+
+
+def load_version(session, document_id):
+    """ A version of a document, with its text but not body_binary """
+    return session.query(Document).options(load_only(*VERSION_COLUMNS)).get(document_id)
+
+
+def archive_previous_versions(session, saved_ids):
+    """ Called after documents are saved:
+            saved_ids: dictionary: url -> id of the version just saved
+        Makes each saved version the current one and archives the
+        versions it replaces: their text is made a delta by compact().
+        Usually a single select, with no changes.
+    """
+    if not saved_ids:
+        return
+
+    rows = session.query(Document.id, Document.url, Document.create_date, Document.end_date) \
+        .filter(Document.url.in_(list(saved_ids.keys()))) \
+        .filter(or_(Document.end_date.is_(None), Document.id.in_(list(saved_ids.values()))))
+
+    rows = rows.all()
+    create_dates = {document_id: create_date for (document_id, url, create_date, end_date) in rows}
+
+    # Content changed back to an archived version: restore it first
+    for (document_id, url, create_date, end_date) in rows:
+        if document_id == saved_ids[url] and end_date is not None:
+            restore(session, load_version(session, document_id))
+
+    # The text of the versions replaced is left to compact()
+    for (document_id, url, create_date, end_date) in rows:
+        if document_id != saved_ids[url] and end_date is None:
+            session.query(Document) \
+                .filter(Document.id == document_id) \
+                .update({'end_date': create_dates[saved_ids[url]] or datetime.utcnow()},
+                        synchronize_session=False)
+
+
+def restore(session, document):
+    """ Make an archived version current again: store its full text """
+    text = reconstruct(session, document)
+    for field in TEXT_FIELDS:
+        setattr(document, field, text[field])
+        setattr(document, field + '_delta', None)
+
+    document.delta_base_id = None
+    document.end_date = None
+
+
+def reconstruct(session, document):
+    """ Recreate the full text of any version of a document
+        Returns a dictionary: {'body_text': .., 'body_html': ..}
+    """
+    if document.delta_base_id is None:
+        return {field: getattr(document, field) for field in TEXT_FIELDS}
+
+    # Follow the chain to the nearest version with full text
+    chain = [document]
+    while chain[-1].delta_base_id is not None:
+        chain.append(load_version(session, chain[-1].delta_base_id))
+
+    text = {field: getattr(chain[-1], field) for field in TEXT_FIELDS}
+    for version in reversed(chain[:-1]):
+        text = {
+            field: apply_delta(text[field], getattr(version, field + '_delta') or '')
+            for field in TEXT_FIELDS
+        }
+    return text
+
+
+def versions(session, url):
+    """ List the stored versions of a url, newest first, without loading
+        any document text: used by the 'archives-of-url' request
+    """
+    return session.query(
+            Document.id, Document.content_hash, Document.word_count,
+            Document.create_date, Document.end_date
+        ) \
+        .filter(Document.url == url) \
+        .order_by(Document.create_date.desc(), Document.id.desc()) \
+        .all()
+
+
+def compact(session, url=None):
+    """ Convert archived versions that still hold full copies into deltas,
+        and rebase each delta onto the next newer version.
+        Only urls with such a version are read (every archived url if
+        url is given).  Each url is checked and committed separately.
+        Returns the number of versions rewritten.
+    """
+    query = session.query(Document.url).filter(Document.end_date.isnot(None))
+    if url:
+        query = query.filter(Document.url == url)
+    else:
+        query = query.filter(or_(Document.body_text.isnot(None), Document.body_html.isnot(None)))
+    urls = [row.url for row in query.distinct()]
+
+    rewritten = 0
+    for document_url in urls:
+        history = session.query(Document) \
+            .options(load_only(*VERSION_COLUMNS)) \
+            .filter(Document.url == document_url) \
+            .order_by(Document.end_date.isnot(None), Document.create_date.desc(), Document.id.desc()) \
+            .all()
+
+        # Reconstruct everything before changing anything
+        texts = [reconstruct(session, version) for version in history]
+
+        for n in range(1, len(history)):
+            newer, older = history[n - 1], history[n]
+            if older.end_date is None:          # two current versions: archive the older
+                older.end_date = newer.create_date
+            elif older.delta_base_id == newer.id and older.body_text is None:
+                continue                        # already compact
+
+            for field in TEXT_FIELDS:
+                delta = make_delta(texts[n - 1][field], texts[n][field])
+                if apply_delta(texts[n - 1][field], delta) != (texts[n][field] or ''):
+                    raise ValueError("Delta check failed: document %s" % older.id)
+                setattr(older, field + '_delta', delta)
+                setattr(older, field, None)
+            older.delta_base_id = newer.id
+            rewritten = rewritten + 1
+
+        session.commit()
+
+    return rewritten
+
+
+if __name__ == '__main__':
+    # Compaction job:  python document_versions.py [url]
+    import sys
+    from database import session_scope
+
+    with session_scope() as session:
+        print("Versions compacted: %s" % compact(session, *sys.argv[1:2]))
@@ -0,0 +1,139 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from xml.etree import ElementTree
+from urllib.parse import urljoin, urlparse
+import requests
+import gzip
+import os
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Discover the pages of a site from its sitemap or feed
+
+    Supported formats (XML namespaces are ignored):
+
+        sitemap index:  <sitemapindex><sitemap><loc>   (followed)
+        sitemap:        <urlset><url><loc>
+        RSS 2.0 / 1.0:  <item><link>
+        Atom:           <entry><link href="..">
+
+    Sitemaps may be gzipped.  Local files are read from disk,
+    so a saved sitemap can be crawled as well.
+"""
+
+HEADERS = {
+   'user-agent': 'Mozilla / 5.0(Windows NT 6.1;'
+   ' WOW64; rv: 54.0) Gecko/20100101 Firefox/71.0'
+}
+
+
+def discover_urls(feed_url, max_sitemaps=None):
+    """ Page urls listed in a sitemap (index) or feed, in the order listed,
+        without duplicates.  At most max_sitemaps files are read
+        (default: settings.CRAWL_MAX_SITEMAPS)
+    """
+    max_sitemaps = max_sitemaps or settings.CRAWL_MAX_SITEMAPS
+
+    page_urls = []
+    seen = set()
+    queue = [feed_url]
+    read = set()
+    while queue and len(read) < max_sitemaps:
+        sitemap_url = queue.pop(0)
+        if sitemap_url in read:
+            continue
+        read.add(sitemap_url)
+
+        pages, sitemaps = parse_feed(fetch_feed(sitemap_url), base_url=sitemap_url)
+        queue.extend(sitemaps)
+        for url in pages:
+            if url not in seen:
+                seen.add(url)
+                page_urls.append(url)
+
+    return page_urls
+
+
+def fetch_feed(feed_url):
+    """ Contents of a feed: a url or a local file """
+    if os.path.exists(feed_url):
+        with open(feed_url, 'rb') as feed_file:
+            content = feed_file.read()
+    else:
+        r = requests.get(feed_url, headers=HEADERS, timeout=settings.CRAWL_TIMEOUT)
+        r.raise_for_status()
+        content = r.content
+    return unzip(content)
+
+
+def unzip(content):
+    """ sitemap.xml.gz: recognized by the gzip magic number """
+    if content[:2] == b'\x1f\x8b':
+        return gzip.decompress(content)
+    return content
+
+
+def parse_feed(content, base_url=''):
+    """ Returns two lists: (page urls, sitemap urls to follow) """
+    root = ElementTree.fromstring(content)
+    kind = local_name(root)
+
+    if kind == 'sitemapindex':
+        return [], web_urls(child_text(root, 'sitemap', 'loc'), base_url)
+    elif kind == 'urlset':
+        return web_urls(child_text(root, 'url', 'loc'), base_url), []
+    elif kind in ('rss', 'RDF'):
+        return web_urls(child_text(root, 'item', 'link'), base_url), []
+    elif kind == 'feed':
+        return web_urls(atom_links(root), base_url), []
+
+    raise ValueError("Not a sitemap or RSS/Atom feed: <%s>" % kind)
+
+
+def local_name(element):
+    """ Tag without its namespace: '{http://..}loc' -> 'loc' """
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def child_text(root, parent, child):
+    """ Text of each <child> of a <parent> element, anywhere in the document """
+    for element in root.iter():
+        if local_name(element) == parent:
+            for item in element:
+                if local_name(item) == child and item.text:
+                    yield item.text.strip()
+
+
+def atom_links(root):
+    """ Atom: the main link of each entry (no rel, or rel="alternate") """
+    for entry in root.iter():
+        if local_name(entry) != 'entry':
+            continue
+        for link in entry:
+            if local_name(link) == 'link' and link.get('rel', 'alternate') == 'alternate' and link.get('href'):
+                yield link.get('href').strip()
+                break
+
+
+def web_urls(urls, base_url=''):
+    """ Absolute http(s) urls: relative links are resolved against the feed """
+    result = []
+    for url in urls:
+        url = urljoin(base_url, url)
+        if urlparse(url).scheme in ('http', 'https'):
+            result.append(url)
+    return result
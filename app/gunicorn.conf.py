@@ -0,0 +1,118 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import multiprocessing
+import os
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Production server settings:
+
+        cd app/
+        gunicorn wsgi:application
+
+    (gunicorn reads ./gunicorn.conf.py).  Every setting can be overridden
+    with an environment variable; benchmarks/load_test.py compares
+    worker and thread counts against a local fixture site.
+
+    Requests spend most of their time waiting on the cited sites and the
+    database, so threaded workers (gthread) are used: GUNICORN_THREADS
+    requests share a worker process, and a few processes use the cores.
+    The requests of a worker share its pool of NUM_DOWNLOAD_PROCESSES
+    processes computing quotes (worker_pool.py).
+
+    Each worker starts its own pool, each pool process its own OCR
+    threads, and each worker its own database connections, so they are
+    sized together.  Unless set in the environment, on a host with C cores:
+
+        workers                  W = max(2, C / 4)
+        NUM_DOWNLOAD_PROCESSES   P = max(2, 2 C / W)  per worker:  W x P, about 2 C, in all
+        OCR_WORKERS              T = max(1, C / (W x P))  per pool process:
+                                     at most max(C, W x P) tesseract at once
+        DATABASE_POOL_SIZE       GUNICORN_THREADS, and DATABASE_MAX_OVERFLOW 4,
+                                 per worker:  W x (threads + 4) connections in all
+
+    e.g. 32 cores: 8 workers, 64 pool processes, 1 OCR thread each,
+    up to 96 database connections.  The totals are logged at startup.
+"""
+
+cores = multiprocessing.cpu_count()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:' + os.getenv('PORT', '80'))
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', str(max(2, cores // 4))))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# Read by settings.py, which is imported after this file (in the master
+# with preload_app, otherwise in each worker)
+pool_processes = int(os.environ.setdefault(
+    'NUM_DOWNLOAD_PROCESSES', str(max(2, 2 * cores // workers))))
+ocr_threads = int(os.environ.setdefault(
+    'OCR_WORKERS', str(max(1, cores // (workers * pool_processes)))))
+database_connections = int(os.environ.setdefault('DATABASE_POOL_SIZE', str(threads))) + \
+    int(os.environ.setdefault('DATABASE_MAX_OVERFLOW', '4'))
+
+# A page with many citations downloads every cited source: allow minutes,
+# and let running requests finish when workers are restarted
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '120'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Restart workers now and then: the document caches only grow
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# Import the app (bs4, sqlalchemy, boto3, youtube_dl, langdetect profiles)
+# once in the master, and fork the workers from it
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+
+
+def on_starting(server):
+    """ Counters start from zero when the server starts (see metrics.py) """
+    from metrics import clear_directory
+    clear_directory()
+
+    server.log.info(
+        "%s cores: %s workers x %s pool processes x %s OCR threads, "
+        "up to %s database connections",
+        cores, workers, pool_processes, ocr_threads, workers * database_connections
+    )
+
+
+def post_fork(server, worker):
+    """ Database connections opened by the master (init_db) can't be
+        shared with the workers: each worker opens its own
+    """
+    from database import engine
+    engine.dispose()
+
+
+def post_worker_init(worker):
+    """ Start the worker pool before the first request, rather than during it,
+        and fail the batch jobs left by workers that have exited
+    """
+    import batch
+    import worker_pool
+    worker_pool.start()
+    batch.recover_jobs()
+
+
+def worker_exit(server, worker):
+    """ Let the quotes being computed finish (within graceful_timeout) """
+    import worker_pool
+    worker_pool.shutdown()
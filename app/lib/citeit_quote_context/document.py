@@ -7,7 +7,8 @@
 # The code for this server library is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license
 
-from models import Domain, Document  
+from persistence import save_documents
+from persistence import document_row
 from lib.citeit_quote_context.canonical_url import Canonical_URL
 from lib.citeit_quote_context.content_type import Content_Type
 from lib.citeit_quote_context.canonical_url import url_without_protocol
@@ -15,6 +16,15 @@ from lib.citeit_quote_context.misc.utils import publish_file
 from lib.citeit_quote_context.misc.utils import fix_encoding
 from lib.citeit_quote_context.misc.utils import get_from_cache
 from lib.citeit_quote_context.misc.utils import save_file_to_cloud
+from lib.citeit_quote_context.misc.timing import Timings
+from lib.citeit_quote_context.ocr import ocr_pages
+from lib.citeit_quote_context import transcript_cache
+from lib.citeit_quote_context import document_cache
+from metrics import inc
+from metrics import register_collector
+from metrics import lru_cache_collector
+from rate_limit import host_limit
+from rate_limit import RateLimited
 
 import requests
 from requests.adapters import HTTPAdapter
@@ -37,6 +47,7 @@ from functools import lru_cache
 import ftfy                      # Fix bad unicode:  http://ftfy.readthedocs.io/
 import re
 import timeit
+import logging
 import settings
 import tldextract
 import os
@@ -55,6 +66,11 @@ __copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
 __license__ = "MIT"
 __version__ = "0.4"
 
+logger = logging.getLogger(__name__)
+
+# Pages of a PDF checked for digital text, spread across it: see pdf_scanned()
+PDF_SCANNED_PAGES = 10
+
 HEADERS = {
    'user-agent': 'Mozilla / 5.0(Windows NT 6.1;'
    ' WOW64; rv: 54.0) Gecko/20100101 Firefox/71.0'
@@ -83,17 +99,22 @@ class Document:
         self.num_downloads = 0  # count number of times the source is downloaded
         self.request_start = datetime.now()  # time how long request takes
         self.request_stop = None  # Datetime of last download
+        self.timings = Timings()  # seconds spent in each stage: see misc/timing.py
 
         self.unicode = ''
         self.content = ''      # raw (binary)
         self.encoding = ''     # character encoding of document, returned by requests library
         self.error = ''
+        self.status_code = None    # HTTP status of the download, if downloaded
         self.language = ''
         self.content_type = ''
         self.line_separater = line_separater
         self.timesplits = timesplits
         self.request_id = request_id
 
+        self.pdf_pages = None           # pages of a PDF read so far: see pages()
+        self.pdf_page_reader = None
+
         self.request_dict = {
             'text': '',        # unicode
             'unicode': '',
@@ -120,17 +141,16 @@ class Document:
 
         # Was this file already downloaded?
         if (len(self.content_type) >= 1):
-            print("ALREADY DOWNLOADED.")
+            logger.debug("Already downloaded: %s", self.url)
             return self.request_dict
 
-        # Is the file cached locally?
-
-        # Does this already exist in database? ***************************************
-
-        file_dict = get_from_cache(self.url_protocol_removed())
-        if (len(file_dict['text']) > 0):
-            self.request_dict = file_dict
-            return file_dict['text']
+        # Is the file cached locally?  (prefetched by another process: see document_cache.py)
+        with self.timings.stage('cache_read'):
+            cached = document_cache.load(self.url)
+        if cached is not None:
+            inc('citeit_cache_total', cache='document_file', result='hit')
+            return self.load_cached(cached)
+        inc('citeit_cache_total', cache='document_file', result='miss')
 
         # --------- Download file from internet -------------
         try:
@@ -148,10 +168,28 @@ class Document:
             session.mount('https://', adapter)
 
             try:
-                r = session.get(url, headers=HEADERS, verify=False)
+                with host_limit(url):   # per-host request rate and concurrency
+                    fetch_start = timeit.default_timer()
+                    r = session.get(url, headers=HEADERS, verify=False)
+                    fetch_time = timeit.default_timer() - fetch_start
+
+            except RateLimited:
+                inc('citeit_fetches_total', status='rate_limited')
+                self.error = "Rate limited"
+                return {
+                    'text': '',  # unicode
+                    'unicode': '',
+                    'content': '',  # raw
+                    'encoding': '',
+                    'error': "Rate limited",
+                    'language': '',
+                    'content_type': ''
+                }
 
             # Invalid URL
             except requests.exceptions.MissingSchema:
+                inc('citeit_fetches_total', status='invalid_url')
+                self.error = "Connection refused"
                 return {
                     'text': '',  # unicode
                     'unicode': '',
@@ -164,6 +202,8 @@ class Document:
 
             except requests.exceptions.ConnectionError:
                 # r.status_code = "Connection refused"
+                inc('citeit_fetches_total', status='connection_error')
+                self.error = "Connection refused"
                 return {
                     'text': '',       # unicode
                     'unicode': url,
@@ -174,10 +214,13 @@ class Document:
                     'content_type': ''
                 }
 
-            print('Downloaded ' + url )
             self.request_stop = datetime.now()
-            print("Encoding: %s" % r.encoding )
-            print("num downloads: " + str(self.num_downloads))
+            self.status_code = r.status_code
+            inc('citeit_fetches_total', status=str(r.status_code))
+
+            # r.elapsed: from sending the request until the headers are parsed
+            self.timings.add('fetch_ttfb', r.elapsed.total_seconds())
+            self.timings.add('fetch_body', max(fetch_time - r.elapsed.total_seconds(), 0))
 
             # Correct the Character Encoding
 
@@ -186,38 +229,48 @@ class Document:
                 hardcoded_encoding = self.url_encoding_hardcoded()[url]
                 r.encoding = hardcoded_encoding
 
-            text = r.text
+            with self.timings.stage('decode'):
+                text = r.text    # decoded on each access: only once
 
-            self.unicode = r.text
+            self.unicode = text
             self.content = r.content
 
             self.encoding = r.encoding
             self.error = error
-            self.language = detect(r.text) # https://www.geeksforgeeks.org/detect-an-unknown-language-using-python/
+            with self.timings.stage('language_detect'):
+                self.language = detect(text) # https://www.geeksforgeeks.org/detect-an-unknown-language-using-python/
 
 
             if 'Content-Type' in r.headers.keys():
                 self.content_type = r.headers['Content-Type']
             else:
                 self.content_type = 'application/html'
-                print(r.headers)    # TODO: Research why content-type is not always set
-
-
-            print('Content-Type: ' + self.content_type)
-            print('Language:     ' + self.language)
-            print('Length: ' + str(len(self.content)))
-            print("Attempting to save ..  ")
-
-            print(self.unicode)
-
+                # TODO: Research why content-type is not always set
+                logger.debug("No Content-Type: %s", url, extra={'fields': {'headers': dict(r.headers)}})
 
             ####### Archive a Copy of the Original File ########
             doc_type = self.doc_type()
-            print("DocType::: " + doc_type)
+            logger.debug("Downloaded %s", url, extra={'fields': {
+                'status': r.status_code,
+                'content_type': self.content_type,
+                'encoding': self.encoding,
+                'language': self.language,
+                'doc_type': doc_type,
+                'bytes': len(self.content),
+                'num_downloads': self.num_downloads,
+            }})
 
             if (doc_type == 'pdf'):
                 text = r.content    # file contents
 
+            if r.status_code < 400:
+                document_cache.save(url, self.content, self.unicode, {
+                    'status_code': r.status_code,
+                    'encoding': self.encoding,
+                    'language': self.language,
+                    'content_type': self.content_type,
+                })
+
             if (settings.SAVE_DOWNLOADS_TO_FILE):
                 write_format = 'w'
 
@@ -237,8 +290,7 @@ class Document:
                     write_format = 'wb'
 
                 # Archive file
-                print("ARCHIVE: local filename----------------------------------")
-                print(local_filename)
+                logger.debug("Archiving %s to %s", url, local_filename)
 
                 my_file = Path(local_filename)
                 if my_file.is_file():
@@ -255,19 +307,12 @@ class Document:
                 filename, file_extension = os.path.splitext(remote_path)
                 if not ((file_extension == '.html') or (file_extension == '.htm')):
                     remote_path = os.path.splitext(remote_path)[0] + 'index.html'
-                    print("Remote path:")
-                    print(remote_path)
 
                 else:
                     remote_path = remote_path + '.' + doc_type
 
                 save_file_to_cloud(local_filename, remote_path, content_type, 'gzip')
 
-            print("Saved original: " + self.filename_original())
-            print('Content-Type: ' + self.content_type)
-            print('Language:     ' + self.language)
-            print('Length: ' + str(len(r.content)))
-
 
         except requests.HTTPError:
             self.request_stop = datetime.now()
@@ -289,9 +334,41 @@ class Document:
 
         return self.request_dict
 
+    def load_cached(self, cached):
+        """ download_resource() of a document_cache.Download """
+        self.request_stop = datetime.now()
+        self.status_code = cached.headers['status_code']
+        self.unicode = cached.text
+        self.content = cached.content
+        self.encoding = cached.headers['encoding']
+        self.language = cached.headers['language']
+        self.content_type = cached.headers['content_type']
+        self.error = ''
+
+        text = self.unicode
+        if (self.doc_type() == 'pdf'):
+            text = self.content    # file contents
+
+        self.request_dict = {
+            'text': text,              # unicode
+            'unicode': self.unicode,
+            'content': self.content,   # raw
+            'encoding': self.encoding,
+            'error': self.error,
+            'language': self.language,
+            'content_type': self.content_type
+        }
+        return self.request_dict
+
     def download_dict(self):
         return self.request_dict
 
+    def fetch_failed(self):
+        """ The download failed, was rate limited or returned an HTTP error:
+            the text is empty or an error page, not the document
+        """
+        return bool(self.error) or (self.status_code or 0) >= 400
+
 
     @lru_cache(maxsize=20)
     def download(self, convert_to_unicode=False):
@@ -302,43 +379,24 @@ class Document:
         return self.download_resource()['text']  # default to blank string
 
 
-    def save_db(self):
-
-        # Count Words
-        text = self.text()
-        words = data.split()
-        word_count = len(words)
+    def save_db(self, session):
+        """ Insert a database record, unless this version
+            of the document (url + content_hash) is already saved.
+            Returns the id of the document record
+        """
+        row = document_row(
+            url=self.url,
+            text=self.text(),
+            raw=self.raw(),
+            content_type=self.content_type_lookup(),
+            encoding=self.encoding_lookup(),
+            language=self.language,
+            request_id=self.request_id,
+        )
+        document_ids = save_documents(session, [row])
+        session.commit()
 
-        # Get Hash of Text Content: used to prevent duplicates
-        hash_method = getattr(hashlib, settings.HASH_ALGORITHM)
-        try:
-            content_hash = hash_method(text.encode(self.encoding)).hexdigest()
-        except UnicodeEncodeError:
-            content_hash = ''   # TODO: research character encoding error
-
-        # Insert Database Record if it doesn't exist
-        document_exists = db.session.query(Document.id).filter_by(content_hash=content_hash, url=self.url).scalar() is not None
-        if not document_exists:
-
-            # Lookup Domain ID
-            domain = db.query(Domain).filter_by(domain_url=domain_url).first()
-            if not domain:          
-                domain = Domain(domain_url=domain_url)
-
-            document.insert().values(
-                request_id = self.request_id
-                , domain_id = domain.id
-                , url = self.url
-                , content_type = self.content_type
-                , title = ''
-                , body_binary = self.content
-                , body_html = self.html()
-                , body_text = text
-                , encoding = self.encoding
-                , language = self.language
-                , word_count = word_count
-                , content_hash = content_hash
-            ) 
+        return document_ids.get((row['url'], row['content_hash']))
 
     @lru_cache(maxsize=500)
     def text(self):
@@ -355,21 +413,24 @@ class Document:
         doc_type = self.doc_type()
 
         if (doc_type == 'html'):
-            print("HTML text()")
 
             # Check Media Provider for transcript: Youtube Video
             if (len(self.media_provider()) > 0):
                 supplemental_text = self.supplemental_text()
 
-            soup = BeautifulSoup(self.html(), "html.parser")
-            invisible_tags = ['style', 'script', '[document]', 'head', 'title']
-            for elem in soup.findAll(invisible_tags):
-                elem.extract()  # hide javascript, css, etc
-            text = soup.get_text()
+            html = self.html()
+            with self.timings.stage('html_parse'):
+                soup = BeautifulSoup(html, "html.parser")
+                invisible_tags = ['style', 'script', '[document]', 'head', 'title']
+                for elem in soup.findAll(invisible_tags):
+                    elem.extract()  # hide javascript, css, etc
+                text = soup.get_text()
 
-            text = fix_encoding(text)
-            text = convert_quotes_to_straight(text)
-            text = normalize_whitespace(text)
+            with self.timings.stage('ftfy'):
+                text = fix_encoding(text)
+            with self.timings.stage('normalize'):
+                text = convert_quotes_to_straight(text)
+                text = normalize_whitespace(text)
 
             html_text = text + '\n\n' + self.supplemental_text()
             html_text = html_text.strip()
@@ -379,13 +440,14 @@ class Document:
                 local_filename = ''.join(["../transcripts/", self.filename_text()])
                 remote_path = ''.join(["transcript/", self.filename_text()])
 
-                publish_file(
-                    self.url,
-                    html_text,
-                    local_filename,
-                    remote_path,
-                    'text/plain'
-                )
+                with self.timings.stage('publish'):
+                    publish_file(
+                        self.url,
+                        html_text,
+                        local_filename,
+                        remote_path,
+                        'text/plain'
+                    )
 
             return html_text
 
@@ -393,7 +455,6 @@ class Document:
             # example: https://demo.citeit.net/2020/06/30/well-behaved-women-seldom-make-history-original-pdf/
             # quoted source: https://dash.harvard.edu/bitstream/handle/1/14123819/Vertuous%20Women%20Found.pdf
 
-            pdf = ''
             pdf_text = ''
             start_time = timeit.default_timer()
 
@@ -402,49 +463,18 @@ class Document:
             except ImportError:
                 return "Unable to process digital PDF. Pdftotext library not installed."
 
-            print("Start PDF processing ..")
-            filename_original = self.filename_original()
-
-            pdf_text = ""
-
-            if (settings.PDF_ENABLED):
-
-                filename_complete = urllib.parse.quote_plus(self.canonical_url_without_protocol())
-                local_filename = ''.join(["../downloads/", filename_complete])
-
-                with open(local_filename, 'rb') as f:
-                    pdf = pdftotext.PDF(f)
-
-                pdf_text = "\n\n".join(pdf)  # Combine text into single string
-
-            pdf_text = pdf_text.strip()
-            pdf_text = fix_encoding(pdf_text)
-
-            """
-            // Get other Pages:
-                 
-            Credit: https://pypi.org/project/pdftotext/
-            
-            # How many pages?
-            print(len(pdf))
-
-            # Iterate over all the pages
-            for page in pdf:
-                print(page)
-
-            # Read some individual pages
-            print(pdf[0])
-            print(pdf[1])
-            """
+            logger.debug("Converting PDF: %s", self.url)
 
             if (settings.PDF_ENABLED):
                 # Digital PDF with digitally extractable text: https://dash.harvard.edu/bitstream/handle/1/14123819/Vertuous%20Women%20Found.pdf
-                if (len(pdf_text) > 0):
+                if not self.pdf_scanned():
+                    # Pages already read by pages() aren't extracted again
+                    pdf_text = "\n\n".join(self.pages()).strip()
+
                     local_filename = self.filename_text()
                     remote_path = ''.join(["transcript/pdf/", self.filename_text()])
 
-                    print("PUBLISH FILE (PDF):  " + local_filename)
-                    print("PUBLISH REMOTE PATH: " + remote_path )
+                    logger.debug("Publishing PDF text: %s", remote_path)
 
                     publish_file(
                         self.url,
@@ -460,47 +490,33 @@ class Document:
                 else:  # example: https://faculty.washington.edu/rsoder/EDLPS579/DostoevskyGrandInquisitor.pdf
 
                     try:
-                        from pdf2image import convert_from_path
+                        import pdf2image
                         import pytesseract  # ocr library for python
-                        import glob
                     except ImportError:
                         return "Unable to run OCR to generate PDF from scanned image.  Pdf2impage, Pytesseract not installed for Docker"
 
-                    pdf_output = ''
-                    language = 'eng'
-
-                    pdfs = glob.glob(filename_original)
-                    print("PDF globs")
-
                     filename_complete = urllib.parse.quote_plus(self.canonical_url_without_protocol()) + ".txt"
 
-                    for original_pdf_path in pdfs:
-                        pages = convert_from_path(filename_original, 500)
-                        print("PDFs converted.  Now enumerating ..")
-
-                        for pageNum, imgBlob in enumerate(pages):
-
-                            print("Page: " + str(pageNum))
-                            filename_page = urllib.parse.quote_plus(self.canonical_url_without_protocol()) + ".txt" + '@@-page-' + str(pageNum).zfill(4) + '.txt'
+                    # Pages are read in parallel and cached: see ocr.py
+                    for pageNum, text in enumerate(self.pages()):
 
-                            # Use OCR to convert image > text
-                            text = pytesseract.image_to_string(imgBlob, language)
-                            text = fix_encoding(text)
+                        filename_page = urllib.parse.quote_plus(self.canonical_url_without_protocol()) + ".txt" + '@@-page-' + str(pageNum).zfill(4) + '.txt'
 
-                            pdf_output = pdf_output + ' ' + text
+                        # Write individual page:
+                        if (settings.SAVE_DOWNLOADS_TO_FILE):
+                            local_filename = ''.join(["../downloads/pdf/", filename_page])
+                            remote_path = ''.join(["transcript/pdf/", filename_page])
 
-                            # Write individual page:
-                            if (settings.SAVE_DOWNLOADS_TO_FILE):
-                                local_filename = ''.join(["../downloads/pdf/", filename_page])
-                                remote_path = ''.join(["transcript/pdf/", filename_page])
+                            publish_file(
+                                self.url,
+                                text,
+                                local_filename,
+                                remote_path,
+                                'text/plain'
+                            )
 
-                                publish_file(
-                                    self.url,
-                                    text,
-                                    local_filename,
-                                    remote_path,
-                                    'text/plain'
-                                )
+                    # Same separator as pages() read by quote_context.locate_in_pages()
+                    pdf_text = "\n\n".join(self.pages()).strip()
 
                     # Write Entire Text to file
                     if (settings.SAVE_DOWNLOADS_TO_FILE):
@@ -509,21 +525,18 @@ class Document:
 
                         publish_file(
                             self.url,
-                            pdf_output,
+                            pdf_text,
                             local_filename,
                             remote_path,
                             'text/plain'
                         )
 
-            # takes roughly 90 minutes (16 seconds per page)
-            print("The time difference is :",
-                  timeit.default_timer() - start_time)
+            logger.info("Converted PDF in %.1f seconds: %s", timeit.default_timer() - start_time, self.url)
 
             return pdf_text
 
 
         elif (doc_type == 'json'):
-            print("SUPPLEMENTAL TEXT()")
             return self.supplemental_text()
 
         elif (doc_type == 'txt'):
@@ -584,7 +597,6 @@ class Document:
             return "XLSX support not yet implemented.  To implement it see: https://pypi.python.org/pypi/xlrd"
 
         elif (doc_type == 'json'):
-            print("JSON DOC TYPE")
             text = ''
             if (len(self.media_provider()) > 0):
                 text = self.supplemental_text()
@@ -602,6 +614,74 @@ class Document:
             return self.download_resource()['content_type']
 
 
+    def pages(self):
+        """ Text of each page, read as the caller asks for it: a caller that
+            stops early (quote_context.locate_in_pages()) doesn't wait for
+            the rest of a long PDF to be extracted or OCRed.
+            Pages already read are kept, so text() doesn't read them again.
+            Other documents are a single page: text()
+        """
+        if (self.doc_type() != 'pdf') or not settings.PDF_ENABLED:
+            yield self.text()
+            return
+
+        if self.pdf_pages is None:
+            self.pdf_pages = []
+            self.pdf_page_reader = self.read_pdf_pages()
+
+        n = 0
+        while True:
+            if n == len(self.pdf_pages):
+                page = next(self.pdf_page_reader, None)
+                if page is None:
+                    return
+                self.pdf_pages.append(page)
+            yield self.pdf_pages[n]
+            n = n + 1
+
+    def read_pdf_pages(self):
+        try:
+            import pdftotext  # convert pdf > text without using ocr
+        except ImportError:
+            yield "Unable to process digital PDF. Pdftotext library not installed."
+            return
+
+        filename_original = self.filename_original()
+        if not os.path.exists(filename_original):
+            logger.warning("PDF not downloaded: %s", self.url)
+            return
+
+        if self.pdf_scanned():
+            for text in ocr_pages(filename_original):
+                yield fix_encoding(text)
+        else:
+            with open(filename_original, 'rb') as f:
+                pdf = pdftotext.PDF(f)
+            for page in pdf:   # each page is extracted as it is read
+                yield fix_encoding(page)
+
+    @lru_cache(maxsize=500)
+    def pdf_scanned(self):
+        """ A scanned PDF has no digital text on most of its pages: use OCR.
+            Pages are sampled across the whole PDF, so a blank or image
+            cover doesn't make a digital PDF look scanned, nor a digital
+            cover sheet a scan look digital
+        """
+        try:
+            import pdftotext
+        except ImportError:
+            return False
+
+        if not os.path.exists(self.filename_original()):
+            return False
+
+        with open(self.filename_original(), 'rb') as f:
+            pdf = pdftotext.PDF(f)
+        step = -(-len(pdf) // PDF_SCANNED_PAGES)    # rounded up
+        sample = range(0, len(pdf), max(step, 1))
+        text_pages = sum(1 for n in sample if pdf[n].strip())
+        return text_pages * 2 < len(sample)
+
     @lru_cache(maxsize=500)
     def doc_type(self):
         # Distinguish between html, text, .doc, ppt, and pdf
@@ -656,6 +736,15 @@ class Document:
 
         return supplemental_text
 
+    def transcript(self):
+        """ Media transcript at the end of text(), with the time of each
+            caption (see transcript_cache.py), or None
+        """
+        if (self.media_provider() == 'youtube.com') and youtube_video_id(self.url):
+            self.text()     # caches the transcript
+            return transcript_cache.load('youtube.com', youtube_video_id(self.url))
+        return None
+
     @lru_cache(maxsize=20)
     def raw(self, convert_to_unicode=True):
         """
@@ -672,7 +761,7 @@ class Document:
     def html(self):
         """ Get html code, if doc_type = 'html' """
         html = ""
-        print('unicode' + self.download_resource()['unicode'])
+        self.download_resource()    # sets self.unicode
 
         if self.doc_type() == 'html':
             #html = self.download_resource()['unicode']   #self.raw()
@@ -741,13 +830,16 @@ class Document:
         data['encoding'] = self.encoding
         data['request_start'] = self.request_start
         data['request_stop'] = self.request_stop
-        data['elapsed_time'] = str(self.elapsed_time())
         data['text'] = self.text()
         data['raw'] = self.raw()
 
+        elapsed_time = self.elapsed_time()
+        data['elapsed_time'] = str(elapsed_time) if elapsed_time is not None else ''
+
         if (verbose_view):
             data['raw_original_encoding'] = self.raw(convert_to_unicode=False)
             data['num_downloads'] = self.num_downloads
+            data['timings'] = self.timings.dict()
 
         return data
 
@@ -785,7 +877,11 @@ class Document:
         return self.request_stop
 
     def elapsed_time(self):
-        """ Elapsed time between instantiation and last download """
+        """ Elapsed time between instantiation and last download,
+            or None if nothing was downloaded (served from the cache)
+        """
+        if self.request_stop is None:
+            return None
         return self.request_stop - self.request_start
 
     def increment_num_downloads(self) -> int:
@@ -801,6 +897,11 @@ class Document:
         return self.num_downloads
 
 
+# Hits and misses of the in-process caches, for /metrics
+register_collector(lru_cache_collector('document_download', Document.download_resource))
+register_collector(lru_cache_collector('document_text', Document.text))
+
+
 # ################## Non-class functions #######################
 
 def convert_quotes_to_straight(str):
@@ -868,7 +969,6 @@ def oyez_case_id(public_apps_url):
         case_id = re.match('.*?([0-9]+)$', public_apps_url).group(1)
         return case_id
     else:
-        print("NOT: oyez.org")
         return ""
 
 def oyez_public_json(public_apps_url):
@@ -879,7 +979,6 @@ def oyez_public_json(public_apps_url):
     if (len(str(case_id)) > 0):
         json_url = 'https://api.oyez.org/case_media/oral_argument_audio/' + case_id
     else:
-        print("NOT: oyez.org")
         json_url = ""
 
     return json_url
@@ -897,10 +996,9 @@ def oyez_transcript(public_url):
         return transcript_content
 
     if (len(json_url) == 0):
-        print("NOT: " + json_url)
         return ''
     else:
-        print("OYEZ JSON: " + json_url)
+        logger.debug("Oyez transcript: %s", json_url)
 
         output = ''
         line_output = ''
@@ -969,33 +1067,41 @@ def youtube_video_id(value):
     return None
 
 
+def clean_caption(line):
+    """ A line of caption, as it appears in the transcript """
+    line = line.replace("&gt;", "")
+    line = line.replace("   ", " ")
+    line = line.replace("  ", " ")
+    return line.strip()
+
+
 def youtube_transcript(url, line_separator='', timesplits=''):
     """
         Check to see if transcript was already downloaded and cached
         If not, query the YouTube API and parse the response into a transcript
             - remove formatting and time codes
-            - a future version could create a format that includes time signatures
+            - line_separator is added after each line, and timesplits puts
+              the time of each line before it: see format_transcript()
     """
     import itertools
     import operator
     import re
-    import os
 
-    transcript_content = ''
     transcript_output = []
+    transcript_lines = []   # the lines of transcript_output
+    captions = []           # (start, line) of the captions: see transcript_cache.py
     deduplicated_output = ''
     duplicate_cnt = 0
     content_file = ""
 
     youtube_id = youtube_video_id(url)
-    transcript_filename = '../downloads/transcripts/custom/youtube.com/' + youtube_id + '.txt'
+    if not youtube_id:
+        return ''
 
-    file_dict = get_from_cache(transcript_filename)
-    transcript_content = file_dict['text']
-    if len(transcript_content) > 0:
-        return transcript_content
+    # Cached with the time of each caption: see transcript_cache.py
+    transcript = transcript_cache.load('youtube.com', youtube_id)
 
-    else:
+    if transcript is None:
         # Download YouTube Transcript from API
         ydl = youtube_dl.YoutubeDL(
             {'writesubtitles': True,
@@ -1016,15 +1122,20 @@ def youtube_transcript(url, line_separator='', timesplits=''):
 
         if res['requested_subtitles'] and res['requested_subtitles'][
             'en']:
-            print('Grabbing vtt file from ' +
-                  res['requested_subtitles']['en']['url']
-            )
-            response = requests.get(
-                res['requested_subtitles']['en']['url'],
-                stream=True
-            )
+            logger.debug("Downloading captions: %s", res['requested_subtitles']['en']['url'])
+            try:
+                response = requests.get(
+                    res['requested_subtitles']['en']['url'],
+                    stream=True
+                )
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                # Not cached: the captions are downloaded again next time
+                logger.warning("Unable to download captions of %s: %s", url, e)
+                return ''
 
             text = response.text
+            captions = transcript_cache.caption_lines(text)
 
             # Remove Formatting: time & color ccodes
             # Credit: Alex Chan
@@ -1084,20 +1195,16 @@ def youtube_transcript(url, line_separator='', timesplits=''):
 
             for line, _ in itertools.groupby(text):
                 if not any(remove_word in line for remove_word in remove_words):
-                    line = line.replace("&gt;", "")
-                    line = line.replace("   ", " ")
-                    line = line.replace("  ", " ")
-                    line = line.strip() + " " + line_separator
+                    line = clean_caption(line)
+                    transcript_lines.append(line)
+                    line = line + " "
 
                     transcript_output.append(line)
 
-            if len(res['subtitles']) > 0:
-                print('manual captions')
-            else:
-                print('automatic_captions')
+            logger.debug("Captions of %s: %s", url, 'manual' if len(res['subtitles']) > 0 else 'automatic')
 
         else:
-            print('Youtube Video does not have any english captions')
+            logger.info("Youtube video has no english captions: %s", url)
 
 
         # Check to see if lines are duplicated
@@ -1134,12 +1241,16 @@ def youtube_transcript(url, line_separator='', timesplits=''):
 
         # Duplicate Lines Found
         else:
-            print("De-duplicate transcripts:", max_count)
+            logger.debug("Transcript lines repeated %s times: %s", max_count, url)
             for line_num, line in enumerate(transcript_output):
                 if (line_num%max_count) == 1:  # Get every n lines
                     deduplicated_output.append(line)
 
             transcript_output = "".join(deduplicated_output)
+            transcript_lines = [
+                line for (line_num, line) in enumerate(transcript_lines)
+                if (line_num%max_count) == 1
+            ]
 
 
         # Combine lines
@@ -1152,10 +1263,20 @@ def youtube_transcript(url, line_separator='', timesplits=''):
         transcript_output = transcript_output.replace("WEBVTTKind", " ")
         transcript_output = transcript_output.strip()
 
-        if settings.SAVE_DOWNLOADS_TO_FILE:
-            print("create/write file: " + transcript_filename)
+        # Only captions that were downloaded are cached: a video without
+        # them is checked again next time, in case they have been added
+        if not (captions and transcript_output):
+            return transcript_output
 
+        # Position of each line in the transcript, and the time it is spoken
+        cues = transcript_cache.index_lines(transcript_output, transcript_lines, captions, clean_caption)
+        transcript = transcript_cache.save('youtube.com', youtube_id, transcript_output, cues, transcript_lines)
+
+        if settings.SAVE_DOWNLOADS_TO_FILE:
+            # Not the cached .txt: publish_file() writes it in place
             local_filename = "../transcripts/" + youtube_id + ".txt"
+            logger.debug("Saving transcript: %s", local_filename)
+
             remote_path = ''.join(['transcript/custom/youtube.com/', youtube_id , '.txt'])
 
             publish_file(
@@ -1166,6 +1287,26 @@ def youtube_transcript(url, line_separator='', timesplits=''):
                 'text/plain'
             )
 
-    return transcript_output
+    return format_transcript(transcript, line_separator, timesplits)
+
+
+def format_transcript(transcript, line_separator='', timesplits=False):
+    """ Text of a cached transcript with line_separator after each line,
+        and the time each line is spoken before it if timesplits
+    """
+    if not (line_separator or timesplits):
+        return transcript.text
+
+    output = []
+    for (position, line) in transcript.lines():
+        if timesplits:
+            seconds = int(transcript.seconds(position) or 0)
+            line = "[%d:%02d:%02d] %s" % (seconds // 3600, seconds // 60 % 60, seconds % 60, line)
+        output.append(line + " " + line_separator)
+
+    transcript_output = "".join(output)
+    transcript_output = transcript_output.replace("   ", " ")
+    transcript_output = transcript_output.replace("  ", " ")
+    return transcript_output.strip()
 
 
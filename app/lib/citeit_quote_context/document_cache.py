@@ -0,0 +1,132 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Cache of downloaded documents, shared by the processes of a server
+
+        download = load(url)    # None if not cached, or older than max age
+        download.content, download.text, download.headers['content_type']
+
+    A batch job downloads each source once (url.prefetch_document()): the
+    tasks computing its citations, in any pool process, read it from here.
+
+    DOCUMENT_CACHE_DIR/<sha256 of url>.body     content, as downloaded
+    DOCUMENT_CACHE_DIR/<sha256 of url>.txt      content decoded (utf-8)
+    DOCUMENT_CACHE_DIR/<sha256 of url>.json     status, encoding, language,
+                                                content type
+
+    Only successful downloads are saved.  Entries older than
+    DOCUMENT_CACHE_MAX_AGE seconds are stale: the document is downloaded
+    again, and prune() removes them.
+"""
+
+PRUNE_INTERVAL = 60     # seconds between prune() of a process
+
+last_pruned = 0
+
+
+class Download:
+
+    def __init__(self, content, text, headers):
+        self.content = content      # bytes
+        self.text = text            # str
+        self.headers = headers      # status_code, encoding, language, content_type
+
+
+def load(url, max_age=None):
+    """ The cached Download of url, or None """
+    path = document_path(url)
+    if max_age is None:
+        max_age = settings.DOCUMENT_CACHE_MAX_AGE
+
+    try:
+        if time.time() - os.path.getmtime(path + '.json') > max_age:
+            return None
+        with open(path + '.json', 'r', encoding='utf-8') as headers_file:
+            headers = json.load(headers_file)
+        with open(path + '.body', 'rb') as body_file:
+            content = body_file.read()
+        with open(path + '.txt', 'r', encoding='utf-8') as text_file:
+            text = text_file.read()
+    except (FileNotFoundError, ValueError):    # not cached, or removed by prune()
+        return None
+
+    return Download(content, text, headers)
+
+
+def save(url, content, text, headers):
+    """ headers: status_code, encoding, language, content_type """
+    path = document_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # The headers are written last: load() finds all the files or none
+    write_file(path + '.body', content)
+    write_file(path + '.txt', text.encode('utf-8', 'replace'))
+    write_file(path + '.json', json.dumps(headers).encode('utf-8'))
+    logger.debug("Cached document %s: %s bytes", url, len(content))
+
+    if time.time() - last_pruned > PRUNE_INTERVAL:
+        prune()
+    return Download(content, text, headers)
+
+
+def prune():
+    """ Remove the entries older than DOCUMENT_CACHE_MAX_AGE.
+        Returns the number of documents removed
+    """
+    global last_pruned
+    last_pruned = time.time()
+
+    removed = 0
+    for entry in os.scandir(settings.DOCUMENT_CACHE_DIR):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            if last_pruned - entry.stat().st_mtime <= settings.DOCUMENT_CACHE_MAX_AGE:
+                continue
+            path = entry.path[:-len('.json')]
+            # The headers first: load() doesn't find a partly removed entry
+            for extension in ('.json', '.body', '.txt'):
+                os.remove(path + extension)
+            removed = removed + 1
+        except FileNotFoundError:   # removed by another process
+            pass
+
+    if removed:
+        logger.info("Removed %s documents from the document cache", removed)
+    return removed
+
+
+def write_file(path, content):
+    # Write to a temporary file first: a reader never sees a partial file
+    temp_path = '%s.%s-%s.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'wb') as cache_file:
+        cache_file.write(content)
+    os.replace(temp_path, path)
+
+
+def document_path(url):
+    return os.path.join(settings.DOCUMENT_CACHE_DIR, hashlib.sha256(url.encode('utf-8')).hexdigest())
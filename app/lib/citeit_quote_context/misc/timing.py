@@ -0,0 +1,132 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Per-stage timings of a citation lookup
+
+    Document and Quote each keep a Timings object; the seconds spent
+    in each stage are returned with their data (Document.data(verbose_view=True),
+    Quote.data()['timings']) and added to the histograms of the process
+    that receives the results:
+
+        document:  fetch_ttfb (request sent -> headers parsed), fetch_body,
+                   cache_read, decode, language_detect, html_parse, ftfy,
+                   normalize, publish
+        quote:     match (QuoteContext of both documents), hash, total
+        request:   db (save the citations), publish (JSON upload)
+
+    Quotes are computed in pool processes, so their timings are recorded
+    by the parent when the result comes back (see record_quote_timings()).
+"""
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Timings:
+    """ Seconds spent in each stage; a stage timed twice adds up
+
+        Usage:
+            timings = Timings()
+            with timings.stage('html_parse'):
+                soup = BeautifulSoup(html, 'html.parser')
+            timings.dict()   # {'html_parse': 0.0123}
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def dict(self):
+        return OrderedDict((name, round(seconds, 6)) for (name, seconds) in self.stages.items())
+
+
+class Histograms:
+    """ Distribution of the time spent in each stage, by this process
+        (cumulative bucket counts, as Prometheus expects)
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}       # name -> {'buckets': [count, ..], 'sum': s, 'count': n}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+                self._histograms[name] = histogram
+
+            for n in range(bisect.bisect_left(self.buckets, seconds), len(self.buckets)):
+                histogram['buckets'][n] = histogram['buckets'][n] + 1
+            histogram['sum'] = histogram['sum'] + seconds
+            histogram['count'] = histogram['count'] + 1
+
+    def observe_all(self, prefix, timings):
+        """ Add a Timings.dict() to the histograms: prefix.stage """
+        for (name, seconds) in timings.items():
+            self.observe(prefix + '.' + name, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {'buckets': list(histogram['buckets']), 'sum': histogram['sum'], 'count': histogram['count']}
+                for (name, histogram) in self._histograms.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+histograms = Histograms()
+
+
+@contextmanager
+def timed(name):
+    """ Time a stage that isn't part of a Document or Quote (db, publish) """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograms.observe(name, time.perf_counter() - start)
+
+
+def record_quote_timings(quote_data):
+    """ Add the timings returned by Quote.data() to this process's histograms:
+        the stages of both documents are counted as 'document.<stage>'
+    """
+    timings = quote_data.get('timings') or {}
+    for side in ('citing_document', 'cited_document'):
+        histograms.observe_all('document', timings.get(side, {}))
+    histograms.observe_all('quote', timings.get('quote', {}))
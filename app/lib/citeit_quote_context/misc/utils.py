@@ -4,9 +4,14 @@ import ftfy  # fix bad unicode
 import boto3
 import settings
 import gzip
+import logging
 import os
 
 from langdetect import detect
+from lib.citeit_quote_context.misc.timing import timed
+from metrics import add_gauge
+
+logger = logging.getLogger(__name__)
 
 
 def escape_json(str):
@@ -85,12 +90,8 @@ def publish_file(url, text, local_path, remote_path, content_type, compression='
         # string_input = gzip.compress(bytes(text, 'utf-8'))
         pass
 
-    print("Input path: >> " + local_path_input )
-    print("Compression: " + compression)
-
     save_file_locally(local_path_input, string_input, filetype)
     save_file_to_cloud(local_path_input, remote_path, content_type, compression)
-    print("SAVED TO CLOUD:  ------------" + remote_path + "---------------")
     submit_to_archive_org(url)
 
 def save_file_locally(local_path, text_input, filetype='w'):
@@ -101,12 +102,10 @@ def save_file_locally(local_path, text_input, filetype='w'):
         os.makedirs(dirname)
 
     # Archive file
-    print("SAVE LOCALLY: local filename----------------------------------")
-    print(local_path)
     with open(local_path, 'w') as f:
         f.write(text_input)
 
-    print("**** Saved locally: " + local_path + " ******")
+    logger.debug("Saved locally: %s", local_path)
 
 
 def save_file_to_cloud(local_path, remote_path, content_type, compression='gzip'):
@@ -131,21 +130,24 @@ def save_file_to_cloud(local_path, remote_path, content_type, compression='gzip'
 
         s3 = session.resource('s3')
 
-        print("try: s3..upload file: " + local_path)
-
+        # Uploads are synchronous: the "queue" is the uploads in progress
+        add_gauge('citeit_s3_uploads_in_progress', 1)
         try:
-            s3.meta.client.upload_file(
-                Filename=local_path,
-                Bucket=settings.AMAZON_S3_BUCKET,
-                Key=remote_path,
-                ExtraArgs=extraArgs,
-            )
+            with timed('s3.upload'):
+                s3.meta.client.upload_file(
+                    Filename=local_path,
+                    Bucket=settings.AMAZON_S3_BUCKET,
+                    Key=remote_path,
+                    ExtraArgs=extraArgs,
+                )
 
         except boto3.exceptions.S3UploadFailedError:
-            print("Error uploading: S3UploadFailed Error")
+            logger.exception("Unable to upload %s to %s", local_path, remote_path)
 
+        finally:
+            add_gauge('citeit_s3_uploads_in_progress', -1)
 
-        print("------Publishing to Cloud: " + remote_path + "-----xyz")
+        logger.debug("Uploaded %s", remote_path)
 
 def submit_to_archive_org(url):
     # submit url to archive.org
@@ -156,7 +158,7 @@ def submit_to_archive_org(url):
 def add_archive_job_to_queue(url):
     # r = requests.get('https://web.archive.org/save/?url='+ url)
     # r = requests.post('https://web.archive.org/save', data={'url': url})
-    print("submit archive request to job queue")
+    logger.debug("Archive request queued: %s", url)
 
 
 def get_from_cache(filename):
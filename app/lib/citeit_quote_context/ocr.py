@@ -0,0 +1,115 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import hashlib
+import logging
+import os
+import threading
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    OCR of scanned PDFs, one page at a time
+
+        for text in ocr_pages('../downloads/scan.pdf'):
+            ...
+
+    Each page is rendered on its own (pdftoppm) and read by tesseract:
+    both are separate programs, so OCR_WORKERS threads keep that many
+    pages in progress on as many cores, with one page image each in
+    memory.  (Threads rather than a process pool: Document.text() runs
+    in the download pool, whose processes can't start their own.)
+
+    The text of each page is cached by (PDF content hash, page, DPI,
+    language) in OCR_CACHE_DIR, so no page is read twice, even if
+    a conversion is interrupted.
+"""
+
+
+def ocr_pages(pdf_path, dpi=None, language=None, workers=None):
+    """ Yield the text of each page, in order.
+        Pages are read ahead of the caller by up to 2 * workers pages;
+        pages not started when the caller stops are never read.
+    """
+    dpi = dpi or settings.OCR_DPI
+    language = language or settings.OCR_LANGUAGE
+    workers = workers or settings.OCR_WORKERS or os.cpu_count() or 1
+
+    pdf_hash = file_hash(pdf_path)
+    pages = page_count(pdf_path)
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')   # one core per tesseract
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = deque()
+    next_page = 1
+    try:
+        for page in range(1, pages + 1):
+            while next_page <= pages and len(futures) < workers * 2:
+                futures.append(executor.submit(cached_ocr_page, pdf_path, pdf_hash, next_page, dpi, language))
+                next_page = next_page + 1
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def cached_ocr_page(pdf_path, pdf_hash, page, dpi, language):
+    path = cache_path(pdf_hash, page, dpi, language)
+    try:
+        with open(path, 'r', encoding='utf-8') as cache_file:
+            return cache_file.read()
+    except FileNotFoundError:
+        pass
+
+    logger.debug("OCR page %s of %s", page, pdf_path)
+    text = ocr_page(pdf_path, page, dpi, language)
+
+    # Write to a temporary file first: a reader never sees a partial page
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = '%s.%s-%s.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'w', encoding='utf-8') as cache_file:
+        cache_file.write(text)
+    os.replace(temp_path, path)
+    return text
+
+
+def ocr_page(pdf_path, page, dpi, language):
+    from pdf2image import convert_from_path
+    import pytesseract
+
+    image = convert_from_path(pdf_path, dpi=dpi, first_page=page, last_page=page)[0]
+    return pytesseract.image_to_string(image, lang=language)
+
+
+def page_count(pdf_path):
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_path)['Pages'])
+
+
+def cache_path(pdf_hash, page, dpi, language):
+    return os.path.join(settings.OCR_CACHE_DIR, pdf_hash, '%04d-%s-%s.txt' % (page, dpi, language))
+
+
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as pdf_file:
+        for block in iter(lambda: pdf_file.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
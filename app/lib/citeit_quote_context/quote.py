@@ -8,6 +8,9 @@
 # http://www.opensource.org/licenses/mit-license
 
 from lib.citeit_quote_context.quote_context import QuoteContext
+from lib.citeit_quote_context.quote_context import locate_in_pages
+from lib.citeit_quote_context.quote_context import normalize_text
+from lib.citeit_quote_context.text_store import store
 from lib.citeit_quote_context.document import Document
 from lib.citeit_quote_context.text_convert import escape_text
 
@@ -15,6 +18,7 @@ from lib.citeit_quote_context.canonical_url import Canonical_URL
 from lib.citeit_quote_context.canonical_url import url_without_protocol
 from lib.citeit_quote_context.text_convert import html_to_text
 from lib.citeit_quote_context.text_convert import escape_url
+from lib.citeit_quote_context.misc.timing import Timings
 
 from functools import lru_cache
 import hashlib
@@ -71,6 +75,7 @@ class Quote:
         self.after_quote_context_length = after_quote_context_length
         self.starting_location_guess = starting_location_guess
         self.request_id = request_id
+        self.timings = Timings()        # match, hash: see misc/timing.py
 
     ######################## Citing Document ############################
 
@@ -84,7 +89,7 @@ class Quote:
     @lru_cache(maxsize=20)
     def citing_doc(self):
         """ Get Document of citing url """
-        return Document(self.citing_url(), self.request_id)
+        return Document(self.citing_url(), request_id=self.request_id)
 
     def citing_doc_encoding(self):
         return self.citing_doc().encoding_lookup()
@@ -128,7 +133,7 @@ class Quote:
     @lru_cache(maxsize=20)
     def cited_doc(self):
         """ Get Document of cited url """
-        return Document(self.cited_url(), self.request_id)
+        return Document(self.cited_url(), request_id=self.request_id)
 
     def cited_raw(self):
         """ Get text-version of citing document """
@@ -147,6 +152,34 @@ class Quote:
             cited_text = self.cited_doc().text()
         return cited_text
 
+    def cited_context(self):
+        """ Context of the quote in the cited document.
+            A PDF is searched page by page, as its pages are read:
+            see locate_in_pages()
+        """
+        if self.cited_doc().doc_type() == 'pdf':
+            quote = self.citing_quote()
+            return locate_in_pages([quote], self.cited_doc().pages())[quote]
+
+        # Long texts are matched and sliced from the text store (text_store.py)
+        cited_text = store(normalize_text(self.cited_text()))
+        return QuoteContext(self.citing_quote(), cited_text)
+
+    def cited_timestamp(self, cited_context):
+        """ Seconds into a cited video at which the quote is spoken
+            (YouTube captions), None for other documents
+        """
+        transcript = self.cited_doc().transcript()
+        if transcript is None:
+            return None
+
+        # The transcript is at the end of the text
+        transcript_start = cited_context.text_length() - len(normalize_text(transcript.text))
+        position = cited_context.data()['quote_start_position'] - transcript_start
+        if position < 0:
+            return None
+        return transcript.seconds(position)
+
     def cited_url_canonical(self):
         """ Check cited page's html (raw) for a canonical url,
             if none found, return the specified url
@@ -169,32 +202,13 @@ class Quote:
             throw off the hash
         """
 
-        citing_quote = escape_text(self.citing_quote())
-        citing_url = escape_url(self.citing_url())  # escape_url(self.citing_url_canonical())
-        cited_url = escape_url(self.cited_url())
-
-        print("HASHKEY: ************ " + citing_quote + " ******************")
-
-
-        return ''.join([
-                    citing_quote, '|',                         # https://stackoverflow.com/questions/22601291/how-do-i-unescape-a-unicode-escaped-string-in-python
-                    url_without_protocol(citing_url), '|',
-                    url_without_protocol(cited_url)            # future: replace with: self.cited_url_canonical ?
-                ])
+        return quote_hashkey(self.citing_quote(), self.citing_url(), self.cited_url())
 
     def hash(self):
         """
             Generate hash of the key, based on hash algorith (sha256)
         """
-        hash_method = getattr(hashlib, settings.HASH_ALGORITHM)
-        hash_text = self.hashkey()
-        encoding = self.citing_doc_encoding()
-
-        try:
-            hash = hash_method(hash_text.encode(encoding)).hexdigest()
-        except UnicodeEncodeError:
-            hash = ''   # TODO: research character encoding error
-        return hash
+        return quote_hash(self.hashkey(), self.citing_doc_encoding())
 
     def error(self):
         """
@@ -214,8 +228,11 @@ class Quote:
             Optionally return a smaller subset of fields to upload to cloud
         """
 
+        with self.timings.stage('hash'):
+            sha256 = self.hash()
+
         data_dict = {
-            'sha256': self.hash(),
+            'sha256': sha256,
             'citing_quote': self.citing_quote(),
             'citing_url': self.citing_url(),  #  may be different from canonical
             'cited_url': self.cited_url(),    #  may be different from canonical
@@ -227,17 +244,41 @@ class Quote:
         ######### LEFT OFF ##########
 
 
-        # Set text and raw values equal to user-supplied values, or look up
-        data_dict['citing_text'] = self.citing_text()
-        data_dict['cited_text'] = self.cited_text()
-
         if self.raw_output and self.citing_doc():
             data_dict['citing_raw'] = self.citing_raw_input
             data_dict['cited_raw'] = self.cited_raw()
 
+        # Document properties: saved to the 'document' table
+        data_dict['citing_encoding'] = self.citing_doc_encoding()
+        data_dict['citing_content_type'] = self.citing_doc().content_type_lookup()
+        data_dict['citing_language'] = self.citing_doc().language
+        data_dict['cited_encoding'] = self.cited_doc().encoding_lookup()
+        data_dict['cited_content_type'] = self.cited_doc().content_type_lookup()
+        data_dict['cited_language'] = self.cited_doc().language
+
+        # A cited document that couldn't be downloaded (rate limited,
+        # connection refused) has no text: its context would be empty.
+        # The quote is neither saved nor published (see error())
+        if self.cited_doc().error:
+            data_dict['error'] = "Cited document: " + self.cited_doc().error
+            data_dict['hashkey'] = self.hashkey()
+            return data_dict
+
         # Find context of quote from within text
         citing_context = QuoteContext(self.citing_quote(), self.citing_text())
-        cited_context = QuoteContext(self.citing_quote(), self.cited_text())
+        with self.timings.stage('match'):
+            cited_context = self.cited_context()
+            citing_context.data()
+            cited_context.data()
+
+        # Set text and raw values equal to user-supplied values, or look up.
+        # The rest of a PDF isn't read for the request: its text is None
+        # until read after it (see cited_texts.py)
+        data_dict['citing_text'] = self.citing_text()
+        if self.cited_doc().doc_type() == 'pdf':
+            data_dict['cited_text'] = None
+        else:
+            data_dict['cited_text'] = self.cited_text()
 
         # Populate context fields with Document methods
         quote_context_fields = [
@@ -255,11 +296,24 @@ class Quote:
             data_dict[citing_field] = citing_context.data()[field]
             data_dict[cited_field] = cited_context.data()[field]
 
+        # Quotes of a video: where to start playing it
+        cited_timestamp = self.cited_timestamp(cited_context)
+        if cited_timestamp is not None:
+            data_dict['cited_timestamp'] = cited_timestamp
+
         # Stop Elapsed Timer
         elapsed_time = time.time() - self.start_time
         data_dict['create_elapsed_time'] = format(elapsed_time, '.5f')
         data_dict['hashkey'] = self.hashkey()
 
+        # Seconds per stage, for each document and the quote itself
+        self.timings.add('total', elapsed_time)
+        data_dict['timings'] = {
+            'citing_document': self.citing_doc().timings.dict(),
+            'cited_document': self.cited_doc().timings.dict(),
+            'quote': self.timings.dict(),
+        }
+
         # Don't return certain fields
         if not self.text_output:
             excluded_fields = ['citing_text', 'cited_text']
@@ -276,8 +330,10 @@ class Quote:
                 'cited_context_start_position',
                 'citing_context_start_position',
                 'cited_context_end_position', 'citing_context_end_position',
-                'create_elapsed_time',
-                'encoding', 'encoding_confidence', 'language'
+                'create_elapsed_time', 'timings',
+                'encoding', 'encoding_confidence', 'language',
+                'citing_encoding', 'citing_content_type', 'citing_language',
+                'cited_encoding', 'cited_content_type', 'cited_language',
             ]
             for excluded_field in excluded_fields:
                 data_dict.pop(excluded_field, None)
@@ -286,3 +342,30 @@ class Quote:
         """
         return data_dict
 
+
+# ################## Non-class functions #######################
+
+
+def quote_hashkey(citing_quote, citing_url, cited_url):
+    """ Quote.hashkey() without downloading anything:
+        citing_quote is the text version of the quote
+    """
+    citing_quote = escape_text(citing_quote)
+    citing_url = escape_url(citing_url)  # escape_url(self.citing_url_canonical())
+    cited_url = escape_url(cited_url)
+
+    return ''.join([
+                citing_quote, '|',                         # https://stackoverflow.com/questions/22601291/how-do-i-unescape-a-unicode-escaped-string-in-python
+                url_without_protocol(citing_url), '|',
+                url_without_protocol(cited_url)            # future: replace with: self.cited_url_canonical ?
+            ])
+
+
+def quote_hash(hashkey, encoding):
+    """ sha256 of a hashkey, encoded as the citing document is """
+    hash_method = getattr(hashlib, settings.HASH_ALGORITHM)
+    try:
+        hash = hash_method(hashkey.encode(encoding)).hexdigest()
+    except UnicodeEncodeError:
+        hash = ''   # TODO: research character encoding error
+    return hash
@@ -9,6 +9,11 @@
 # http://www.opensource.org/licenses/mit-license
 
 from lib.google_diff_match_patch.diff_match_patch import diff_match_patch
+from lib.citeit_quote_context.misc.timing import timed
+from lib.citeit_quote_context.text_store import StoredText
+from lib.citeit_quote_context.text_store import store
+from metrics import register_collector
+from metrics import lru_cache_collector
 from functools import lru_cache
 
 __author__ = 'Tim Langeman'
@@ -33,13 +38,15 @@ class QuoteContext:
         text_output=True,	 # output computed text version of url's text
         prior_quote_context_length=500,  # length of excerpt before quote
         after_quote_context_length=500,  # length of excerpt after quote
-        starting_location_guess=0  # guess used by google diff_match_patch
+        starting_location_guess=0,  # guess used by google diff_match_patch
+        quote_position=None  # already located (locate_in_pages()): -1 if not found
     ):
         self.quote = normalize_text(quote)
-        self.text = normalize_text(text)
+        self.text = normalize_text(text)  # a StoredText is stored normalized
         self.text_output = text_output
         self.prior_quote_context_length = prior_quote_context_length
         self.after_quote_context_length = after_quote_context_length
+        self.quote_position = quote_position
 
         if starting_location_guess:
             self.starting_location_guess = starting_location_guess
@@ -74,26 +81,14 @@ class QuoteContext:
             google diff_match_patch (Levenshtein) algorithm:
             https://en.wikipedia.org/wiki/Levenshtein_distance
         """
-        quote_locate = diff_match_patch()   # Levenshtein library, from google
-        quote_locate.Diff_Timeout = 5.0 	# Tweak this?
-        quote_locate.Match_Threshold = 0.5  # Tweak this?
-
-        # Guess a big distance so that starting guess location is unimportant
-        quote_locate.Match_Distance = (self.text_length() * 2)  # Tweak this?
+        if self.quote_position is not None:
+            return self.quote_position
 
         estimated_starting_location = 0
         if self.estimated_starting_location():
             estimated_starting_location = self.estimated_starting_location()
 
-        quote_start_position = quote_locate.match_bitap(
-            self.text,
-            self.quote,
-            estimated_starting_location
-        )
-        if (quote_start_position >= 0):
-            return quote_start_position
-        else:
-            return -1
+        return match_quote(self.text, self.quote, estimated_starting_location)
 
     @lru_cache(maxsize=8)
     def data(self):
@@ -177,6 +172,103 @@ class QuoteContext:
 # ################## Non-class functions #######################
 
 
+# Hits and misses of the quote context cache, for /metrics
+register_collector(lru_cache_collector('quote_context', QuoteContext.data))
+
+
+def match_quote(text, quote, starting_location=0):
+    """ Position of the closest match of quote within text, -1 if none """
+    # An exact quote is the best match: bitap would prefer a near miss
+    # closer to starting_location, and reads every character to find it
+    if text and quote:
+        position = text.find(quote, starting_location)
+        if position < 0 and starting_location:
+            position = text.find(quote)
+        if position >= 0:
+            return position
+
+    if isinstance(text, StoredText):
+        text = str(text)    # bitap is much faster on a str
+
+    quote_locate = diff_match_patch()   # Levenshtein library, from google
+    quote_locate.Diff_Timeout = 5.0 	# Tweak this?
+    quote_locate.Match_Threshold = 0.5  # Tweak this?
+
+    # Guess a big distance so that starting guess location is unimportant
+    quote_locate.Match_Distance = (len(text) * 2)  # Tweak this?
+
+    with timed('quote.bitap'):
+        quote_start_position = quote_locate.match_bitap(
+            text,
+            quote,
+            starting_location
+        )
+    if (quote_start_position >= 0):
+        return quote_start_position
+    else:
+        return -1
+
+
+def locate_in_pages(
+    quotes,
+    pages,
+    prior_quote_context_length=500,
+    after_quote_context_length=500,
+    separator='\n\n'
+):
+    """ Locate quotes in a long document (Document.pages()) as its pages
+        are read, and stop reading once every quote and its context is found
+
+        Each new page is searched together with the end of the text before
+        it, so a quote can span a page break.  Only exact quotes stop the
+        reading early: a quote that differs from the text (typography,
+        OCR errors) is matched in the whole text, as QuoteContext does.
+
+        Returns {quote: QuoteContext}: the text of each QuoteContext is
+        the text read so far (pages joined by separator), so positions
+        are the same as in the whole text.
+    """
+    quotes = list(quotes)
+    remaining = {quote: normalize_text(quote) for quote in quotes}
+    overlap = 2 * max([len(quote) for quote in remaining.values()] + [0])
+    found = {}      # quote -> position in text
+    text = ''
+
+    for page in pages:
+        window_start = max(0, len(text) - overlap)
+        if text:
+            text = text + separator + normalize_text(page)
+        else:   # leading whitespace is stripped, as in Document.text()
+            text = normalize_text(page).lstrip()
+
+        for (quote, normalized_quote) in list(remaining.items()):
+            position = text.find(normalized_quote, window_start)
+            if position >= 0:
+                found[quote] = position
+                del remaining[quote]
+
+        # QuoteContext.data() reads up to twice the length of the context after
+        if not remaining and all(
+            found[quote] + len(normalize_text(quote)) + 2 * after_quote_context_length <= len(text)
+            for quote in quotes
+        ):
+            break
+
+    # Not quoted exactly: the closest match in the whole text
+    for (quote, normalized_quote) in remaining.items():
+        found[quote] = match_quote(text, normalized_quote)
+
+    return {
+        quote: QuoteContext(
+            quote, store(text),
+            prior_quote_context_length=prior_quote_context_length,
+            after_quote_context_length=after_quote_context_length,
+            quote_position=found.get(quote, -1)
+        )
+        for quote in quotes
+    }
+
+
 def normalize_text(text):
     """ TODO: improve typography.
         This is a quick and dirty attempt to standardize characters.
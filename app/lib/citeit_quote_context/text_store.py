@@ -0,0 +1,198 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from functools import lru_cache
+import hashlib
+import logging
+import mmap
+import os
+import threading
+import time
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Content-addressed store of large document texts, read through mmap
+
+        text = store(document.text())   # StoredText, or the str if short
+        len(text), text[start:end], text.find(quote)
+
+    Texts of at least TEXT_STORE_MIN_LENGTH characters are written once
+    to TEXT_STORE_DIR/<sha256>.utf32 and mapped read-only: every process
+    reading the same text (pool workers, app servers) shares one copy in
+    the OS page cache, instead of each holding its own str.
+
+    Texts are stored as UTF-32 (little-endian, no BOM): every character
+    is 4 bytes, so a slice of characters is a slice of the file, and only
+    the characters sliced are decoded.
+
+    A StoredText is pickled as its key: a worker process maps the same
+    file rather than receiving a copy of the text.  Worker results return
+    their texts the same way; text() decodes each one once per process.
+
+    Once the store is larger than TEXT_STORE_MAX_SIZE, the texts least
+    recently stored are removed: see prune().
+"""
+
+ENCODING = 'utf-32-le'
+CHAR_SIZE = 4
+PRUNE_INTERVAL = 60     # seconds between prune() of a process
+
+last_pruned = 0
+
+
+def store(text):
+    """ The text, mapped from the store if it is long enough to be worth it """
+    if isinstance(text, StoredText) or len(text or '') < settings.TEXT_STORE_MIN_LENGTH:
+        return text
+    return get(put(text))
+
+
+def put(text):
+    """ Save text (unless already saved) and return its key """
+    key = hashlib.sha256(text.encode('utf-8', 'replace')).hexdigest()
+    path = text_path(key)
+    try:
+        os.utime(path)    # already saved: now the most recently stored
+    except FileNotFoundError:
+        # Write to a temporary file first: a reader never maps a partial text
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '%s.%s-%s.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(temp_path, 'wb') as text_file:
+            text_file.write(text.encode(ENCODING, 'replace'))   # one character per surrogate
+        os.replace(temp_path, path)
+        logger.debug("Stored text %s: %s characters", key, len(text))
+
+        if time.time() - last_pruned > PRUNE_INTERVAL:
+            prune()
+    return key
+
+
+def prune():
+    """ Remove the texts least recently stored until the store is no larger
+        than TEXT_STORE_MAX_SIZE.  Texts stored in the last TEXT_STORE_MIN_AGE
+        seconds are kept: tasks given their key may not have mapped them yet.
+        A process that already mapped a removed text keeps reading it.
+        Returns the number of texts removed
+    """
+    global last_pruned
+    last_pruned = time.time()
+
+    texts = []
+    for entry in os.scandir(settings.TEXT_STORE_DIR):
+        if entry.name.endswith('.utf32'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:   # removed by another process
+                continue
+            texts.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(text_size for (mtime, text_size, path) in texts)
+    removed = 0
+    for (mtime, text_size, path) in sorted(texts):
+        if size <= settings.TEXT_STORE_MAX_SIZE or mtime > last_pruned - settings.TEXT_STORE_MIN_AGE:
+            break
+        try:
+            os.remove(path)
+            removed = removed + 1
+        except FileNotFoundError:   # removed by another process
+            pass
+        size = size - text_size
+
+    if removed:
+        logger.info("Removed %s texts from the text store: %s bytes kept", removed, size)
+    return removed
+
+
+def text(value):
+    """ A text returned by store(), as a str: the citations of a page
+        (and of a source) share one str rather than each decoding its own
+    """
+    if isinstance(value, StoredText):
+        return decoded(value.key)
+    return value
+
+
+@lru_cache(maxsize=8)
+def decoded(key):
+    return str(get(key))
+
+
+@lru_cache(maxsize=50)
+def get(key):
+    """ StoredText of a saved text, mapped once per process """
+    return StoredText(key)
+
+
+def text_path(key):
+    return os.path.join(settings.TEXT_STORE_DIR, key + '.utf32')
+
+
+class StoredText:
+    """ Read-only text mapped from the store: supports len(), slices,
+        single characters and find(); str(text) decodes all of it
+    """
+
+    def __init__(self, key):
+        self.key = key
+        with open(text_path(key), 'rb') as text_file:
+            if os.fstat(text_file.fileno()).st_size:
+                self.buffer = mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.buffer = b''   # empty files can't be mapped
+
+    def __len__(self):
+        return len(self.buffer) // CHAR_SIZE
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return str(self)[index]
+            if stop <= start:
+                return ''
+            return self.buffer[start * CHAR_SIZE: stop * CHAR_SIZE].decode(ENCODING)
+
+        if index < 0:
+            index = index + len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('StoredText index out of range')
+        return self.buffer[index * CHAR_SIZE: (index + 1) * CHAR_SIZE].decode(ENCODING)
+
+    def find(self, sub, start=0, end=None):
+        """ Position of the first sub in text[start:end], -1 if none """
+        length = len(self)
+        start, end, step = slice(start, end).indices(length)
+        pattern = sub.encode(ENCODING, 'replace')
+
+        position = start * CHAR_SIZE
+        while True:
+            position = self.buffer.find(pattern, position, end * CHAR_SIZE)
+            if position < 0:
+                return -1
+            if position % CHAR_SIZE == 0:   # otherwise: bytes from two characters
+                return position // CHAR_SIZE
+            position = position + 1
+
+    def __str__(self):
+        return self[:]
+
+    def __reduce__(self):
+        return (get, (self.key,))
+
+    def __repr__(self):
+        return '<StoredText %s: %s characters>' % (self.key, len(self))
@@ -0,0 +1,172 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from array import array
+from bisect import bisect_right
+import logging
+import os
+import re
+import threading
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Cache of media transcripts (YouTube captions), with a timestamp index
+
+        transcript = load('youtube.com', video_id)     # None if not cached
+        transcript.text
+        transcript.seconds(position)    # start of the caption at a text position
+        transcript.lines()              # the lines the text is made of
+
+    TRANSCRIPT_CACHE_DIR/<provider>/<id>.txt    text of the transcript
+    TRANSCRIPT_CACHE_DIR/<provider>/<id>.cues   its cue index: two arrays of
+        unsigned 32 bit integers, the position in the text at which each
+        caption starts and its start time (milliseconds)
+    TRANSCRIPT_CACHE_DIR/<provider>/<id>.lines  position in the text at which
+        each line starts (unsigned 32 bit integers)
+
+    Only the plain text is cached: the separator between lines is added
+    by the caller, from lines().
+
+    A position is mapped to its caption by binary search of the offsets.
+"""
+
+# 00:01:02.500 --> 00:01:04.000 align:start position:0%  (hours are optional)
+CUE_TIMING = re.compile(r'(?:(\d+):)?(\d{2}):(\d{2})\.(\d{3}) --> ')
+
+
+class Transcript:
+
+    def __init__(self, text, offsets, starts, line_offsets=()):
+        self.text = text
+        self.offsets = offsets      # array('I'): position of each caption in text
+        self.starts = starts        # array('I'): start of each caption, milliseconds
+        self.line_offsets = line_offsets    # array('I'): position of each line in text
+
+    def lines(self):
+        """ (position, line) of each line of the text """
+        ends = list(self.line_offsets[1:]) + [len(self.text)]
+        return [
+            (start, self.text[start:end].strip())
+            for (start, end) in zip(self.line_offsets, ends)
+        ]
+
+    def seconds(self, position):
+        """ Start (seconds into the media) of the caption at a position of text """
+        n = bisect_right(self.offsets, position) - 1
+        if n < 0:
+            return 0.0 if self.starts else None
+        return self.starts[n] / 1000.0
+
+
+def load(provider, media_id):
+    """ The cached Transcript, or None """
+    path = transcript_path(provider, media_id)
+    try:
+        with open(path + '.txt', 'r', encoding='utf-8') as text_file:
+            text = text_file.read()
+        with open(path + '.cues', 'rb') as cues_file:
+            cues = array('I', cues_file.read())
+        with open(path + '.lines', 'rb') as lines_file:
+            line_offsets = array('I', lines_file.read())
+    except FileNotFoundError:   # or cached before lines were kept
+        return None
+
+    count = len(cues) // 2
+    return Transcript(text, cues[:count], cues[count:], line_offsets)
+
+
+def save(provider, media_id, text, cues, lines=()):
+    """ cues: (position in text, start in milliseconds) of each caption
+        lines: the lines text is made of, in order
+    """
+    path = transcript_path(provider, media_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    offsets = array('I', [position for (position, start) in cues])
+    starts = array('I', [start for (position, start) in cues])
+    line_offsets = array('I', line_positions(text, lines))
+
+    # The text is written last: load() finds all the files or none
+    write_file(path + '.cues', (offsets + starts).tobytes())
+    write_file(path + '.lines', line_offsets.tobytes())
+    write_file(path + '.txt', text.encode('utf-8'))
+    logger.debug("Cached transcript %s/%s: %s captions", provider, media_id, len(cues))
+    return Transcript(text, offsets, starts, line_offsets)
+
+
+def write_file(path, content):
+    # Write to a temporary file first: a reader never sees a partial file
+    temp_path = '%s.%s-%s.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'wb') as cache_file:
+        cache_file.write(content)
+    os.replace(temp_path, path)
+
+
+def transcript_path(provider, media_id):
+    return os.path.join(settings.TRANSCRIPT_CACHE_DIR, provider, media_id)
+
+
+def caption_lines(vtt):
+    """ (start in milliseconds, line) of each line of text of a WebVTT file """
+    lines = []
+    start = 0
+    for line in vtt.splitlines():
+        timing = CUE_TIMING.search(line)
+        if timing:
+            hours, minutes, seconds, milliseconds = timing.groups()
+            start = ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(milliseconds)
+        elif line.strip():
+            lines.append((start, line.strip()))
+    return lines
+
+
+def line_positions(text, lines):
+    """ Position in text at which each of the lines it is made of starts """
+    positions = []
+    position = 0
+    for line in lines:
+        found = text.find(line.strip(), position) if line.strip() else -1
+        if found >= 0:
+            positions.append(found)
+            position = found + len(line.strip())
+    return positions
+
+
+def index_lines(text, lines, captions, clean=lambda line: line):
+    """ Cues of the transcript text made of lines, from the captions they
+        were made from (caption_lines()).  clean(caption) is the caption
+        as it appears in lines.
+        Returns [(position in text, start in milliseconds)]
+    """
+    cues = []
+    position = 0
+    caption = 0
+    for line in lines:
+        line = line.strip()
+        found = text.find(line, position) if line else -1
+        if found < 0:
+            continue
+        position = found + len(line)
+
+        # The next caption with this text: captions and lines are in the same order
+        for n in range(caption, len(captions)):
+            if clean(captions[n][1]) == line:
+                caption = n + 1
+                cues.append((found, captions[n][0]))
+                break
+    return cues
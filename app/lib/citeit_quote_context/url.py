@@ -9,12 +9,19 @@
 
 from lib.citeit_quote_context.document import Document
 from lib.citeit_quote_context.quote import Quote
+from lib.citeit_quote_context.quote import quote_hash
+from lib.citeit_quote_context.quote import quote_hashkey
+from lib.citeit_quote_context.text_convert import html_to_text
+from lib.citeit_quote_context import text_store
+from lib.citeit_quote_context.misc.timing import record_quote_timings
+from metrics import flush as flush_metrics
+from persistence import content_hash
+import worker_pool
 from bs4 import BeautifulSoup
 from functools import lru_cache
-from multiprocessing import Pool
 from collections import Counter
 import time
-import settings
+import logging
 
 
 __author__ = 'Tim Langeman'
@@ -23,6 +30,11 @@ __copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
 __license__ = "MIT"
 __version__ = "0.4"
 
+logger = logging.getLogger(__name__)
+
+# Page-sized fields of the quote data, passed between processes by key
+TEXT_FIELDS = ['citing_text', 'citing_raw', 'cited_text', 'cited_raw']
+
 
 class URL:
     """
@@ -82,17 +94,24 @@ class URL:
 
         # print("Getting URLs")
         citations_list_dict = []
+        citing_text = None
+        citing_raw = None
         soup = BeautifulSoup(self.html(), 'html.parser')
 
         # Get all blockquote and q tags
         for cite in soup.find_all(['blockquote', 'q']):
             # print("Beautiful Soup: ", cite.get('cite'), cite.text)
             if cite.get('cite'):
+                if citing_text is None:
+                    # Long pages are passed to the pool by key, not copied into every task: see text_store.py
+                    citing_text = text_store.store(self.text)
+                    citing_raw = text_store.store(self.raw())
+
                 quote = {}
                 quote['citing_quote'] = cite.text
                 quote['citing_url'] = self.url
-                quote['citing_text'] = self.text
-                quote['citing_raw'] = self.raw()
+                quote['citing_text'] = citing_text
+                quote['citing_raw'] = citing_raw
                 quote['cited_url'] = cite.get('cite')
 
                 citations_list_dict.append(quote)
@@ -125,49 +144,149 @@ class URL:
 
         return duplicate_urls
 
-    def citations(self):
-        """ Return a list of Quote Lookup results for all citations on this page
-            Uses asychronous pool to achieve parallel processing
+    def citations(self, lookup=None):
+        """ Return a list of Quote Lookup results for all citations on this page,
+            in the order they appear on the page.  See: iter_citations()
+        """
+        results = dict(self.iter_citations(lookup))
+        result_list = [results[n] for n in sorted(results.keys())]
+        return result_list
+
+    def prepare_citations(self, lookup=None):
+        """ Split the citations on this page into those that can be returned
+            from storage and those whose context must be computed
+            (see iter_citations for lookup)
+            Returns two lists:
+                ready:      (position on page, stored quote data)
+                recompute:  (position on page, quote keys for load_quote_data())
+        """
+        citations_list_dict = self.citations_list_dict()
+
+        stored = {}
+        if lookup:
+            encoding = self.doc().encoding_lookup()
+            for quote in citations_list_dict:
+                quote['hashkey'] = quote_hashkey(
+                    html_to_text(quote['citing_quote']), quote['citing_url'], quote['cited_url']
+                )
+                quote['sha256'] = quote_hash(quote['hashkey'], encoding)
+            stored = lookup([quote['sha256'] for quote in citations_list_dict])
+
+        # Quote.data() saves the text version of the citing page
+        citing_content_hash = content_hash(html_to_text(self.text))
+
+        ready = []
+        recompute = []
+        for n, quote in enumerate(citations_list_dict):
+            quote_data = stored.get(quote.get('sha256'))
+            if quote_data and quote_data['citing_content_hash'] == citing_content_hash:
+                if quote_data['fresh']:
+                    ready.append((n, dict(quote_data, hashkey=quote['hashkey'], cached='fresh')))
+                    continue
+                quote['stored'] = dict(quote_data, hashkey=quote['hashkey'])   # verify in load_quote_data()
+            recompute.append((n, quote))
+
+        return ready, recompute
+
+    def iter_citations(self, lookup=None):
+        """ Yield (position on page, quote data) for each citation on this page
+            as soon as it is ready, rather than after the slowest source.
+            Uses the worker pool (worker_pool.py) to achieve parallel processing
             calls load_quote_data() function
             for all values in self.citations_list_dict
-            using python 'map' function
+
+            lookup: optional function: list of sha256 -> {sha256: stored quote data}
+            Stored quotes are returned without recomputing their context if
+            the citing page is unchanged and either:
+                * the stored data is 'fresh' (checked recently), or
+                * the cited page is downloaded and its text is unchanged
+            Results taken from storage have a 'cached' key: 'fresh' or 'verified'
         """
-        result_list = []
+        ready, recompute = self.prepare_citations(lookup)
+        for n, quote_data in ready:
+            yield n, quote_data
+
+        if not recompute:
+            return
 
         # Pre-fetch and cache URL if it is found in more than one quote
         # this prevents sources from being clobbered with multiple requests in parallel
-        for url in self.citations_list_duplicates():
-            d = Document(url)
-            d.download_resource()  # request and cache result so parallel requests come from cache
-
-        # Load Quote data in parallel:
-        citations_list_dict = self.citations_list_dict()
+        cited_urls = Counter(quote['cited_url'] for (n, quote) in recompute)
+        for url, count in cited_urls.items():
+            if count > 1:
+                prefetch_document(url)  # request and cache result so parallel requests come from cache
 
-        pool = Pool(processes=settings.NUM_DOWNLOAD_PROCESSES)
-        # try:
-        result_list = pool.map(load_quote_data, citations_list_dict)
-        # except (NameError, ValueError):
-        # TODO: add better error handling
-        # print("Skipping map value ..")
-        pool.close()
-        pool.join()
-        return result_list
+        # Load Quote data in parallel, in the order it completes:
+        for n, quote_data in worker_pool.imap_unordered(load_numbered_quote_data, recompute):
+            record_quote_timings(quote_data)
+            yield n, join_texts(quote_data)
 
 
 # ################## Non-class functions #######################
 
 
+def prefetch_document(url):
+    """ Download a document into the local cache, so that later
+        Document(url) calls (from any worker process) read the cached copy
+    """
+    Document(url).download_resource()
+    flush_metrics(force=True)      # pool processes: see metrics.py
+    return url
+
+
+def load_numbered_quote_data(numbered_quote_keys):
+    """ load_quote_data() for imap_unordered(): returns (key, quote data),
+        where the key (position on page) identifies the quote
+    """
+    n, quote_keys = numbered_quote_keys
+    quote_data = load_quote_data(quote_keys)
+    flush_metrics(force=True)      # pool processes: see metrics.py
+    return n, quote_data
+
+
 def load_quote_data(quote_keys):
     """ lookup quote data, from keys """
-    print("Downloading citation for: " + quote_keys['citing_quote'])
-    print("Downloading citation url: " + quote_keys['cited_url'])
+    logger.debug("Loading quote from %s", quote_keys['cited_url'])
+
+    # Stored context is still valid if the cited text hasn't changed
+    stored = quote_keys.get('stored')
+    if stored:
+        cited_text = Document(quote_keys['cited_url']).text()
+        if content_hash(cited_text) == stored['cited_content_hash']:
+            return dict(stored, cached='verified')
+
     quote = Quote(
                  quote_keys['citing_quote'],
                  quote_keys['citing_url'],
                  quote_keys['cited_url'],
-                 quote_keys['citing_text'],  # optional: caching
-                 quote_keys['citing_raw']    # optional: caching
+                 str(quote_keys['citing_text']),  # optional: caching
+                 str(quote_keys['citing_raw'])    # optional: caching
              )
 
-    return quote.data()
+    # The texts go back to the parent by key, as the citing ones came:
+    # see join_texts()
+    quote_data = dict(quote.data())
+    for field in TEXT_FIELDS:
+        if isinstance(quote_data.get(field), str):
+            quote_data[field] = text_store.store(quote_data[field])
+    return quote_data
+
+
+def join_texts(quote_data):
+    """ The texts of a load_quote_data() result, as str: the parent holds
+        one copy of each page, shared by the citations that quote it
+    """
+    for field in TEXT_FIELDS:
+        if field in quote_data:
+            quote_data[field] = text_store.text(quote_data[field])
+    return quote_data
 
+
+
+def read_cited_text(url):
+    """ Full text of a cited document, read after the request that quoted
+        it: see cited_texts.py.  Returns (url, text)
+    """
+    text = text_store.store(Document(url).text())
+    flush_metrics(force=True)      # pool processes: see metrics.py
+    return url, text
@@ -0,0 +1,279 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from lib.citeit_quote_context.misc.timing import histograms, BUCKETS
+from contextlib import contextmanager
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Runtime metrics, served in the Prometheus text format at /metrics
+
+    Requests are handled by several gunicorn workers, and quotes are
+    computed in pool processes, so each process keeps its own metrics
+    and writes them to METRICS_DIR/<pid>-<id>.json:
+
+        * after each request and each pool task
+        * otherwise at most every METRICS_FLUSH_SECONDS
+
+    /metrics adds up the files of every process.  The files of processes
+    that have exited are merged into archive.json, so their counts aren't
+    lost; their gauges are dropped.
+
+    Series:
+        counters:     inc('citeit_fetches_total', status='200')
+        gauges:       set_gauge('citeit_requests_in_progress', 2)
+        collected:    cumulative counts read from other objects
+                      (lru_cache and TTLCache statistics): register_collector()
+        histograms:   misc/timing.py: citeit_stage_seconds{stage=".."}
+"""
+
+ARCHIVE = 'archive.json'
+
+
+class Metrics:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._collectors = []
+        self._pid = None
+        self.reset()
+
+    def reset(self):
+        """ New process (or fork): start from zero.  A forked process
+            inherits its parent's counts, which the parent reports itself.
+        """
+        self._pid = os.getpid()
+        self._file = os.path.join(self.directory, '%s-%s.json' % (self._pid, uuid.uuid4().hex[:8]))
+        self._counters = {}
+        self._gauges = {}
+        self._flushed = 0
+        histograms.clear()
+        self._baseline = self.collect_registered(baseline={})
+
+    def check_pid(self):
+        if self._pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, value=1, **labels):
+        key = series(name, labels)
+        with self._lock:
+            self.check_pid()
+            self._counters[key] = self._counters.get(key, 0) + value
+        self.flush()
+
+    def set_gauge(self, name, value, **labels):
+        key = series(name, labels)
+        with self._lock:
+            self.check_pid()
+            self._gauges[key] = value
+
+    def add_gauge(self, name, value, **labels):
+        key = series(name, labels)
+        with self._lock:
+            self.check_pid()
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def register_collector(self, collector):
+        """ collector(): {(name, labels dict as tuple of pairs): cumulative count} """
+        self._collectors.append(collector)
+        self._baseline.update(self.collect_registered(baseline={}, collectors=[collector]))
+
+    def collect_registered(self, baseline, collectors=None):
+        values = {}
+        for collector in (self._collectors if collectors is None else collectors):
+            for ((name, labels), value) in collector().items():
+                key = series(name, dict(labels))
+                values[key] = value - baseline.get(key, 0)
+        return values
+
+    def snapshot(self):
+        self.check_pid()
+        with self._lock:
+            return {
+                'pid': self._pid,
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'collected': self.collect_registered(self._baseline),
+                'histograms': histograms.snapshot(),
+            }
+
+    def flush(self, force=False):
+        """ Write this process's metrics (at most every METRICS_FLUSH_SECONDS
+            unless forced)
+        """
+        if not settings.METRICS_ENABLED:
+            return
+        if not force and time.time() - self._flushed < settings.METRICS_FLUSH_SECONDS:
+            return
+
+        self._flushed = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        write_json(self._file, self.snapshot())
+
+    def collect(self):
+        """ Metrics of every process: live processes plus the archive """
+        self.flush(force=True)
+        with directory_lock(self.directory):
+            total = read_json(os.path.join(self.directory, ARCHIVE)) or empty_snapshot()
+            archive = None
+
+            for filename in glob.glob(os.path.join(self.directory, '*-*.json')):
+                snapshot = read_json(filename)
+                if snapshot is None:
+                    continue
+
+                if pid_exists(snapshot['pid']):
+                    merge(total, snapshot, gauges=True)
+                else:
+                    archive = archive or read_json(os.path.join(self.directory, ARCHIVE)) or empty_snapshot()
+                    merge(archive, snapshot, gauges=False)
+                    merge(total, snapshot, gauges=False)
+                    os.remove(filename)
+
+            if archive is not None:
+                write_json(os.path.join(self.directory, ARCHIVE), archive)
+        return total
+
+
+def series(name, labels):
+    """ Prometheus series name: citeit_fetches_total{status="200"} """
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join(
+        '%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for (label, value) in sorted(labels.items())
+    ))
+
+
+def empty_snapshot():
+    return {'counters': {}, 'gauges': {}, 'collected': {}, 'histograms': {}}
+
+
+def merge(total, snapshot, gauges):
+    for field in ('counters', 'collected') + (('gauges',) if gauges else ()):
+        for (key, value) in snapshot[field].items():
+            total[field][key] = total[field].get(key, 0) + value
+
+    for (name, histogram) in snapshot['histograms'].items():
+        merged = total['histograms'].setdefault(
+            name, {'buckets': [0] * len(histogram['buckets']), 'sum': 0, 'count': 0}
+        )
+        merged['buckets'] = [a + b for (a, b) in zip(merged['buckets'], histogram['buckets'])]
+        merged['sum'] = merged['sum'] + histogram['sum']
+        merged['count'] = merged['count'] + histogram['count']
+
+
+def render(total):
+    """ Prometheus text exposition format """
+    lines = []
+    for (key, value) in sorted(list(total['counters'].items()) + list(total['collected'].items())):
+        lines.append('%s %s' % (key, value))
+    for (key, value) in sorted(total['gauges'].items()):
+        lines.append('%s %s' % (key, value))
+
+    if total['histograms']:
+        lines.append('# TYPE citeit_stage_seconds histogram')
+    for (stage, histogram) in sorted(total['histograms'].items()):
+        for (bound, count) in zip(BUCKETS, histogram['buckets']):
+            lines.append('citeit_stage_seconds_bucket{stage="%s",le="%s"} %s' % (stage, bound, count))
+        lines.append('citeit_stage_seconds_bucket{stage="%s",le="+Inf"} %s' % (stage, histogram['count']))
+        lines.append('citeit_stage_seconds_sum{stage="%s"} %s' % (stage, histogram['sum']))
+        lines.append('citeit_stage_seconds_count{stage="%s"} %s' % (stage, histogram['count']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def directory_lock(directory):
+    """ One process at a time merges the files of exited processes """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_json(filename):
+    try:
+        with open(filename, 'r') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(filename, data):
+    """ Write to a temporary file first: readers never see a partial file """
+    temp_path = '%s.%s.tmp' % (filename, threading.get_ident())
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_path, filename)
+
+
+def clear_directory(directory=None):
+    """ Start counting from zero: run once, before any worker starts """
+    for filename in glob.glob(os.path.join(directory or settings.METRICS_DIR, '*.json')):
+        os.remove(filename)
+
+
+def lru_cache_collector(cache_name, cached_function):
+    """ Hits and misses of a functools.lru_cache """
+    def collector():
+        info = cached_function.cache_info()
+        return {
+            ('citeit_cache_total', (('cache', cache_name), ('result', 'hit'))): info.hits,
+            ('citeit_cache_total', (('cache', cache_name), ('result', 'miss'))): info.misses,
+        }
+    return collector
+
+
+def ttl_cache_collector(cache_name, cache):
+    """ Hits and misses of a cache.TTLCache """
+    def collector():
+        return {
+            ('citeit_cache_total', (('cache', cache_name), ('result', 'hit'))): cache.hits,
+            ('citeit_cache_total', (('cache', cache_name), ('result', 'miss'))): cache.misses,
+        }
+    return collector
+
+
+metrics = Metrics(settings.METRICS_DIR)
+
+inc = metrics.inc
+set_gauge = metrics.set_gauge
+add_gauge = metrics.add_gauge
+register_collector = metrics.register_collector
+flush = metrics.flush
+collect = metrics.collect
@@ -7,10 +7,7 @@
 # The code for this server library is released under the MIT License:
 # http://www.opensource.org/licenses/mit-license
 
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-
-from sqlalchemy import create_engine, MetaData, Table, \
+from sqlalchemy import MetaData, Table, \
     Integer, BigInteger, LargeBinary, UnicodeText, String, Column, DateTime, \
     PrimaryKeyConstraint, UniqueConstraint, Sequence, Index, ForeignKey, \
     Boolean, null, orm, Unicode, func
@@ -31,24 +28,20 @@ import settings
 import pymysql
 pymysql.install_as_MySQLdb
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = settings.SQLALCHEMY_DATABASE_URI
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URI)
-
+# Tables are bound to the shared engine in database.py
+# and created by database.init_db()
 Base = declarative_base()
 
-################################# New: Database Connection Error
-Base.metadata.drop_all(engine)
+# SQLite (local development) only auto-increments INTEGER primary keys
+PrimaryKeyId = BigInteger().with_variant(Integer(), 'sqlite')
 
 class Domain(Base):
     __tablename__ = 'domain'
 
-    id = Column(BigInteger(), Sequence('document_id_seq'))  
+    id = Column(PrimaryKeyId, Sequence('document_id_seq'))  
     domain_url = Column(String(255), nullable=False)    #2048
-    owner_user = Column(BigInteger(), ForeignKey('user.id'), nullable=False )
+    domain_reversed = Column(String(256), nullable=True)  # 'com.example.www.': see reverse_domain()
+    owner_user = Column(BigInteger(), ForeignKey('user.id'), nullable=True )  # cited domains have no owner
 
     __table_args__ = (
         PrimaryKeyConstraint('id', name='domain_pk'),
@@ -58,6 +51,9 @@ class Domain(Base):
         Index('domain_domain_url_unique', (domain_url) , unique=True),
         Index('domain_domain_url', 'domain_url', mysql_length=100),
         Index('domain_owner_user_index', 'owner_user'),
+
+        # Subdomain search: domain_reversed LIKE 'com.example.%'
+        Index('domain_domain_reversed_index', 'domain_reversed', mysql_length=100),
     )
 
     def __repr__(self):
@@ -73,6 +69,8 @@ class Request(Base):
         (u'posts-cited-by', u'Get Posts Cited by this URL/Domain'), # url, start_date, end_date, (default to latest), citation_terms, context_terms, tags, document_terms, search_type, max_results
         (u'posts-citing', u'Get Posts that Cite this URL'),         # url, start_date, end_date, (default to latest), citation_terms, context_terms, tags, document_terms, search_type, max_results
         (u'archives-of-url', u'Get Archive of URL'),                # url, start_date, end_date, max_results
+        (u'search', u'Search Citations'),                           # citation_terms, context_terms, document_terms, max_results
+        (u'post-url-batch', u'Post a Batch of URLs'),               # urls
     ]
     SEARCH_TYPES = [
         (u'url', u'URL'),
@@ -82,7 +80,7 @@ class Request(Base):
 
     __tablename__ = 'request'
 
-    id = Column(BigInteger(), Sequence('request_id_seq'))
+    id = Column(PrimaryKeyId, Sequence('request_id_seq'))
     ip_address = Column(IPAddressType, nullable=False)
     request_type = Column(ChoiceType(REQUEST_TYPES))
     request_url = Column(String(2048), nullable=False)
@@ -108,14 +106,90 @@ class Request(Base):
         )
 
 
+class RequestIdBlock(Base):
+    """ A block of request ids, reserved by a server process: see request_log.py """
+    __tablename__ = 'request_id_block'
+
+    id = Column(PrimaryKeyId, Sequence('request_id_block_seq'))
+    create_date = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        nullable=False
+    )
+
+    __table_args__ = (
+        PrimaryKeyConstraint('id', name='request_id_block_pk'),
+    )
+
+
+class BatchJob(Base):
+    """ A batch of citing urls submitted together: see batch.py """
+    STATUSES = [
+        (u'queued', u'Queued'),
+        (u'running', u'Running'),
+        (u'done', u'Done'),
+        (u'error', u'Error'),
+    ]
+
+    __tablename__ = 'batch_job'
+
+    id = Column(String(32), nullable=False)          # uuid4 hex: the job id given to the client
+    request_id = Column(BigInteger(), nullable=True)
+    status = Column(ChoiceType(STATUSES), nullable=False)
+    url_count = Column(Integer, nullable=False)
+    source_count = Column(Integer, nullable=False, default=0)    # distinct cited urls to fetch
+    sources_fetched = Column(Integer, nullable=False, default=0)
+    create_date = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        nullable=False
+    )
+    finish_date = Column(DateTime(timezone=True), nullable=True)
+    worker = Column(String(128), nullable=True)     # host:pid running the job: see batch.recover_jobs()
+
+    __table_args__ = (
+        PrimaryKeyConstraint('id', name='batch_job_pk'),
+        Index('batch_job_create_date_index', 'create_date'),
+    )
+
+    def __repr__(self):
+        return "<BatchJob(id='%s', status='%s')>" % (
+            self.id,
+            self.status
+        )
+
+
+class BatchJobUrl(Base):
+    """ Progress of one citing url of a BatchJob """
+    __tablename__ = 'batch_job_url'
+
+    job_id = Column(String(32), ForeignKey('batch_job.id'), nullable=False)
+    position = Column(Integer, nullable=False)        # order the url was submitted in
+    url = Column(String(2048), nullable=False)
+    status = Column(ChoiceType(BatchJob.STATUSES), nullable=False)
+    citation_count = Column(Integer, nullable=True)
+    error = Column(String(2048), nullable=True)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('job_id', 'position', name='batch_job_url_pk'),
+    )
+
+    def __repr__(self):
+        return "<BatchJobUrl(job_id='%s', url='%s', status='%s')>" % (
+            self.job_id,
+            self.url,
+            self.status
+        )
+
+
 class Citation(Base):
     __tablename__ = 'citation'
 
-    id = Column(BigInteger(), Sequence('citation_id_seq'))
-    request_id = Column(BigInteger(), ForeignKey('request.id'), index=True, nullable=False)
+    id = Column(PrimaryKeyId, Sequence('citation_id_seq'))
+    request_id = Column(BigInteger(), ForeignKey('request.id'), index=True, nullable=True)  # request log rows may be dropped under load
     sha256 = Column(String(64), nullable=False, index=True, unique=True)
 
-    citing_domain_id = Column(BigInteger(), ForeignKey('domain.id'), index=True, nullable=False)
+    citing_domain_id = Column(BigInteger(), ForeignKey('domain.id'), nullable=False)
     citing_document = Column(BigInteger(), ForeignKey('document.id'), nullable=False)
     citing_url = Column(String(2048), nullable=False)
     citing_url_canonical = Column(String(2048), nullable=False)
@@ -123,9 +197,10 @@ class Citation(Base):
     citing_context_before = Column(UnicodeText)
     citing_context_after = Column(UnicodeText)
 
-    cited_domain_id = Column(BigInteger(), ForeignKey('domain.id'), index=True, nullable=False)
+    cited_domain_id = Column(BigInteger(), ForeignKey('domain.id'), nullable=False)
     cited_document = Column(BigInteger(), ForeignKey('document.id'), nullable=False)
     cited_url = Column(String(2048), nullable=False)
+    cited_url_canonical = Column(String(2048), nullable=True)
     cited_quote = Column(String(2048), nullable=False)
     cited_context_before = Column(UnicodeText(), nullable=True)
     cited_context_after = Column(UnicodeText(), nullable=True)
@@ -135,21 +210,29 @@ class Citation(Base):
         default=datetime.utcnow,
         nullable=False
     )
+    # Last time the context was computed or checked against the cited document
+    update_date = Column(DateTime(timezone=True), nullable=True)
 
     __table_args__ = (
         PrimaryKeyConstraint('id', name='citation_pk'),
         UniqueConstraint('sha256', name='citation_sha256_unique'),
         Index('citation_request_id_index', 'request_id'),
         
-        Index('citation_citing_domain_id_index', 'citing_domain_id'),
+        # Composite indexes serve the 'posts-cited-by' and 'posts-citing'
+        # requests: filter on the url/domain, then page through create_date
+        # without sorting (see queries.py)
+        Index('citation_citing_domain_id_create_date_index', 'citing_domain_id', 'create_date', 'id'),
         Index('citation_citing_document_index', 'citing_document'),
         Index('citation_citing_url_index', 'citing_url', mysql_length=256),
-        Index('citation_citing_url_canonical_index', 'citing_url_canonical', mysql_length=256),
+        Index('citation_citing_url_canonical_create_date_index', 'citing_url_canonical', 'create_date', 'id',
+              mysql_length={'citing_url_canonical': 255}),
         Index('citation_citing_quote_index', 'citing_quote', mysql_length=256),
 
-        Index('citation_cited_domain_index', 'cited_domain_id'),
+        Index('citation_cited_domain_id_create_date_index', 'cited_domain_id', 'create_date', 'id'),
         Index('citation_cited_document_index', 'cited_document'),
         Index('citation_cited_url_index', 'cited_url', mysql_length=256),
+        Index('citation_cited_url_canonical_create_date_index', 'cited_url_canonical', 'create_date', 'id',
+              mysql_length={'cited_url_canonical': 255}),
         Index('citation_cited_quote_index', 'cited_quote', mysql_length=256),
         Index('citation_create_date_index', 'create_date')
 
@@ -179,10 +262,11 @@ class Citation(Base):
 class Document(Base):
     __tablename__ = 'document'
 
-    id = Column(BigInteger(), Sequence('document_id_seq'))  
-    request_id = Column(BigInteger(), ForeignKey('request.id'), index=True, nullable=False)
+    id = Column(PrimaryKeyId, Sequence('document_id_seq'))  
+    request_id = Column(BigInteger(), ForeignKey('request.id'), index=True, nullable=True)  # request log rows may be dropped under load
     domain_id = Column(BigInteger(), nullable=False)
     url = Column(String(2048), nullable=False)
+    url_hash = Column(String(64), nullable=True)     # unique with content_hash: see persistence.url_hash()
     content_type = Column(String(50), nullable=False)
     title = Column(String(256), nullable=True)
     body_binary = Column(LargeBinary, nullable=True)
@@ -192,6 +276,13 @@ class Document(Base):
     language = Column(String(16), nullable=False)
     word_count = Column(Integer, nullable=False)
     content_hash = Column(String(64), nullable=False)
+
+    # Archived versions store their text as a delta against a newer version
+    # See: document_versions.py
+    body_text_delta = Column(UnicodeText, nullable=True)
+    body_html_delta = Column(UnicodeText, nullable=True)
+    delta_base_id = Column(BigInteger(), nullable=True)
+
     create_date = Column(
         DateTime(timezone=True),
         index=True,
@@ -201,7 +292,7 @@ class Document(Base):
     end_date = Column(
         DateTime(timezone=True),
         index=True,
-        default=null,
+        default=None,
         nullable=True
     )
 
@@ -210,7 +301,10 @@ class Document(Base):
         Index('document_request_id_index', 'request_id'),
         Index('document_domain_id_index', 'domain_id'),
         Index('document_url_index', 'url', mysql_length=256),
-        # Index('document_content_hash_unique_index', 'content_hash', 'domain_id' ),
+        # A document is only stored again when its content changes: see persistence.save_documents()
+        # (the url is hashed: MySQL can only index its first 255 characters)
+        Index('document_url_hash_content_hash_unique', 'url_hash', 'content_hash', unique=True),
+        Index('document_url_create_date_index', 'url', 'create_date', 'id', mysql_length={'url': 255}),
 
         {  # Partitioning: https://groups.google.com/g/sqlalchemy/c/qCQFD2LNyTQ
         'info': {
@@ -235,7 +329,7 @@ class Document(Base):
 class Tag(Base):
     __tablename__ = 'tag'
 
-    id = Column(BigInteger(), Sequence('tag_id_seq'))
+    id = Column(PrimaryKeyId, Sequence('tag_id_seq'))
     tag = Column(String(100), unique=True, nullable=False)
     parent_id = Column(BigInteger(), ForeignKey('tag.id'), nullable=False)
     create_date = Column(
@@ -279,7 +373,7 @@ class CitationTag(Base):
 class User(Base):
     __tablename__ = 'user'
 
-    id = Column(BigInteger, Sequence('user_id_seq') )
+    id = Column(PrimaryKeyId, Sequence('user_id_seq') )
     email = Column(EmailType, nullable=False)
     first_name = Column(String(25), nullable=True)
     last_name = Column(String(35), nullable=True)
@@ -320,16 +414,10 @@ class User(Base):
 
 
 
-Base.metadata.drop_all(engine)
-Base.metadata.create_all(engine)
-db.session.commit()
-
-
 """
 # ADDITIONAL NATIVE DATABASE COMMANDS:
 
-# CREATE FULLTEXT INDEX document_body_text
-# ON Document(body_text);
+# Full-text indexes (FULLTEXT, GIN, FTS5) are created by search.py
 """
 
 
@@ -0,0 +1,480 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from models import Domain, Document, Citation
+from sqlalchemy.orm import aliased
+from sqlalchemy import func, inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Insert
+from cache import TTLCache
+from document_versions import archive_previous_versions
+from lib.citeit_quote_context.misc.timing import timed
+from metrics import inc, register_collector, ttl_cache_collector
+from request_log import request_log
+from urllib.parse import urlparse
+from datetime import datetime, timedelta
+import hashlib
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Bulk persistence of the results of one URL.citations() run.
+
+    Instead of a query-then-insert per citation, document and domain,
+    each table is written with a single multi-row statement:
+
+        1. domains:    1 select (+ 1 insert of unknown domains)
+        2. documents:  1 upsert + 1 select of the resulting ids
+                       + 1 select for new versions (document_versions.py)
+        3. citations:  1 upsert
+
+    so a page with 40 citations costs a handful of round trips, not 120.
+    Existing rows are matched on citation.sha256 and
+    document(url_hash, content_hash) using the database's native
+    INSERT .. ON CONFLICT / ON DUPLICATE KEY UPDATE.
+"""
+
+# domain_url -> domain.id: shared by request logging, document and citation persistence
+domain_cache = TTLCache(
+    maxsize=settings.DOMAIN_CACHE_SIZE,
+    ttl=settings.DOMAIN_CACHE_TTL
+)
+register_collector(ttl_cache_collector('domain', domain_cache))
+
+# Columns refreshed when a citation with the same sha256 is saved again
+CITATION_UPDATE_COLUMNS = [
+    'citing_domain_id', 'citing_document',
+    'citing_url', 'citing_url_canonical',
+    'citing_quote', 'citing_context_before', 'citing_context_after',
+    'cited_domain_id', 'cited_document',
+    'cited_url', 'cited_url_canonical',
+    'cited_quote', 'cited_context_before', 'cited_context_after',
+    'update_date',
+]
+
+
+def save_citations(session, citations, request_id):
+    """ Save every citation returned by URL.citations() in one transaction
+        Returns the list of sha256 keys saved
+    """
+    citation_rows = {}
+    documents = {}
+
+    # Citations without a hash can't be identified: skip them
+    citations = [c for c in citations if c.get('sha256')]
+    if not citations:
+        return []
+
+    # Collect the distinct citing and cited documents
+    for citation in citations:
+        for side in ('citing', 'cited'):
+            row = document_row(
+                url=citation[side + '_url'],
+                text=citation.get(side + '_text', ''),
+                raw=citation.get(side + '_raw', ''),
+                content_type=citation.get(side + '_content_type', ''),
+                encoding=citation.get(side + '_encoding', ''),
+                language=citation.get(side + '_language', ''),
+                request_id=request_id,
+            )
+            documents[(row['url'], row['content_hash'])] = row
+
+    domain_ids = lookup_domain_ids(
+        session,
+        [domain_url(url) for (url, content_hash) in documents.keys()]
+    )
+    document_ids = save_documents(session, list(documents.values()), domain_ids)
+
+    for citation in citations:
+        citing_key = (citation['citing_url'], content_hash(citation.get('citing_text', '')))
+        cited_key = (citation['cited_url'], content_hash(citation.get('cited_text', '')))
+
+        # The same quote may appear twice on a page: keep the last one
+        citation_rows[citation['sha256']] = {
+            'request_id': request_id,
+            'sha256': citation['sha256'],
+            'citing_domain_id': domain_ids[domain_url(citation['citing_url'])],
+            'citing_document': document_ids[citing_key],
+            'citing_url': citation['citing_url'],
+            'citing_url_canonical': citation.get('citing_url_canonical', ''),
+            'citing_quote': citation['citing_quote'],
+            'citing_context_before': citation.get('citing_context_before', ''),
+            'citing_context_after': citation.get('citing_context_after', ''),
+            'cited_domain_id': domain_ids[domain_url(citation['cited_url'])],
+            'cited_document': document_ids[cited_key],
+            'cited_url': citation['cited_url'],
+            'cited_url_canonical': citation.get('cited_url_canonical', ''),
+            'cited_quote': citation.get('cited_quote', ''),
+            'cited_context_before': citation.get('cited_context_before', ''),
+            'cited_context_after': citation.get('cited_context_after', ''),
+            'create_date': datetime.utcnow(),
+            'update_date': datetime.utcnow(),
+        }
+
+    session.execute(upsert(
+        session,
+        Citation.__table__,
+        list(citation_rows.values()),
+        index_elements=['sha256'],
+        update_columns=CITATION_UPDATE_COLUMNS,
+    ))
+    session.commit()
+
+    return list(citation_rows.keys())
+
+
+def save_citation_results(session, citations, request_id):
+    """ Save the results of URL.citations(): new citations are saved,
+        stored citations that were verified are marked as current.
+        Citations with an error (Quote.error()) are skipped: their
+        stored context is kept
+    """
+    with timed('request.db'):
+        new_citations = [c for c in citations if not c.get('cached') and not c.get('error')]
+        if new_citations and request_id:
+            # They reference the request row: not if it was dropped or lost
+            if not request_log.flush(request_id):
+                request_id = None
+
+        # Cited PDFs not read to the end: saved once they are (cited_texts.py)
+        unread = [c for c in new_citations if c.get('cited_text', '') is None]
+        if unread:
+            import cited_texts     # imports url.py, which imports this module
+            cited_texts.save_later(unread, request_id)
+            new_citations = [c for c in new_citations if c.get('cited_text', '') is not None]
+
+        save_citations(session, new_citations, request_id)
+        touch_citations(session, [c['sha256'] for c in citations if c.get('cached') == 'verified'])
+
+    for citation in citations:
+        source = 'error' if citation.get('error') else citation.get('cached') or 'computed'
+        inc('citeit_citations_total', source=source)
+
+
+def stored_citations(session, sha256_list):
+    """ Lookup for URL.citations(): saved context of the given quotes
+        Returns a dictionary: sha256 -> quote data, including
+            * citing_content_hash, cited_content_hash:  the document
+              versions the context was computed from
+            * fresh: checked against the cited document within
+              settings.CITATION_CACHE_TTL seconds
+    """
+    if not sha256_list:
+        return {}
+
+    citing_document = aliased(Document)
+    cited_document = aliased(Document)
+    checked = datetime.utcnow() - timedelta(seconds=settings.CITATION_CACHE_TTL)
+
+    rows = session.query(
+            Citation.sha256,
+            Citation.citing_url, Citation.citing_url_canonical, Citation.citing_quote,
+            Citation.citing_context_before, Citation.citing_context_after,
+            Citation.cited_url, Citation.cited_url_canonical, Citation.cited_quote,
+            Citation.cited_context_before, Citation.cited_context_after,
+            citing_document.content_hash.label('citing_content_hash'),
+            cited_document.content_hash.label('cited_content_hash'),
+            (func.coalesce(Citation.update_date, Citation.create_date) >= checked).label('fresh'),
+        ) \
+        .join(citing_document, citing_document.id == Citation.citing_document) \
+        .join(cited_document, cited_document.id == Citation.cited_document) \
+        .filter(Citation.sha256.in_(set(sha256_list)))
+
+    stored = {}
+    for row in rows:
+        quote_data = row._asdict()
+        quote_data['fresh'] = bool(quote_data['fresh'])
+        stored[row.sha256] = quote_data
+    return stored
+
+
+def touch_citations(session, sha256_list):
+    """ Record that stored citations were checked and are still current """
+    if not sha256_list:
+        return
+
+    session.query(Citation) \
+        .filter(Citation.sha256.in_(set(sha256_list))) \
+        .update({Citation.update_date: datetime.utcnow()}, synchronize_session=False)
+    session.commit()
+
+
+def save_documents(session, rows, domain_ids=None):
+    """ Insert documents that haven't been seen with this content before.
+        Returns a dictionary: (url, content_hash) -> document.id
+    """
+    if not rows:
+        return {}
+
+    if domain_ids is None:
+        domain_ids = lookup_domain_ids(session, [domain_url(row['url']) for row in rows])
+
+    for row in rows:
+        row['domain_id'] = domain_ids[domain_url(row['url'])]
+
+    # Same url and content hash: the stored copy is already current
+    session.execute(upsert(
+        session,
+        Document.__table__,
+        rows,
+        index_elements=['url_hash', 'content_hash'],
+    ))
+
+    keys = set((row['url'], row['content_hash']) for row in rows)
+    stored = session.query(Document.id, Document.url, Document.content_hash) \
+        .filter(Document.url_hash.in_(set(row['url_hash'] for row in rows))) \
+        .filter(Document.content_hash.in_(set(content_hash for (url, content_hash) in keys)))
+
+    document_ids = {
+        (url, content_hash): document_id
+        for (document_id, url, content_hash) in stored
+        if (url, content_hash) in keys
+    }
+
+    # A new content hash is a new version: archive the version it replaces
+    archive_previous_versions(
+        session,
+        {url: document_id for ((url, content_hash), document_id) in document_ids.items()}
+    )
+
+    return document_ids
+
+
+def lookup_domain_ids(session, domain_urls):
+    """ Resolve domain urls to ids, inserting any domains that don't exist yet.
+        Ids are served from domain_cache when possible; the rest are
+        resolved with one batched select.
+        Returns a dictionary: domain_url -> domain.id
+    """
+    domain_ids = {}
+    uncached = set()
+    for url in set(domain_urls):
+        domain_id = domain_cache.get(url)
+        if domain_id is None:
+            uncached.add(url)
+        else:
+            domain_ids[url] = domain_id
+
+    if not uncached:
+        return domain_ids
+
+    # Domains that already exist are committed: safe to cache
+    found = dict(
+        session.query(Domain.domain_url, Domain.id)
+        .filter(Domain.domain_url.in_(uncached))
+    )
+    for url, domain_id in found.items():
+        domain_cache.set(url, domain_id)
+    domain_ids.update(found)
+
+    # Get-or-create the rest.  Another worker may insert the same domain
+    # at the same time: the unique index on domain_url turns the second
+    # insert into a no-op, and the locking read sees the other worker's row
+    # once it commits.  New ids are not cached until they are seen committed.
+    missing = uncached - set(found.keys())
+    for attempt in range(settings.DOMAIN_LOOKUP_RETRIES):
+        if not missing:
+            break
+
+        session.execute(upsert(
+            session,
+            Domain.__table__,
+            [{'domain_url': url, 'domain_reversed': reverse_domain(url)} for url in missing],
+            index_elements=['domain_url'],
+        ))
+        created = dict(
+            session.query(Domain.domain_url, Domain.id)
+            .filter(Domain.domain_url.in_(missing))
+            .with_for_update(read=True)
+        )
+        domain_ids.update(created)
+        missing = missing - set(created.keys())
+
+    if missing:
+        raise LookupError("Unable to create domain: " + ', '.join(sorted(missing)))
+
+    return domain_ids
+
+
+def get_domain_id(session, domain_url):
+    """ Get (or create) the id of a single domain: used to log requests.
+        A new domain is only visible (and cached) once the caller commits:
+        post_url() calls it in a session_scope() of its own.
+    """
+    return lookup_domain_ids(session, [domain_url])[domain_url]
+
+
+def backfill_reversed_domains(session, batch_size=1000):
+    """ Set domain_reversed of the domains saved before it was added, so
+        that subdomain search (queries.find_domain_ids) finds them.
+        Called by init_db(): once every domain has it, a single indexed select.
+        Returns the number of domains updated
+    """
+    updated = 0
+    while True:
+        rows = session.query(Domain.id, Domain.domain_url) \
+            .filter(Domain.domain_reversed.is_(None)) \
+            .limit(batch_size) \
+            .all()
+        if not rows:
+            return updated
+
+        session.bulk_update_mappings(Domain, [
+            {'id': domain_id, 'domain_reversed': reverse_domain(url or '')}
+            for (domain_id, url) in rows
+        ])
+        session.commit()
+        updated = updated + len(rows)
+
+
+def backfill_url_hashes(session, batch_size=1000):
+    """ Set url_hash of the documents saved before it was added, and drop
+        the unique index on (url, content_hash) it replaces.
+        Called by init_db(): once every document has it, there is nothing to do.
+        Returns the number of documents updated
+    """
+    bind = session.get_bind()
+    if 'document_url_content_hash_unique' in set(index['name'] for index in inspect(bind).get_indexes('document')):
+        drop = 'DROP INDEX document_url_content_hash_unique'
+        if bind.dialect.name == 'mysql':
+            drop = drop + ' ON document'
+        session.execute(drop)
+        session.commit()
+
+    updated = 0
+    while True:
+        rows = session.query(Document.id, Document.url) \
+            .filter(Document.url_hash.is_(None)) \
+            .limit(batch_size) \
+            .all()
+        if not rows:
+            return updated
+
+        session.bulk_update_mappings(Document, [
+            {'id': document_id, 'url_hash': url_hash(url)}
+            for (document_id, url) in rows
+        ])
+        session.commit()
+        updated = updated + len(rows)
+
+
+def upsert(session, table, rows, index_elements, update_columns=None):
+    """ Build a multi-row INSERT that updates (or ignores) rows
+        whose unique key (index_elements) already exists
+    """
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(rows)
+        if update_columns:
+            return stmt.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={column: stmt.excluded[column] for column in update_columns}
+            )
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+    elif dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        # MySQL has no "do nothing": set the key to its own value instead
+        columns = update_columns or index_elements[:1]
+        return stmt.on_duplicate_key_update(
+            {column: stmt.inserted[column] for column in columns}
+        )
+
+    # SQLite (local development, 3.24+): the same statement as PostgreSQL,
+    # built by compile_sqlite_insert() as SQLAlchemy 1.3 has no sqlite insert()
+    stmt = table.insert().values(rows)
+    stmt.on_conflict = (index_elements, update_columns or [])
+    return stmt
+
+
+@compiles(Insert, 'sqlite')
+def compile_sqlite_insert(insert, compiler, **kw):
+    """ INSERT .. ON CONFLICT DO UPDATE / DO NOTHING of upsert(): the row
+        is updated in place, keeping its id and create_date
+        (INSERT OR REPLACE deletes it and inserts a new one)
+    """
+    sql = compiler.visit_insert(insert, **kw)
+    if getattr(insert, 'on_conflict', None) is None:
+        return sql
+
+    index_elements, update_columns = insert.on_conflict
+    quote = compiler.preparer.quote
+    sql = sql + ' ON CONFLICT (%s)' % ', '.join(quote(column) for column in index_elements)
+    if not update_columns:
+        return sql + ' DO NOTHING'
+    return sql + ' DO UPDATE SET ' + ', '.join(
+        '%s = excluded.%s' % (quote(column), quote(column)) for column in update_columns
+    )
+
+
+def document_row(url, text, raw, content_type, encoding, language, request_id):
+    """ Convert downloaded document data into a 'document' table row """
+    text = text or ''
+
+    if isinstance(raw, bytes):
+        body_binary, body_html = raw, None
+    else:
+        body_binary, body_html = None, raw
+
+    return {
+        'request_id': request_id,
+        'url': url,
+        'url_hash': url_hash(url),
+        'content_type': (content_type or '')[:50],
+        'title': '',
+        'body_binary': body_binary,
+        'body_html': body_html,
+        'body_text': text,
+        'encoding': (encoding or '')[:16],
+        'language': (language or '')[:16],
+        'word_count': len(text.split()),
+        'content_hash': content_hash(text),
+        'create_date': datetime.utcnow(),
+    }
+
+
+def content_hash(text):
+    """ Hash of a document's text: used to detect new versions.
+        Always hashed as utf-8 so that the same text gets the same hash,
+        whatever encoding the document was served in.
+    """
+    hash_method = getattr(hashlib, settings.HASH_ALGORITHM)
+    return hash_method((text or '').encode('utf-8', 'replace')).hexdigest()
+
+
+def url_hash(url):
+    """ Hash of a document's url: unique with its content_hash.
+        The url itself is too long for a unique index (MySQL indexes only
+        its first 255 characters: longer urls that share them collide)
+    """
+    hash_method = getattr(hashlib, settings.HASH_ALGORITHM)
+    return hash_method((url or '').encode('utf-8', 'replace')).hexdigest()
+
+
+def domain_url(url):
+    return urlparse(url).netloc
+
+
+def reverse_domain(domain_url):
+    """ Reverse the labels of a hostname so that a domain and all its
+        subdomains share a prefix that an index can scan:
+            www.example.com  ->  com.example.www.
+            example.com      ->  com.example.
+    """
+    hostname = domain_url.split(':')[0].lower().strip('.')
+    return '.'.join(reversed(hostname.split('.'))) + '.'
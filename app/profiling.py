@@ -0,0 +1,102 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from structured_logging import CORRELATION_ID_PATTERN
+import cProfile
+import glob
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Profiles of individual API requests (cProfile)
+
+        requested:  ?profile=1 or an X-Profile: 1 header, with the admin
+                    token (PROFILE_ADMIN_TOKEN) in the X-Admin-Token header.
+                    The profile is saved, and its id returned in the
+                    X-Profile-Id header.  With profile=text, the response
+                    is replaced by the slowest functions of the request.
+        sampled:    1 in PROFILE_SAMPLE_RATE requests is profiled and saved
+
+    Profiles are saved to PROFILE_DIR/<request id>.prof (pstats format:
+    snakeviz, `python -m pstats`) and can be downloaded from
+    /v0.4/profile/<id>.  The newest PROFILE_MAX_FILES are kept.
+
+    Only the thread handling the request is profiled: quotes computed in
+    the download pool appear as time waiting for their results, and a
+    streamed response (format=ndjson) is profiled until it starts.
+"""
+
+
+def requested_mode(args, headers):
+    """ 'save' or 'text' if the request asks to be profiled by an admin """
+    mode = args.get('profile') or headers.get('X-Profile')
+    if not mode or mode == '0':
+        return None
+    if not is_admin(headers.get('X-Admin-Token')):
+        return None
+    return 'text' if mode == 'text' else 'save'
+
+
+def is_admin(token):
+    if not (settings.PROFILE_ADMIN_TOKEN and token):
+        return False
+    return hmac.compare_digest(token, settings.PROFILE_ADMIN_TOKEN)
+
+
+def sampled():
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < 1.0 / settings.PROFILE_SAMPLE_RATE
+
+
+def start():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def save(profiler, profile_id):
+    """ Write the profile to PROFILE_DIR and drop the oldest ones """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(profile_path(profile_id))
+
+    profiles = sorted(glob.glob(os.path.join(settings.PROFILE_DIR, '*.prof')), key=os.path.getmtime)
+    for filename in profiles[:-settings.PROFILE_MAX_FILES]:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+    logger.info("Saved profile %s", profile_id)
+
+
+def report(profile, lines=None):
+    """ The functions that took longest, including their calls (text) """
+    output = io.StringIO()
+    stats = pstats.Stats(profile, stream=output)
+    stats.sort_stats('cumulative').print_stats(lines or settings.PROFILE_REPORT_LINES)
+    return output.getvalue()
+
+
+def profile_path(profile_id):
+    """ Path of a saved profile, None if profile_id isn't a valid id """
+    if not CORRELATION_ID_PATTERN.match(profile_id):
+        return None
+    return os.path.join(settings.PROFILE_DIR, profile_id + '.prof')
@@ -0,0 +1,275 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from lib.citeit_quote_context.canonical_url import url_without_protocol
+from models import Citation, Document, Domain, Request
+from persistence import domain_cache, domain_url, reverse_domain
+from search import filter_citations, citation_rank
+from sqlalchemy import and_, or_, literal_column
+from datetime import datetime
+import base64
+import re
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Read queries behind the Request.REQUEST_TYPES endpoints:
+
+        posts-citing:     citations whose cited url/domain matches
+        posts-cited-by:   citations made by the citing url/domain
+        archives-of-url:  stored versions of a document (document_versions.py)
+        search:           citations matching search terms (search.py)
+
+    Results are returned newest first, a page at a time.  Pages use
+    keyset pagination: the 'after' cursor holds the (create_date, id)
+    of the last row of the previous page, so each page is an index range
+    scan on (url or domain, create_date, id) rather than an OFFSET that
+    re-reads every earlier row.
+"""
+
+SEARCH_TYPES = [search_type for (search_type, label) in Request.SEARCH_TYPES]
+
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%dT%H:%M:%S.%f%z',
+]
+
+
+def posts_citing(session, url, search_type='url', start_date=None,
+                 end_date=None, max_results=None, after=None,
+                 citation_terms=None, context_terms=None, document_terms=None):
+    """ Posts that cite this url (or any url on this domain) """
+    query = citing_query(session, url, search_type)
+    query = filter_citations(
+        query, session.get_bind().dialect.name,
+        citation_terms, context_terms, document_terms
+    )
+    return citation_page(query, start_date, end_date, max_results, after)
+
+
+def posts_cited_by(session, url, search_type='url', start_date=None,
+                   end_date=None, max_results=None, after=None,
+                   citation_terms=None, context_terms=None, document_terms=None):
+    """ Posts cited by this url (or by any page on this domain) """
+    query = cited_by_query(session, url, search_type)
+    query = filter_citations(
+        query, session.get_bind().dialect.name,
+        citation_terms, context_terms, document_terms
+    )
+    return citation_page(query, start_date, end_date, max_results, after)
+
+
+def search_citations(session, citation_terms=None, context_terms=None,
+                     document_terms=None, max_results=None):
+    """ Citations matching the search terms, best match first """
+    if not (citation_terms or context_terms or document_terms):
+        raise ValueError("Specify citation_terms, context_terms or document_terms")
+
+    dialect = session.get_bind().dialect.name
+    query = filter_citations(
+        session.query(Citation), dialect,
+        citation_terms, context_terms, document_terms
+    )
+
+    rank = citation_rank(dialect, citation_terms, context_terms)
+    if rank is not None:
+        query = query.add_columns(rank.label('rank')).order_by(rank.desc(), Citation.id.desc())
+    else:       # document_terms only: newest first
+        query = query.add_columns(literal_column('0').label('rank')) \
+            .order_by(Citation.create_date.desc(), Citation.id.desc())
+
+    results = []
+    for (citation, relevance) in query.limit(page_size(max_results)):
+        row = citation_dict(citation)
+        row['rank'] = float(relevance)
+        results.append(row)
+    return {'results': results}
+
+
+def citing_query(session, url, search_type='url'):
+    return filter_url(
+        session.query(Citation), url, search_type,
+        Citation.cited_url_canonical, Citation.cited_domain_id
+    )
+
+
+def cited_by_query(session, url, search_type='url'):
+    return filter_url(
+        session.query(Citation), url, search_type,
+        Citation.citing_url_canonical, Citation.citing_domain_id
+    )
+
+
+def archives_of_url(session, url, start_date=None, end_date=None,
+                    max_results=None, after=None):
+    """ Stored versions of a url, without loading any document text """
+    query = session.query(
+            Document.id, Document.content_hash, Document.word_count,
+            Document.create_date, Document.end_date
+        ) \
+        .filter(Document.url == url)
+
+    rows, next_cursor = keyset_page(
+        query, Document.create_date, Document.id,
+        start_date, end_date, max_results, after
+    )
+    return {
+        'results': [{
+            'id': row.id,
+            'content_hash': row.content_hash,
+            'word_count': row.word_count,
+            'create_date': row.create_date.isoformat(),
+            'end_date': row.end_date.isoformat() if row.end_date else None,
+        } for row in rows],
+        'next': next_cursor,
+    }
+
+
+def filter_url(query, url, search_type, url_column, domain_column):
+    if search_type not in SEARCH_TYPES:
+        raise ValueError("search_type must be one of: " + ', '.join(SEARCH_TYPES))
+
+    if search_type == 'url':
+        return query.filter(url_column == url_without_protocol(url))
+
+    domain_ids = find_domain_ids(
+        query.session,
+        domain_url(url) or url,
+        subdomains=(search_type == 'domain-subdomains')
+    )
+    if len(domain_ids) == 1:
+        return query.filter(domain_column == domain_ids[0])
+    return query.filter(domain_column.in_(domain_ids))
+
+
+def find_domain_ids(session, domain, subdomains=False):
+    """ Ids of a domain, and optionally of all its subdomains.
+        Read-only: unknown domains return an empty list
+    """
+    if not subdomains:
+        domain_id = domain_cache.get(domain)
+        if domain_id is None:
+            domain_id = session.query(Domain.id).filter(Domain.domain_url == domain).scalar()
+        return [domain_id] if domain_id is not None else []
+
+    prefix = reverse_domain(domain).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    rows = session.query(Domain.id).filter(Domain.domain_reversed.like(prefix + '%', escape='\\'))
+    return [row.id for row in rows]
+
+
+def citation_page(query, start_date, end_date, max_results, after):
+    rows, next_cursor = keyset_page(
+        query, Citation.create_date, Citation.id,
+        start_date, end_date, max_results, after
+    )
+    return {
+        'results': [citation_dict(citation) for citation in rows],
+        'next': next_cursor,
+    }
+
+
+def keyset_page(query, date_column, id_column, start_date=None,
+                end_date=None, max_results=None, after=None):
+    """ Return one page of rows, newest first, and the cursor of the next page
+        (None on the last page)
+    """
+    max_results = page_size(max_results)
+
+    # Fetch one extra row to find out if there is a next page
+    rows = keyset_query(
+        query, date_column, id_column, start_date, end_date, after
+    ).limit(max_results + 1).all()
+
+    next_cursor = None
+    if len(rows) > max_results:
+        rows = rows[:max_results]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            getattr(last, date_column.key),
+            getattr(last, id_column.key)
+        )
+
+    return rows, next_cursor
+
+
+def keyset_query(query, date_column, id_column, start_date=None,
+                 end_date=None, after=None):
+    """ Rows newer than start_date, older than end_date and after the cursor,
+        ordered to match the (.., create_date, id) indexes
+    """
+    if start_date:
+        query = query.filter(date_column >= start_date)
+    if end_date:
+        query = query.filter(date_column < end_date)
+
+    if after:
+        after_date, after_id = decode_cursor(after)
+        query = query.filter(or_(
+            date_column < after_date,
+            and_(date_column == after_date, id_column < after_id)
+        ))
+
+    return query.order_by(date_column.desc(), id_column.desc())
+
+
+def page_size(max_results):
+    """ max_results parameter, limited to QUERY_MAX_RESULTS """
+    max_results = int(max_results or settings.QUERY_DEFAULT_RESULTS)
+    return max(1, min(max_results, settings.QUERY_MAX_RESULTS))
+
+
+def encode_cursor(create_date, row_id):
+    cursor = '%s|%s' % (create_date.isoformat(), row_id)
+    return base64.urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        create_date, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        return parse_date(create_date), int(row_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid 'after' cursor: " + cursor)
+
+
+def parse_date(value):
+    """ Parse a date parameter: 2020-08-17 or 2020-08-17T10:30:00
+        (also the isoformat() dates in 'after' cursors)
+        datetime.fromisoformat() needs Python 3.7: the Docker image runs 3.6
+    """
+    if not value:
+        return None
+
+    value = re.sub(r'([+-]\d\d):(\d\d)$', r'\1\2', value)    # %z can't parse +00:00 before 3.7
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: %s (use YYYY-MM-DD)" % value)
+
+
+def citation_dict(citation):
+    return {
+        'sha256': citation.sha256,
+        'citing_url': citation.citing_url,
+        'citing_url_canonical': citation.citing_url_canonical,
+        'citing_quote': citation.citing_quote,
+        'cited_url': citation.cited_url,
+        'cited_url_canonical': citation.cited_url_canonical,
+        'create_date': citation.create_date.isoformat(),
+    }
@@ -0,0 +1,220 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import logging
+import os
+import sqlite3
+import time
+import uuid
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Rate limits shared by every process on this machine: the web
+    workers and the download pools they start.
+
+        clients:  token bucket per API key (settings.API_KEYS) or IP address,
+                  checked before each API request (429 + Retry-After)
+        sources:  per host, at most RATE_LIMIT_HOST_RATE requests per second
+                  and RATE_LIMIT_HOST_CONCURRENCY downloads at once;
+                  Document waits for its turn (see host_limit())
+
+    The state lives in a small SQLite file: each check is one short
+    BEGIN IMMEDIATE transaction, which serializes the processes.
+    A download slot is leased, so a process that dies holding one
+    only blocks its host until the lease expires.
+
+    Throttled requests are counted by name (see throttle_counts()):
+        client:        API requests refused
+        host_wait:     downloads delayed
+        host_timeout:  downloads abandoned after RATE_LIMIT_HOST_MAX_WAIT
+"""
+
+
+class RateLimited(Exception):
+    """ No download slot for this host within RATE_LIMIT_HOST_MAX_WAIT """
+
+
+class RateLimiter:
+    """ Token buckets and concurrency slots stored in a SQLite file
+
+        Usage:
+            limiter = RateLimiter('/tmp/citeit-rate-limit.db')
+            limiter.take('client:1.2.3.4', rate=2, burst=20)    # 0: allowed
+            slot = limiter.acquire('host:example.com', limit=4, lease=120)
+            limiter.release(slot)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+        self._pruned = 0
+
+    def connection(self):
+        # sqlite connections can't be shared with forked pool processes
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL);
+                CREATE TABLE IF NOT EXISTS slot (id TEXT PRIMARY KEY, key TEXT, expires REAL);
+                CREATE INDEX IF NOT EXISTS slot_key ON slot (key);
+                CREATE TABLE IF NOT EXISTS throttled (name TEXT PRIMARY KEY, count INTEGER);
+            """)
+            self._pid = os.getpid()
+        return self._connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def take(self, key, rate, burst):
+        """ Take a token from the bucket: 'rate' tokens are added per second,
+            up to 'burst'.  Returns 0 if a token was taken, otherwise the
+            number of seconds until one is available.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT tokens, updated FROM bucket WHERE key = ?", (key,)
+            ).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+
+            wait = 0
+            if tokens >= 1:
+                tokens = tokens - 1
+            else:
+                wait = (1 - tokens) / rate
+
+            connection.execute(
+                "INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+            self.prune(connection, now)
+        return wait
+
+    def prune(self, connection, now):
+        """ An idle bucket is full again: forgetting it changes nothing """
+        if now - self._pruned > 60:
+            connection.execute(
+                "DELETE FROM bucket WHERE updated < ?", (now - settings.RATE_LIMIT_IDLE_SECONDS,)
+            )
+            self._pruned = now
+
+    def acquire(self, key, limit, lease):
+        """ One of 'limit' slots for this key, held for at most 'lease' seconds.
+            Returns the slot id, or None if all slots are taken.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM slot WHERE expires < ?", (now,))
+            (used,) = connection.execute("SELECT count(*) FROM slot WHERE key = ?", (key,)).fetchone()
+            if used >= limit:
+                return None
+
+            slot_id = uuid.uuid4().hex
+            connection.execute(
+                "INSERT INTO slot (id, key, expires) VALUES (?, ?, ?)", (slot_id, key, now + lease)
+            )
+        return slot_id
+
+    def release(self, slot_id):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM slot WHERE id = ?", (slot_id,))
+
+    def count_throttled(self, name):
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO throttled (name, count) VALUES (?, 0)", (name,)
+            )
+            connection.execute(
+                "UPDATE throttled SET count = count + 1 WHERE name = ?", (name,)
+            )
+
+    def throttle_counts(self):
+        return dict(self.connection().execute("SELECT name, count FROM throttled"))
+
+
+limiter = RateLimiter(settings.RATE_LIMIT_DB)
+
+
+def client_key(ip_address, api_key=None):
+    """ Known API keys get their own bucket; anyone else is limited by address
+        (an unknown key would otherwise be a way to get a fresh bucket)
+    """
+    if api_key and api_key in settings.API_KEYS:
+        return 'key:' + api_key
+    return 'ip:' + (ip_address or '')
+
+
+def check_client(key):
+    """ Seconds the client must wait before its next request (0: allowed) """
+    if not settings.RATE_LIMIT_ENABLED:
+        return 0
+
+    wait = limiter.take(key, settings.RATE_LIMIT_CLIENT_RATE, settings.RATE_LIMIT_CLIENT_BURST)
+    if wait:
+        limiter.count_throttled('client')
+    return wait
+
+
+@contextmanager
+def host_limit(url):
+    """ Wait for a download slot for the host of this url
+        Raises RateLimited after settings.RATE_LIMIT_HOST_MAX_WAIT seconds
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        yield
+        return
+
+    key = 'host:' + urlparse(url).netloc.lower()
+    deadline = time.time() + settings.RATE_LIMIT_HOST_MAX_WAIT
+    waited = False
+
+    while True:
+        slot_id = limiter.acquire(key, settings.RATE_LIMIT_HOST_CONCURRENCY, settings.RATE_LIMIT_HOST_LEASE)
+        if slot_id:
+            wait = limiter.take(key, settings.RATE_LIMIT_HOST_RATE, max(1, settings.RATE_LIMIT_HOST_RATE))
+            if not wait:
+                break
+            limiter.release(slot_id)
+        else:
+            wait = settings.RATE_LIMIT_HOST_POLL
+
+        if not waited:
+            waited = True
+            limiter.count_throttled('host_wait')
+        if time.time() + wait > deadline:
+            limiter.count_throttled('host_timeout')
+            logger.warning("Rate limited: gave up waiting for %s", key)
+            raise RateLimited(key)
+        time.sleep(wait)
+
+    try:
+        yield
+    finally:
+        limiter.release(slot_id)
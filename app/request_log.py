@@ -0,0 +1,215 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from database import engine
+from models import Request
+from models import RequestIdBlock
+from datetime import datetime
+import logging
+import threading
+import atexit
+import queue
+import time
+import os
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+ID_BLOCK_SIZE = 4096    # request ids reserved from the database at once: see next_id()
+
+
+class RequestLog:
+    """ Write-behind buffer for the 'request' audit table.
+
+        post_url() used to insert and commit a Request row before doing
+        any work.  Now rows are put on a bounded queue and a background
+        thread writes them in batches: every batch_size rows or every
+        flush_ms milliseconds, whichever comes first.
+
+        * If the queue is full (the database is down or slow), new rows
+          are dropped and counted in self.dropped rather than blocking
+          the request
+        * Ids are assigned up front (see next_id) so that citations can
+          reference the request before its row has been written;
+          call flush(request_id) before saving rows that depend on it:
+          it only waits for the database if that row is still unwritten,
+          and returns False if the row was dropped or lost
+        * Remaining rows are written when the process exits
+
+        Usage:
+            request_id = request_log.log(ip_address=.., request_type='post-url', ..)
+    """
+
+    def __init__(self, batch_size=100, flush_ms=500, max_queue=10000):
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0        # rows discarded because the queue was full
+        self.written = 0        # rows saved to the database
+        self.failed = 0         # rows lost to database errors
+
+        self._pending = []      # batch being collected by the writer thread
+        self._unwritten = set()     # ids of the rows queued, pending or being written
+        self._failed_ids = set()    # ids of the rows lost to database errors
+        self._waiting = 0       # flush() calls waiting for a row the writer thread holds
+        self._write_lock = threading.Lock()
+        self._written_rows = threading.Condition(self._write_lock)
+        self._id_lock = threading.Lock()
+        self._id_block = None   # (process id, next id, end of the block)
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+
+    def log(self, **row):
+        """ Queue a request row without waiting for the database.
+            Returns the request id, or None if the row was dropped
+        """
+        self.start()
+
+        try:
+            row['id'] = self.next_id()
+        except Exception:
+            self.dropped = self.dropped + 1
+            logger.exception("Unable to reserve request ids")
+            return None
+
+        row.setdefault('create_date', datetime.utcnow())
+        self._unwritten.add(row['id'])     # before the writer thread can take it
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self._unwritten.discard(row['id'])
+            self.dropped = self.dropped + 1
+            return None
+
+        return row['id']
+
+    def next_id(self):
+        """ Id unique across processes and hosts: ids are taken from a
+            block of ID_BLOCK_SIZE reserved by inserting a RequestIdBlock
+            row, so the database is only asked once per block
+        """
+        with self._id_lock:
+            # A forked worker process doesn't share its parent's block
+            if self._id_block is None or self._id_block[0] != os.getpid() \
+                    or self._id_block[1] == self._id_block[2]:
+                with engine.begin() as connection:
+                    result = connection.execute(RequestIdBlock.__table__.insert(), {
+                        'create_date': datetime.utcnow()
+                    })
+                    block = result.inserted_primary_key[0]
+                self._id_block = (os.getpid(), block * ID_BLOCK_SIZE, (block + 1) * ID_BLOCK_SIZE)
+
+            pid, request_id, end = self._id_block
+            self._id_block = (pid, request_id + 1, end)
+            return request_id
+
+    def flush(self, request_id=None):
+        """ Write every queued row now, including any batch the writer
+            thread is holding, before returning
+            request_id: return at once if that row has already been
+            written, or wait for it if the writer thread has taken it
+            from the queue.  Returns False if that row isn't in the
+            database: dropped, lost to a database error, or still held
+            after timeout seconds
+        """
+        timeout = self.flush_ms / 1000 * 2
+        with self._written_rows:
+            if request_id is None or request_id in self._unwritten:
+                while True:
+                    try:
+                        self._pending.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self.write_pending()
+
+            if request_id is None:
+                return True
+
+            # Taken from the queue by the writer thread, not yet in its batch
+            self._waiting = self._waiting + 1
+            try:
+                self._written_rows.wait_for(lambda: request_id not in self._unwritten, timeout)
+            finally:
+                self._waiting = self._waiting - 1
+
+            return request_id not in self._unwritten and request_id not in self._failed_ids
+
+    def write_pending(self):
+        """ Save the pending batch: call with self._write_lock held """
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+
+        ids = [row['id'] for row in rows]
+        try:
+            with engine.begin() as connection:
+                connection.execute(Request.__table__.insert(), rows)
+            self.written = self.written + len(rows)
+        except Exception:
+            self.failed = self.failed + len(rows)
+            if len(self._failed_ids) > self.queue.maxsize:
+                self._failed_ids.clear()    # old requests: no longer flushed
+            self._failed_ids.update(ids)
+            logger.exception("Unable to save %d request log rows", len(rows))
+
+        self._unwritten.difference_update(ids)
+        self._written_rows.notify_all()
+
+    def start(self):
+        """ Start the writer thread, once per process:
+            threads don't survive a fork into a new worker process
+        """
+        if self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name='request-log', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the writer thread and write what is left in the queue """
+        self._stopping.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_ms / 1000 * 2)
+        self.flush()
+
+    def run(self):
+        deadline = time.monotonic() + self.flush_ms / 1000
+
+        while not self._stopping.is_set():
+            try:
+                row = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+            except queue.Empty:
+                row = None
+
+            with self._write_lock:
+                if row:
+                    self._pending.append(row)
+
+                if len(self._pending) >= self.batch_size or time.monotonic() >= deadline \
+                        or (self._waiting and self._pending):
+                    self.write_pending()
+                    deadline = time.monotonic() + self.flush_ms / 1000
+
+
+request_log = RequestLog(
+    batch_size=settings.REQUEST_LOG_BATCH_SIZE,
+    flush_ms=settings.REQUEST_LOG_FLUSH_MS,
+    max_queue=settings.REQUEST_LOG_MAX_QUEUE,
+)
+
+atexit.register(request_log.stop)
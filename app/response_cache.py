@@ -0,0 +1,107 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from flask import g
+from flask import request
+from flask import make_response
+from cache import TTLCache
+from metrics import register_collector, ttl_cache_collector
+from functools import wraps
+from urllib.parse import urldefrag
+import hashlib
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Response cache for the read-only document endpoints
+    (text-version, meta-data, encoding, canonical-url)
+
+    These views download and convert a document on every request.
+    The @cached_response decorator stores each successful GET response,
+    keyed by endpoint and normalized query parameters, and adds:
+
+        ETag:           strong validator, the hash of the response body
+                        (the text or data derived from the document content),
+                        so it changes exactly when the response does
+        Cache-Control:  public, max-age=RESPONSE_CACHE_MAX_AGE
+
+    A request whose If-None-Match matches gets an empty 304 response,
+    so clients and a CDN in front of the API can revalidate cheaply.
+
+    A view whose document couldn't be downloaded calls dont_cache(): its
+    response is sent with Cache-Control: no-store, and not kept.
+"""
+
+# cache key -> (body, mimetype, etag)
+response_cache = TTLCache(
+    maxsize=settings.RESPONSE_CACHE_SIZE,
+    ttl=settings.RESPONSE_CACHE_TTL
+)
+register_collector(ttl_cache_collector('response', response_cache))
+
+
+def cached_response(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+
+        key = cache_key(request.endpoint, request.args)
+        entry = response_cache.get(key)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if g.get('dont_cache'):
+                response.cache_control.no_store = True
+                return response
+            if response.status_code != 200:
+                return response
+
+            body = response.get_data()
+            entry = (body, response.mimetype, body_etag(body))
+            if len(body) <= settings.RESPONSE_CACHE_MAX_BODY:
+                response_cache.set(key, entry)
+        else:
+            response = make_response(entry[0])
+            response.mimetype = entry[1]
+
+        response.set_etag(entry[2])
+        response.cache_control.public = True
+        response.cache_control.max_age = settings.RESPONSE_CACHE_MAX_AGE
+        return response.make_conditional(request)   # 304 if If-None-Match matches
+
+    return wrapper
+
+
+def dont_cache():
+    """ The response of this request is not to be cached, by this process,
+        clients or a CDN: its document couldn't be downloaded
+    """
+    g.dont_cache = True
+
+
+def cache_key(endpoint, args):
+    """ Endpoint and its parameters, in a canonical order.
+        The fragment of the url is dropped: it is never sent to the source.
+    """
+    params = []
+    for (name, value) in sorted(args.items(multi=True)):
+        if name == 'url':
+            value = urldefrag(value.strip())[0]
+        params.append((name, value))
+    return (endpoint, tuple(params))
+
+
+def body_etag(body):
+    return hashlib.sha256(body).hexdigest()
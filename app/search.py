@@ -0,0 +1,219 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from models import Citation, Document
+from sqlalchemy import func, inspect, literal_column, select, or_
+from sqlalchemy.sql import column, table
+from functools import reduce
+import re
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Full-text search over citations and document text
+
+    Each search parameter of the 'posts-citing' and 'posts-cited-by'
+    requests matches a set of columns:
+
+        citation_terms:  citation.citing_quote, cited_quote
+        context_terms:   citation.citing/cited_context_before/after
+        document_terms:  document.body_text (citing or cited document)
+
+    The index depends on the database:
+
+        PostgreSQL:  GIN index on the to_tsvector() of the columns
+        MySQL:       FULLTEXT index on the columns
+        SQLite:      FTS5 table (citation_search, document_search),
+                     kept up to date by triggers
+
+    The database updates each index as rows are inserted, so new
+    citations are searchable as soon as they are saved.
+    create_search_indexes() is run by database.init_db() and only
+    creates what is missing.
+"""
+
+SEARCH_FIELDS = {
+    'citation_terms': ('citation_quote_search', Citation.__table__, [
+        'citing_quote', 'cited_quote'
+    ]),
+    'context_terms': ('citation_context_search', Citation.__table__, [
+        'citing_context_before', 'citing_context_after',
+        'cited_context_before', 'cited_context_after'
+    ]),
+    'document_terms': ('document_text_search', Document.__table__, [
+        'body_text'
+    ]),
+}
+
+# SQLite: one FTS5 table per searched table
+SQLITE_SEARCH_TABLES = {
+    'citation': 'citation_search',
+    'document': 'document_search',
+}
+
+
+def create_search_indexes(engine):
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        return create_sqlite_search_tables(engine)
+
+    inspector = inspect(engine)
+    existing = {
+        search_table.name: {index['name'] for index in inspector.get_indexes(search_table.name)}
+        for (index_name, search_table, columns) in SEARCH_FIELDS.values()
+    }
+
+    for (index_name, search_table, columns) in SEARCH_FIELDS.values():
+        if index_name in existing[search_table.name]:
+            continue
+
+        if dialect == 'postgresql':
+            expression = tsvector(search_table, columns).compile(dialect=engine.dialect)
+            engine.execute("CREATE INDEX %s ON %s USING GIN ((%s))" % (index_name, search_table.name, expression))
+        elif dialect == 'mysql':
+            engine.execute("CREATE FULLTEXT INDEX %s ON %s (%s)" % (index_name, search_table.name, ', '.join(columns)))
+
+
+def create_sqlite_search_tables(engine):
+    with engine.begin() as connection:
+        for (table_name, search_table_name) in SQLITE_SEARCH_TABLES.items():
+            columns = [
+                name for (index_name, search_table, names) in SEARCH_FIELDS.values()
+                if search_table.name == table_name
+                for name in names
+            ]
+            created = connection.execute(
+                "SELECT name FROM sqlite_master WHERE name = ?", (search_table_name,)
+            ).first() is None
+
+            for statement in sqlite_search_ddl(table_name, search_table_name, columns):
+                connection.execute(statement)
+
+            if created:     # index rows saved before the search table existed
+                connection.execute(
+                    "INSERT INTO %s(%s) VALUES ('rebuild')" % (search_table_name, search_table_name)
+                )
+
+
+def sqlite_search_ddl(table_name, search_table_name, columns):
+    """ External content FTS5 table: the text is only stored once, in
+        table_name.  Triggers add and remove index entries.
+        (persistence.upsert() uses INSERT OR REPLACE on SQLite: the delete
+        trigger only fires then because database.py turns on recursive_triggers)
+    """
+    names = ', '.join(columns)
+    new_values = ', '.join('new.' + name for name in columns)
+    old_values = ', '.join('old.' + name for name in columns)
+    values = {
+        'table': table_name, 'search': search_table_name,
+        'names': names, 'new': new_values, 'old': old_values,
+    }
+
+    return [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS %(search)s USING fts5(
+               %(names)s, content='%(table)s', content_rowid='id'
+           )""" % values,
+        """CREATE TRIGGER IF NOT EXISTS %(search)s_insert AFTER INSERT ON %(table)s BEGIN
+               INSERT INTO %(search)s(rowid, %(names)s) VALUES (new.id, %(new)s);
+           END""" % values,
+        """CREATE TRIGGER IF NOT EXISTS %(search)s_delete AFTER DELETE ON %(table)s BEGIN
+               INSERT INTO %(search)s(%(search)s, rowid, %(names)s) VALUES ('delete', old.id, %(old)s);
+           END""" % values,
+        """CREATE TRIGGER IF NOT EXISTS %(search)s_update AFTER UPDATE ON %(table)s BEGIN
+               INSERT INTO %(search)s(%(search)s, rowid, %(names)s) VALUES ('delete', old.id, %(old)s);
+               INSERT INTO %(search)s(rowid, %(names)s) VALUES (new.id, %(new)s);
+           END""" % values,
+    ]
+
+
+def tsvector(search_table, columns):
+    """ PostgreSQL: the indexed expression.  Queries must use the same
+        expression for the GIN index to be used
+    """
+    space = literal_column("' '")
+    document = reduce(
+        lambda text_so_far, next_text: text_so_far.op('||')(space).op('||')(next_text),
+        [func.coalesce(search_table.c[name], literal_column("''")) for name in columns]
+    )
+    return func.to_tsvector(literal_column("'%s'" % settings.SEARCH_LANGUAGE), document)
+
+
+def search_words(terms):
+    words = re.findall(r'\w+', terms or '')
+    if not words:
+        raise ValueError("Search terms must contain at least one word")
+    return words
+
+
+def match(dialect, field, terms):
+    """ Condition matching the search terms, and its relevance:
+        higher ranks are better matches.
+        All words must be present.
+    """
+    (index_name, search_table, columns) = SEARCH_FIELDS[field]
+    words = search_words(terms)
+
+    if dialect == 'postgresql':
+        vector = tsvector(search_table, columns)
+        query = func.plainto_tsquery(literal_column("'%s'" % settings.SEARCH_LANGUAGE), ' '.join(words))
+        return vector.op('@@')(query), func.ts_rank_cd(vector, query)
+
+    elif dialect == 'mysql':
+        # Safe to inline: search_words() only returns letters, digits and _
+        expression = literal_column("MATCH (%s) AGAINST ('%s' IN BOOLEAN MODE)" % (
+            ', '.join('%s.%s' % (search_table.name, name) for name in columns),
+            ' '.join('+' + word for word in words)
+        ))
+        return expression, expression
+
+    # SQLite: '{column column} : "word" "word"'
+    search_table_name = SQLITE_SEARCH_TABLES[search_table.name]
+    fts = table(search_table_name, column('rowid'), column('rank'), column(search_table_name))
+    matches = fts.c[search_table_name].op('MATCH')(
+        '{%s} : %s' % (' '.join(columns), ' '.join('"%s"' % word for word in words))
+    )
+    condition = search_table.c.id.in_(select([fts.c.rowid]).where(matches))
+    rank = select([fts.c.rank]).where(matches).where(fts.c.rowid == search_table.c.id).as_scalar()
+    return condition, -rank        # bm25: lower is better
+
+
+def filter_citations(query, dialect, citation_terms=None, context_terms=None, document_terms=None):
+    """ Add the search conditions to a citation query """
+    for (field, terms) in (('citation_terms', citation_terms), ('context_terms', context_terms)):
+        if terms:
+            query = query.filter(match(dialect, field, terms)[0])
+
+    if document_terms:
+        documents = select([Document.id]).where(match(dialect, 'document_terms', document_terms)[0])
+        query = query.filter(or_(
+            Citation.citing_document.in_(documents),
+            Citation.cited_document.in_(documents)
+        ))
+
+    return query
+
+
+def citation_rank(dialect, citation_terms=None, context_terms=None):
+    """ Relevance of each citation to the search terms,
+        or None if there are no citation or context terms
+    """
+    ranks = [
+        match(dialect, field, terms)[1]
+        for (field, terms) in (('citation_terms', citation_terms), ('context_terms', context_terms))
+        if terms
+    ]
+    if not ranks:
+        return None
+    return reduce(lambda total, next_rank: total + next_rank, ranks)
@@ -18,6 +18,131 @@ DATABASE_PORT = = os.getenv('DATABASE_PORT', database_settings.DATABASE_PORT)
 
 JSON_FILE_PATH = '/tmp/'   # in Lambda, you need to save to /tmp folder
 
+# Hash used for quote keys (sha256) and document content hashes
+HASH_ALGORITHM = 'sha256'
+
+# In-process cache of domain_url -> domain.id
+# Usage in: app/persistence.py
+DOMAIN_CACHE_SIZE = int(os.getenv('DOMAIN_CACHE_SIZE', '10000'))
+DOMAIN_CACHE_TTL = int(os.getenv('DOMAIN_CACHE_TTL', '3600'))     # seconds
+DOMAIN_LOOKUP_RETRIES = 3
+
+# Request audit rows are queued and written in batches by a background thread
+# Usage in: app/request_log.py
+REQUEST_LOG_BATCH_SIZE = int(os.getenv('REQUEST_LOG_BATCH_SIZE', '100'))    # rows per insert
+REQUEST_LOG_FLUSH_MS = int(os.getenv('REQUEST_LOG_FLUSH_MS', '500'))        # max wait before writing
+REQUEST_LOG_MAX_QUEUE = int(os.getenv('REQUEST_LOG_MAX_QUEUE', '10000'))    # rows dropped beyond this
+
+# Seconds the compaction job spends diffing an archived document version
+# against the next newer one (per field)
+# Usage in: app/document_versions.py
+DOCUMENT_DELTA_TIMEOUT = 5.0
+
+# Seconds a saved citation is returned without re-checking the cited document
+# Older citations are returned if the cited document's text is unchanged
+# Usage in: app/persistence.py
+CITATION_CACHE_TTL = int(os.getenv('CITATION_CACHE_TTL', '86400'))
+
+# format=ndjson: citations are saved in batches of this size while streaming
+# Usage in: app/app.py
+STREAM_SAVE_BATCH_SIZE = 20
+
+# Batch submission of citing urls
+# Usage in: app/batch.py
+BATCH_MAX_URLS = 500            # urls per job
+BATCH_MAX_RUNNING = 2           # jobs processed at once by each worker process
+BATCH_PROGRESS_INTERVAL = 10    # save the count of fetched sources every n sources
+
+# Crawling a site from its sitemap or feed: flask citeit crawl
+# Usage in: app/crawl.py, app/feeds.py
+CRAWL_BATCH_SIZE = 50                               # pages per batch job
+CRAWL_DELAY = 0                                     # seconds between batches
+CRAWL_STATE_DIR = os.getenv('CRAWL_STATE_DIR', '.')  # checkpoint files
+CRAWL_MAX_SITEMAPS = 100                            # sitemap files read per crawl
+CRAWL_TIMEOUT = 30                                  # seconds, sitemap and feed requests
+
+# Responses of the document endpoints (text-version, meta-data, encoding, canonical-url)
+# Usage in: app/response_cache.py
+RESPONSE_CACHE_SIZE = 1000              # responses kept by each worker process
+RESPONSE_CACHE_TTL = 3600               # seconds a response is reused
+RESPONSE_CACHE_MAX_BODY = 1024 * 1024   # larger responses get an ETag but aren't kept
+RESPONSE_CACHE_MAX_AGE = 3600           # Cache-Control max-age, for clients and the CDN
+
+# Rate limits, shared by the processes of this machine through a SQLite file
+# Usage in: app/rate_limit.py, app/app.py, app/lib/citeit_quote_context/document.py
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '/tmp/citeit-rate-limit.db')
+API_KEYS = [key for key in os.getenv('API_KEYS', '').split(',') if key]   # clients with their own bucket
+RATE_LIMIT_CLIENT_RATE = 2          # API requests per second, per API key or IP address
+RATE_LIMIT_CLIENT_BURST = 30        # requests allowed at once after being idle
+RATE_LIMIT_HOST_RATE = 2            # downloads per second from each source host
+RATE_LIMIT_HOST_CONCURRENCY = 4     # downloads at once from each source host
+RATE_LIMIT_HOST_LEASE = 120         # seconds: a download slot is freed after this
+RATE_LIMIT_HOST_MAX_WAIT = 60       # seconds a download waits for a slot
+RATE_LIMIT_HOST_POLL = 0.25         # seconds between checks for a free slot
+RATE_LIMIT_IDLE_SECONDS = 3600      # client buckets idle this long are deleted
+
+# Metrics served at /metrics: each process writes its own file to METRICS_DIR
+# Usage in: app/metrics.py
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/citeit-metrics')
+METRICS_FLUSH_SECONDS = 1       # at most one write per process per second, between requests
+
+# Logging: JSON lines (or 'text') to LOG_FILE, stderr if empty
+# Usage in: app/structured_logging.py
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')                  # DEBUG messages cost nothing unless enabled
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_FILE = os.getenv('LOG_FILE', '')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1'))   # fraction of DEBUG messages kept
+
+# Profiles of API requests: see app/profiling.py
+# Usage in: app/profiling.py
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')        # empty: no requested profiles
+PROFILE_SAMPLE_RATE = int(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # profile 1 in N requests, 0: never
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/citeit-profiles')
+PROFILE_MAX_FILES = 500
+PROFILE_REPORT_LINES = 60      # functions listed by ?profile=text
+
+# OCR of scanned PDFs: see app/lib/citeit_quote_context/ocr.py
+# Usage in: app/lib/citeit_quote_context/ocr.py
+OCR_DPI = int(os.getenv('OCR_DPI', '300'))
+OCR_LANGUAGE = os.getenv('OCR_LANGUAGE', 'eng')            # tesseract language(s): 'eng+fra'
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '0'))           # pages read at once, 0: one per core (gunicorn: see gunicorn.conf.py)
+OCR_CACHE_DIR = os.getenv('OCR_CACHE_DIR', '../downloads/ocr/')
+
+# Long cited texts, shared by processes through mmap: see text_store.py
+# Usage in: app/lib/citeit_quote_context/text_store.py
+TEXT_STORE_DIR = os.getenv('TEXT_STORE_DIR', '../downloads/text/')
+TEXT_STORE_MIN_LENGTH = int(os.getenv('TEXT_STORE_MIN_LENGTH', '100000'))   # characters
+TEXT_STORE_MAX_SIZE = int(os.getenv('TEXT_STORE_MAX_SIZE', str(2 * 1024 ** 3)))   # bytes: oldest texts removed beyond
+TEXT_STORE_MIN_AGE = 3600      # seconds: newer texts are kept, tasks may still read them
+
+# Worker pool computing quotes, shared by the requests of a server process
+# (NUM_DOWNLOAD_PROCESSES processes): see worker_pool.py
+# Usage in: app/worker_pool.py
+WORKER_POOL_MAX_PENDING = int(os.getenv('WORKER_POOL_MAX_PENDING', '0'))   # tasks queued or running, 0: 4 per process
+WORKER_POOL_WAIT = float(os.getenv('WORKER_POOL_WAIT', '10'))    # seconds a request waits for room, then 503
+WORKER_POOL_BATCH_MAX_PENDING = int(os.getenv('WORKER_POOL_BATCH_MAX_PENDING', '0'))   # tasks of batch jobs, 0: 1 per process
+
+# Downloaded documents, shared by the processes of a server: see document_cache.py
+# Usage in: app/lib/citeit_quote_context/document_cache.py
+DOCUMENT_CACHE_DIR = os.getenv('DOCUMENT_CACHE_DIR', '../downloads/documents/')
+DOCUMENT_CACHE_MAX_AGE = int(os.getenv('DOCUMENT_CACHE_MAX_AGE', '3600'))   # seconds, as RESPONSE_CACHE_MAX_AGE
+
+# YouTube transcripts and the time of each caption: see transcript_cache.py
+# Usage in: app/lib/citeit_quote_context/transcript_cache.py
+TRANSCRIPT_CACHE_DIR = os.getenv('TRANSCRIPT_CACHE_DIR', '../downloads/transcripts/custom/')
+
+# Page size of the posts-citing, posts-cited-by and archives-of-url queries
+# Usage in: app/queries.py
+QUERY_DEFAULT_RESULTS = 20
+QUERY_MAX_RESULTS = 100
+
+# Text search configuration (PostgreSQL) used by the search indexes
+# Changing it requires dropping and recreating the indexes
+# Usage in: app/search.py
+SEARCH_LANGUAGE = 'english'
+
 # Construct Database Connection String from Docker
 SQLALCHEMY_DATABASE_URI='{database_type}://{user}:{password}@{server}/{database}'.format(
     database_type = os.getenv('DATABASE_TYPE'),
@@ -28,9 +153,15 @@ SQLALCHEMY_DATABASE_URI='{database_type}://{user}:{password}@{server}/{database}
     database = os.getenv('DATABASE_PORT')    
 )
 
-# Number of URL lookups to make simulaneously:
-# pool = Pool(processes=settings.NUM_DOWNLOAD_PROCESSES)
-NUM_DOWNLOAD_PROCESSES = 5
+# Database connection pool: shared by all requests in a worker process
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '10'))
+DATABASE_MAX_OVERFLOW = int(os.getenv('DATABASE_MAX_OVERFLOW', '20'))
+DATABASE_POOL_TIMEOUT = int(os.getenv('DATABASE_POOL_TIMEOUT', '30'))     # seconds
+DATABASE_POOL_RECYCLE = int(os.getenv('DATABASE_POOL_RECYCLE', '1800'))   # seconds
+
+# Number of URL lookups to make simulaneously (processes in the worker pool):
+# Usage in: app/worker_pool.py
+NUM_DOWNLOAD_PROCESSES = int(os.getenv('NUM_DOWNLOAD_PROCESSES', '5'))   # gunicorn: sized with the workers, see gunicorn.conf.py
 
 # Remove the following Unicode code points from Hash
 URL_ESCAPE_CODE_POINTS = set ([
@@ -0,0 +1,115 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from collections import OrderedDict
+from datetime import datetime
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import uuid
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    Leveled, structured logging: one line of JSON per message
+
+        logger = logging.getLogger(__name__)
+        logger.debug("Downloaded %s", url, extra={'fields': {'status': 200}})
+
+    {"time": "..", "level": "DEBUG", "logger": "..", "message": "Downloaded https://..",
+     "pid": 12, "correlation_id": "4f0c..", "status": 200}
+
+    * Messages are only formatted if their level is enabled (LOG_LEVEL):
+      pass values as arguments, don't build the string yourself
+    * LOG_DEBUG_SAMPLE_RATE: fraction of debug messages kept
+    * correlation_id: the id of the API request (X-Request-ID) or batch job
+      being processed.  Tasks of the worker pool (worker_pool.py) log
+      with the id of the request that sent them.
+"""
+
+_context = threading.local()
+
+# Accepted from the X-Request-ID header
+CORRELATION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9._-]{0,63}$')
+
+
+def set_correlation_id(correlation_id=None):
+    """ Use the given id (if valid) or a new one for this thread's messages """
+    if not (correlation_id and CORRELATION_ID_PATTERN.match(correlation_id)):
+        correlation_id = uuid.uuid4().hex[:16]
+    _context.correlation_id = correlation_id
+    return correlation_id
+
+
+def get_correlation_id():
+    return getattr(_context, 'correlation_id', None)
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record):
+        record.correlation_id = get_correlation_id()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """ Keep a fraction of debug messages; other levels are always kept """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = OrderedDict()
+        data['time'] = datetime.utcfromtimestamp(record.created).isoformat() + 'Z'
+        data['level'] = record.levelname
+        data['logger'] = record.name
+        data['message'] = record.getMessage()
+        data['pid'] = record.process
+        data['correlation_id'] = getattr(record, 'correlation_id', None)
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def configure_logging():
+    """ Send every logger's messages to LOG_FILE (default: stderr) """
+    if settings.LOG_FILE:
+        handler = logging.FileHandler(settings.LOG_FILE)
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(DebugSampler(settings.LOG_DEBUG_SAMPLE_RATE))
+    if settings.LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s'
+        ))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(settings.LOG_LEVEL)
+    return handler
@@ -0,0 +1,24 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import os
+import sys
+import tempfile
+
+# Modules import each other relative to app/: (import settings, from lib.citeit_quote_context ..)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Run against a local SQLite stand-in unless a database is specified
+os.environ.setdefault(
+    'SQLALCHEMY_DATABASE_URI',
+    'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'citeit-test.db')
+)
+
+# Documents downloaded by one test aren't read from the cache by the next
+os.environ.setdefault('DOCUMENT_CACHE_DIR', tempfile.mkdtemp())
@@ -0,0 +1,100 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import subprocess
+import sys
+
+import pytest
+
+from database import Session, init_db, session_scope
+from models import BatchJob
+import batch
+import worker_pool
+
+# Citing page -> its quotes; 'bad' fails when its context is computed
+PAGES = {
+    'https://blog.example.com/1': ['one', 'two'],
+    'https://blog.example.com/2': ['three', 'bad', 'four'],
+    'https://blog.example.com/3': ['five'],
+}
+
+
+class FakeURL:
+
+    def __init__(self, url):
+        self.url = url
+
+    def prepare_citations(self, lookup=None):
+        if self.url not in PAGES:
+            raise IOError("Unable to download " + self.url)
+        return [], [
+            (n, {'citing_url': self.url, 'cited_url': 'https://source.example.com/', 'quote': quote})
+            for (n, quote) in enumerate(PAGES[self.url])
+        ]
+
+
+def load_numbered_quote_data(task):
+    n, quote = task
+    if quote['quote'] == 'bad':
+        raise ValueError("Unable to find the quote")
+    return n, {'sha256': quote['quote'], 'citing_quote': quote['quote']}
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """ Pages saved by the job.  The pool is started after the patches,
+        so its processes inherit them
+    """
+    pages = []
+    monkeypatch.setattr(batch, 'URL', FakeURL)
+    monkeypatch.setattr(batch, 'prefetch_document', lambda url: url)
+    monkeypatch.setattr(batch, 'load_numbered_quote_data', load_numbered_quote_data)
+    monkeypatch.setattr(batch, 'save_citation_results', lambda session, citations, request_id:
+                        pages.append([c['citing_quote'] for c in citations]))
+    monkeypatch.setattr(batch.Citation, 'publish_json', lambda self: {})
+    monkeypatch.setattr(worker_pool.settings, 'NUM_DOWNLOAD_PROCESSES', 2)
+
+    init_db()
+    worker_pool.shutdown()
+    worker_pool.start()
+    yield pages
+    worker_pool.shutdown()
+
+
+def test_failed_citation_fails_only_its_page(saved):
+    urls = list(PAGES.keys()) + ['https://blog.example.com/missing']
+    job_id = batch.create(urls)
+    batch.run(job_id, urls)
+
+    job = batch.status(Session(), job_id)
+    Session.remove()
+
+    assert job['status'] == 'done'
+    assert job['sources'] == {'distinct': 1, 'fetched': 1}
+    assert [page['status'] for page in job['urls']] == ['done', 'error', 'done', 'error']
+    assert 'Unable to find the quote' in job['urls'][1]['error']
+    assert sorted(saved) == [['five'], ['one', 'two']]
+
+
+def test_jobs_of_exited_processes_are_failed(saved):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+
+    orphan = batch.create(['https://blog.example.com/1'])
+    current = batch.create(['https://blog.example.com/3'])
+    with session_scope() as session:
+        session.query(BatchJob).filter(BatchJob.id == orphan) \
+            .update({'worker': batch.worker_name().rsplit(':', 1)[0] + ':%s' % exited.pid})
+
+    assert orphan in batch.recover_jobs()
+    job = batch.status(Session(), orphan)
+    assert job['status'] == 'error'
+    assert job['urls'][0]['status'] == 'error'
+    assert batch.status(Session(), current)['status'] == 'queued'
+    Session.remove()
@@ -0,0 +1,95 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import os
+import sys
+import types
+
+import pytest
+
+from lib.citeit_quote_context import document
+from lib.citeit_quote_context import document_cache
+from lib.citeit_quote_context.document import Document
+from lib.citeit_quote_context.quote import Quote
+from database import Session, init_db
+from models import Document as DocumentRow
+import cited_texts
+import worker_pool
+
+CITING_URL = 'https://www.citeit.net/pdf-post/'
+PDF_URL = 'https://source.example.com/report.pdf'
+PAGES = [
+    '  Page %s. ' % n + ' '.join('word%s-%s' % (n, w) for w in range(200))
+    for n in range(30)
+]
+QUOTE = 'word3-10 word3-11 word3-12 word3-13'
+
+
+@pytest.fixture
+def pdf(monkeypatch, tmpdir):
+    """ PDF_URL, read page by page: returns the pages read, by any process """
+    log = str(tmpdir.join('pages.log'))
+
+    def read_pdf_pages(self):
+        for n, page in enumerate(PAGES):
+            with open(log, 'a') as log_file:
+                log_file.write('%s\n' % n)
+            yield page
+
+    def pages_read():
+        if not os.path.exists(log):
+            return []
+        with open(log) as log_file:
+            return [int(n) for n in log_file.read().split()]
+
+    # text() checks pdftotext is installed; the pages are read by read_pdf_pages()
+    monkeypatch.setitem(sys.modules, 'pdftotext', types.ModuleType('pdftotext'))
+    monkeypatch.setattr(document.settings, 'PDF_ENABLED', True)
+    monkeypatch.setattr(document.settings, 'SAVE_DOWNLOADS_TO_FILE', False)
+    monkeypatch.setattr(document, 'publish_file', lambda *args: None)
+    monkeypatch.setattr(Document, 'pdf_scanned', lambda self: False)
+    monkeypatch.setattr(Document, 'read_pdf_pages', read_pdf_pages)
+    monkeypatch.setattr(document_cache.settings, 'DOCUMENT_CACHE_DIR', str(tmpdir.join('documents')))
+
+    html = '<html><body><p>The report says: %s</p></body></html>' % QUOTE
+    document_cache.save(CITING_URL, html.encode('utf-8'), html, {
+        'status_code': 200, 'encoding': 'utf-8', 'language': 'en', 'content_type': 'text/html'})
+    document_cache.save(PDF_URL, b'%PDF-1.4', '%PDF-1.4', {
+        'status_code': 200, 'encoding': 'utf-8', 'language': 'en', 'content_type': 'application/pdf'})
+    return pages_read
+
+
+def test_pdf_context_without_reading_later_pages(pdf):
+    quote = Quote(QUOTE, CITING_URL, PDF_URL, 'The report says: ' + QUOTE)
+    data = quote.data()
+
+    assert pdf() == [0, 1, 2, 3]
+    assert data['cited_quote'] == QUOTE
+    assert data['cited_context_after'].startswith(' word3-14')
+    assert data['cited_text'] is None
+
+
+def test_pdf_citation_saved_with_its_full_text(pdf):
+    init_db()
+    data = Quote(QUOTE, CITING_URL, PDF_URL, 'The report says: ' + QUOTE).data()
+
+    worker_pool.shutdown()
+    worker_pool.start()     # processes inherit the patches
+    try:
+        saved = cited_texts.save_later([data], None).result()
+    finally:
+        worker_pool.shutdown()
+
+    assert saved == [data['sha256']]
+    assert data['cited_text'] is None
+    assert len(pdf()) == 4 + len(PAGES)
+    session = Session()
+    row = session.query(DocumentRow).filter_by(url=PDF_URL).one()
+    assert row.body_text == '\n\n'.join(PAGES).strip()
+    Session.remove()
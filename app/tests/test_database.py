@@ -0,0 +1,54 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from sqlalchemy import text
+
+import database
+import settings
+
+NUM_REQUESTS = 200
+
+
+def test_concurrent_requests_do_not_leak_connections():
+    """ 200 concurrent requests each borrow a pooled connection through
+        the request-scoped session; all of them must be back in the pool
+        once the responses have been sent
+    """
+    app = Flask(__name__)
+    database.init_app(app)
+
+    @app.route('/query')
+    def query():
+        session = database.Session()
+        return str(session.execute(text('SELECT 1')).scalar())
+
+    def get(n):
+        with app.test_client() as client:
+            return client.get('/query').data
+
+    with ThreadPoolExecutor(max_workers=NUM_REQUESTS) as executor:
+        responses = list(executor.map(get, range(NUM_REQUESTS)))
+
+    pool = database.engine.pool
+    assert responses == [b'1'] * NUM_REQUESTS
+    assert pool.checkedout() == 0
+    assert pool.size() == settings.DATABASE_POOL_SIZE
+
+
+def test_session_scope_returns_connection_after_error():
+    try:
+        with database.session_scope() as session:
+            session.execute(text('SELECT 1'))
+            raise ValueError()
+    except ValueError:
+        pass
+
+    assert database.engine.pool.checkedout() == 0
@@ -0,0 +1,104 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from datetime import timedelta
+import os
+
+import pytest
+
+from lib.citeit_quote_context import document
+from lib.citeit_quote_context import document_cache
+from lib.citeit_quote_context.document import Document
+import batch
+import worker_pool
+
+SOURCES = {
+    'https://source.example.com/1': 'The first source, quoted on several pages.',
+    'https://source.example.com/2': 'The second source: it is quoted too.',
+}
+
+
+class FakeResponse:
+
+    def __init__(self, url, status_code):
+        self.status_code = status_code
+        self.text = SOURCES.get(url, 'Not Found')
+        self.content = self.text.encode('utf-8')
+        self.encoding = 'utf-8'
+        self.headers = {'Content-Type': 'text/plain'}
+        self.elapsed = timedelta(milliseconds=1)
+
+
+@pytest.fixture
+def downloads(monkeypatch, tmpdir):
+    """ Urls downloaded, by any process """
+    log = str(tmpdir.join('downloads.log'))
+
+    class FakeSession:
+        def mount(self, prefix, adapter):
+            pass
+
+        def get(self, url, headers=None, verify=True):
+            with open(log, 'a') as log_file:
+                log_file.write(url + '\n')
+            return FakeResponse(url, 200 if url in SOURCES else 404)
+
+    def downloaded():
+        if not os.path.exists(log):
+            return []
+        with open(log) as log_file:
+            return sorted(log_file.read().split())
+
+    monkeypatch.setattr(document_cache.settings, 'DOCUMENT_CACHE_DIR', str(tmpdir.join('documents')))
+    monkeypatch.setattr(document.settings, 'SAVE_DOWNLOADS_TO_FILE', False)
+    monkeypatch.setattr(document.settings, 'RATE_LIMIT_ENABLED', False)
+    monkeypatch.setattr(document, 'HTMLSession', FakeSession)
+    return downloaded
+
+
+def test_batch_fetches_each_source_once(downloads, monkeypatch):
+    # Every citation reads its source: 3 citations of each
+    tasks = [((n, 0), {'cited_url': url}) for n in range(3) for url in SOURCES]
+    monkeypatch.setattr(batch, 'load_numbered_quote_data', lambda task: (
+        task[0], {'cited_text': Document(task[1]['cited_url']).text()}))
+    monkeypatch.setattr(worker_pool.settings, 'NUM_DOWNLOAD_PROCESSES', 2)
+    worker_pool.shutdown()
+    worker_pool.start()     # processes inherit the patches
+    try:
+        fetched = list(worker_pool.imap_unordered(batch.fetch_source, sorted(SOURCES), batch=True))
+        results = list(worker_pool.imap_unordered(batch.compute_quote, tasks, batch=True))
+    finally:
+        worker_pool.shutdown()
+
+    assert sorted(fetched) == sorted(SOURCES)
+    assert downloads() == sorted(SOURCES)
+    assert sorted(quote_data['cited_text'] for (key, quote_data, error) in results) == \
+        sorted(list(SOURCES.values()) * 3)
+
+
+def test_failed_and_stale_downloads_fetched_again(downloads, monkeypatch):
+    missing = 'https://source.example.com/missing'
+    for n in range(2):
+        failed = Document(missing)
+        failed.text()
+        assert failed.fetch_failed()
+    assert document_cache.load(missing) is None
+
+    url = 'https://source.example.com/1'
+    assert Document(url).text() == SOURCES[url]
+    cached = Document(url)
+    assert cached.text() == SOURCES[url]
+    assert (cached.status_code, cached.num_downloads) == (200, 0)
+    assert downloads() == sorted([missing, missing, url])
+
+    monkeypatch.setattr(document_cache.settings, 'DOCUMENT_CACHE_MAX_AGE', -1)
+    assert Document(url).text() == SOURCES[url]
+    assert downloads() == sorted([missing, missing, url, url])
+    assert document_cache.prune() == 1
+    assert document_cache.load(url, max_age=3600) is None
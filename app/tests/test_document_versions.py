@@ -0,0 +1,80 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from database import Session, init_db
+from document_versions import reconstruct, versions, compact
+import document_versions
+from models import Document
+from persistence import document_row, save_documents
+
+URL = 'https://versions.example.com/article'
+PARAGRAPH = 'The quick brown fox jumps over the lazy dog. ' * 200
+
+
+def save_version(session, text):
+    row = document_row(URL, text, '<p>' + text + '</p>', 'text/html', 'utf-8', 'en', None)
+    save_documents(session, [row])
+    session.commit()
+
+
+def test_versions_stored_as_deltas(monkeypatch):
+    init_db()
+    session = Session()
+    texts = [PARAGRAPH + 'Edition %s.' % n for n in range(3)]
+
+    # Saving a version doesn't diff it
+    with monkeypatch.context() as patch:
+        patch.setattr(document_versions, 'make_delta', None)
+        for text in texts:
+            save_version(session, text)
+
+    history = [session.query(Document).get(v.id) for v in versions(session, URL)]
+    current, archived = history[0], history[1:]
+
+    # Archived with their full text: the deltas are made by the compaction job
+    assert [version.body_text for version in archived] == texts[1::-1]
+    assert [version.end_date is not None for version in archived] == [True, True]
+    assert [reconstruct(session, v)['body_text'] for v in history] == texts[::-1]
+    assert compact(session, URL) == 2
+    history = [session.query(Document).get(v.id) for v in history]
+    current, archived = history[0], history[1:]
+
+    assert current.end_date is None
+    assert current.body_text == texts[2]
+    for version in archived:
+        assert version.end_date is not None
+        assert version.body_text is None
+        assert len(version.body_text_delta) < len(PARAGRAPH) / 10
+
+    assert [reconstruct(session, v)['body_text'] for v in history] == texts[::-1]
+
+    # Content changes back to the first edition: it becomes current again
+    save_version(session, texts[0])
+    first = session.query(Document).get(history[-1].id)
+    assert first.end_date is None
+    assert first.body_text == texts[0]
+    assert reconstruct(session, history[0])['body_text'] == texts[2]
+
+    # The third edition was archived with its full text
+    assert compact(session, URL) == 1
+    assert compact(session, URL) == 0
+
+    # An archived version with a full copy (saved before deltas) is compacted
+    full_copy = session.query(Document).get(history[1].id)
+    full_copy.body_text, full_copy.body_text_delta = texts[1], None
+    full_copy.body_html, full_copy.body_html_delta = '<p>' + texts[1] + '</p>', None
+    full_copy.delta_base_id = None
+    session.commit()
+
+    assert compact(session, URL) == 1
+    assert session.query(Document).get(history[1].id).body_text is None
+    assert compact(session, URL) == 0
+    assert [reconstruct(session, session.query(Document).get(v.id))['body_text']
+            for v in history] == texts[::-1]
+    Session.remove()
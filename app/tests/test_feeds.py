@@ -0,0 +1,72 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import gzip
+import pytest
+
+import feeds as feeds_module
+from feeds import discover_urls, parse_feed
+
+SITEMAP_INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>%s</loc></sitemap>
+  <sitemap><loc>%s</loc></sitemap>
+</sitemapindex>"""
+
+SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc> https://blog.example.com/post-1/ </loc><lastmod>2020-08-01</lastmod></url>
+  <url><loc>https://blog.example.com/post-2/</loc></url>
+</urlset>"""
+
+RSS = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel>
+  <title>Blog</title><link>https://blog.example.com/</link>
+  <item><title>Post 2</title><link>https://blog.example.com/post-2/</link></item>
+  <item><title>Post 3</title><link>/post-3/</link></item>
+</channel></rss>"""
+
+ATOM = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <link href="https://blog.example.com/" rel="alternate"/>
+  <entry>
+    <link rel="edit" href="https://blog.example.com/edit/4"/>
+    <link href="https://blog.example.com/post-4/"/>
+  </entry>
+</feed>"""
+
+
+def test_parse_feed_formats():
+    assert parse_feed(SITEMAP) == (
+        ['https://blog.example.com/post-1/', 'https://blog.example.com/post-2/'], []
+    )
+    assert parse_feed(RSS, base_url='https://blog.example.com/feed/') == (
+        ['https://blog.example.com/post-2/', 'https://blog.example.com/post-3/'], []
+    )
+    assert parse_feed(ATOM) == (['https://blog.example.com/post-4/'], [])
+
+    with pytest.raises(ValueError):
+        parse_feed(b'<html><body></body></html>')
+
+
+def test_discover_urls_follows_sitemap_index(monkeypatch):
+    feeds = {
+        'https://blog.example.com/sitemap.xml': SITEMAP_INDEX % (
+            b'https://blog.example.com/sitemap-posts.xml.gz', b'https://blog.example.com/feed/'
+        ),
+        'https://blog.example.com/sitemap-posts.xml.gz': gzip.compress(SITEMAP),
+        'https://blog.example.com/feed/': RSS,
+    }
+    monkeypatch.setattr(feeds_module, 'fetch_feed', lambda url: feeds_module.unzip(feeds[url]))
+
+    assert discover_urls('https://blog.example.com/sitemap.xml') == [
+        'https://blog.example.com/post-1/',
+        'https://blog.example.com/post-2/',
+        'https://blog.example.com/post-3/',
+    ]
@@ -0,0 +1,99 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import pytest
+
+from lib.citeit_quote_context.quote_context import QuoteContext
+from lib.citeit_quote_context.quote_context import locate_in_pages
+
+
+PAGES = [
+    '  Page %s. ' % n + ' '.join('word%s-%s' % (n, w) for w in range(200))
+    for n in range(30)
+]
+
+
+def read(pages, read_pages):
+    for page in pages:
+        read_pages.append(page)
+        yield page
+
+
+def test_stops_once_the_quote_and_its_context_are_read():
+    read_pages = []
+    quote = 'word3-10 word3-11 word3-12 word3-13'
+    context = locate_in_pages([quote], read(PAGES, read_pages), after_quote_context_length=100)[quote]
+
+    assert len(read_pages) == 4
+
+    # Same position and context as in the whole text
+    whole = QuoteContext(quote, '\n\n'.join(PAGES).strip(), after_quote_context_length=100)
+    assert context.data()['quote_start_position'] == whole.data()['quote_start_position']
+    assert context.data()['context_after'] == whole.data()['context_after']
+    assert context.data()['context_before'] == whole.data()['context_before']
+
+
+def test_quote_across_a_page_break():
+    quote = 'word5-198 word5-199\n\n  Page 6. word6-0 word6-1'
+    context = locate_in_pages([quote], PAGES)[quote]
+
+    assert context.data()['quote'] == quote
+
+
+def test_quote_not_found_reads_every_page():
+    read_pages = []
+    context = locate_in_pages(['not in the document at all'], read(PAGES, read_pages))
+
+    assert len(read_pages) == len(PAGES)
+    assert context['not in the document at all'].data()['quote_start_position'] == -1
+
+
+def test_scanned_pdf_text_matches_its_pages(monkeypatch):
+    import sys
+    import types
+    from lib.citeit_quote_context import document
+    from lib.citeit_quote_context.document import Document
+
+    # text() checks these are installed; the pages are read by read_pdf_pages()
+    for module in ['pdftotext', 'pdf2image', 'pytesseract']:
+        monkeypatch.setitem(sys.modules, module, types.ModuleType(module))
+    monkeypatch.setattr(document.settings, 'PDF_ENABLED', True)
+    monkeypatch.setattr(document.settings, 'SAVE_DOWNLOADS_TO_FILE', False)
+    monkeypatch.setattr(Document, 'doc_type', lambda self: 'pdf')
+    monkeypatch.setattr(Document, 'canonical_url', lambda self: self.url)
+    monkeypatch.setattr(Document, 'pdf_scanned', lambda self: True)
+    monkeypatch.setattr(Document, 'read_pdf_pages', lambda self: iter(PAGES))
+
+    doc = Document('https://www.citeit.net/scanned.pdf')
+    quote = 'word7-198 word7-199\n\n  Page 8. word8-0'
+    context = locate_in_pages([quote], doc.pages())[quote]
+    whole = QuoteContext(quote, doc.text())
+
+    assert context.data()['quote_start_position'] == whole.data()['quote_start_position'] > 0
+    assert context.data()['context_before'] == whole.data()['context_before']
+
+
+@pytest.mark.parametrize('pages, scanned', [
+    ([''] + PAGES, False),                              # blank cover
+    (['', ''] + PAGES[:2], False),
+    (PAGES[:1] + [''] * 40, True),                      # digital cover sheet
+    ([''] * 3 + PAGES[:1], True),
+])
+def test_pdf_scanned_samples_the_whole_pdf(monkeypatch, tmpdir, pages, scanned):
+    import sys
+    import types
+    from lib.citeit_quote_context.document import Document
+
+    pdftotext = types.ModuleType('pdftotext')
+    pdftotext.PDF = lambda pdf_file: pages
+    monkeypatch.setitem(sys.modules, 'pdftotext', pdftotext)
+    tmpdir.join('report.pdf').write_binary(b'%PDF-1.4')
+    monkeypatch.setattr(Document, 'filename_original', lambda self: str(tmpdir.join('report.pdf')))
+
+    assert Document('https://www.citeit.net/report.pdf').pdf_scanned() == scanned
@@ -0,0 +1,59 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from multiprocessing import get_context
+import json
+
+from metrics import Metrics, render
+
+
+def count_in_child(metrics):
+    metrics.inc('citeit_fetches_total', status='200')
+    metrics.flush(force=True)
+
+
+def test_counts_of_every_process(tmpdir):
+    metrics = Metrics(str(tmpdir))
+    metrics.inc('citeit_fetches_total', status='200')
+    metrics.set_gauge('citeit_requests_in_progress', 3)
+
+    # An exited worker: its counters are archived, its gauges dropped
+    tmpdir.join('99999999-exited.json').write(json.dumps({
+        'pid': 99999999,
+        'counters': {'citeit_fetches_total{status="200"}': 5},
+        'gauges': {'citeit_requests_in_progress': 7},
+        'collected': {},
+        'histograms': {'quote.bitap': {'buckets': [1] * 15, 'sum': 0.0005, 'count': 1}},
+    }))
+
+    # A forked process starts from zero rather than its parent's counts
+    child = get_context('fork').Process(target=count_in_child, args=(metrics,))
+    child.start()
+    child.join()
+
+    total = metrics.collect()
+    assert total['counters'] == {'citeit_fetches_total{status="200"}': 7}
+    assert total['gauges'] == {'citeit_requests_in_progress': 3}
+    assert not tmpdir.join('99999999-exited.json').exists()
+
+    # Archived counts are still there on the next collection
+    assert metrics.collect()['counters'] == total['counters']
+
+    text = render(total)
+    assert 'citeit_fetches_total{status="200"} 7\n' in text
+    assert 'citeit_stage_seconds_bucket{stage="quote.bitap",le="+Inf"} 1\n' in text
+
+
+def test_collectors_report_changes_since_start(tmpdir):
+    hits = {'count': 10}
+    metrics = Metrics(str(tmpdir))
+    metrics.register_collector(lambda: {('citeit_cache_total', (('cache', 'test'),)): hits['count']})
+    hits['count'] = 12
+
+    assert metrics.snapshot()['collected'] == {'citeit_cache_total{cache="test"}': 2}
@@ -0,0 +1,58 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import threading
+
+import pytest
+
+from lib.citeit_quote_context import ocr
+
+
+@pytest.fixture
+def scan(monkeypatch, tmpdir):
+    """ A 20 page 'scan': each page's text is its number.  Returns the pages read """
+    read = []
+    lock = threading.Lock()
+
+    def ocr_page(pdf_path, page, dpi, language):
+        with lock:
+            read.append(page)
+        return 'page %s at %s dpi' % (page, dpi)
+
+    monkeypatch.setattr(ocr, 'ocr_page', ocr_page)
+    monkeypatch.setattr(ocr, 'page_count', lambda pdf_path: 20)
+    monkeypatch.setattr(ocr.settings, 'OCR_CACHE_DIR', str(tmpdir.join('ocr')))
+    tmpdir.join('scan.pdf').write_binary(b'%PDF-1.4 scanned')
+    return str(tmpdir.join('scan.pdf')), read
+
+
+def test_pages_in_order_and_cached(scan):
+    pdf_path, read = scan
+
+    texts = list(ocr.ocr_pages(pdf_path, dpi=300, language='eng', workers=4))
+    assert texts == ['page %s at 300 dpi' % page for page in range(1, 21)]
+    assert sorted(read) == list(range(1, 21))
+
+    # Read again: every page comes from the cache
+    assert list(ocr.ocr_pages(pdf_path, dpi=300, language='eng', workers=4)) == texts
+    assert len(read) == 20
+
+    # Another resolution is another conversion
+    assert next(ocr.ocr_pages(pdf_path, dpi=150, language='eng', workers=1)) == 'page 1 at 150 dpi'
+
+
+def test_stopping_early_skips_the_remaining_pages(scan):
+    pdf_path, read = scan
+
+    pages = ocr.ocr_pages(pdf_path, dpi=300, language='eng', workers=2)
+    assert next(pages) == 'page 1 at 300 dpi'
+    pages.close()
+
+    # At most the pages read ahead (2 * workers)
+    assert len(read) <= 4
@@ -0,0 +1,208 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from sqlalchemy import event, inspect
+from datetime import datetime, timedelta
+
+from database import Session, engine, init_db, session_scope
+from models import Citation, Document, Domain
+from persistence import save_citations, get_domain_id, content_hash
+from persistence import stored_citations, touch_citations, backfill_reversed_domains
+from persistence import save_citation_results, backfill_url_hashes, url_hash
+from queries import find_domain_ids
+
+
+def citation_data(n, cited_text='Text of the cited source'):
+    return {
+        'sha256': '%064x' % n,
+        'citing_url': 'https://www.citeit.net/demo/',
+        'citing_url_canonical': 'www.citeit.net/demo',
+        'citing_quote': 'quote %s' % n,
+        'citing_text': 'Text of the citing page',
+        'citing_raw': '<html>Text of the citing page</html>',
+        'citing_context_before': 'before',
+        'citing_context_after': 'after',
+        'cited_url': 'https://source-%s.example.com/page' % (n % 4),
+        'cited_quote': 'quote %s' % n,
+        'cited_text': cited_text,
+        'cited_raw': '<html>%s</html>' % cited_text,
+        'cited_context_before': 'before',
+        'cited_context_after': 'after',
+    }
+
+
+def test_save_citations_round_trips():
+    """ Saving 40 citations takes a fixed number of statements """
+    init_db()
+    session = Session()
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        saved = save_citations(session, [citation_data(n) for n in range(40)], request_id=1)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    urls = ['https://www.citeit.net/demo/'] + \
+        ['https://source-%s.example.com/page' % n for n in range(4)]
+    domains = ['www.citeit.net'] + ['source-%s.example.com' % n for n in range(4)]
+
+    assert len(saved) == 40
+    assert len(statements) <= 7
+    assert session.query(Citation).filter(Citation.sha256.in_(saved)).count() == 40
+    assert session.query(Document).filter(Document.url.in_(urls)).count() == 5
+    assert session.query(Domain).filter(Domain.domain_url.in_(domains)).count() == 5
+    Session.remove()
+
+
+def test_save_citations_upserts_by_sha256():
+    init_db()
+    session = Session()
+    save_citations(session, [citation_data(100)], request_id=1)
+    first = session.query(Citation).filter_by(sha256='%064x' % 100).one()
+    first_id, first_created = first.id, first.create_date
+    session.commit()
+    save_citations(session, [citation_data(100, cited_text='Revised text')], request_id=2)
+
+    citations = session.query(Citation).filter_by(sha256='%064x' % 100).all()
+    document = session.query(Document).get(citations[0].cited_document)
+
+    assert len(citations) == 1
+    assert document.body_text == 'Revised text'
+
+    # Updated in place, not deleted and inserted again
+    assert (citations[0].id, citations[0].create_date) == (first_id, first_created)
+    assert citations[0].request_id == 1
+    Session.remove()
+
+
+def test_domain_ids_served_from_cache():
+    init_db()
+    session = Session()
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    first = get_domain_id(session, 'cache.example.com')   # created
+    session.commit()
+    second = get_domain_id(session, 'cache.example.com')  # read, then cached
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        third = get_domain_id(session, 'cache.example.com')
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    assert first == second == third
+    assert statements == []
+    Session.remove()
+
+
+def test_domain_committed_in_its_own_scope():
+    """ post_url(): the domain outlives a request that saves no citations """
+    init_db()
+    with session_scope() as session:
+        domain_id = get_domain_id(session, 'scope.example.com')
+
+    session = Session()
+    session.rollback()
+    assert session.query(Domain).get(domain_id).domain_url == 'scope.example.com'
+    Session.remove()
+
+
+def test_backfill_reversed_domains():
+    """ Domains saved before domain_reversed existed are found by subdomain search """
+    init_db()
+    session = Session()
+    session.execute(Domain.__table__.insert(), [
+        {'domain_url': url, 'domain_reversed': None}
+        for url in ('legacy.example', 'www.legacy.example', 'blog.legacy.example')
+    ])
+    session.commit()
+    assert find_domain_ids(session, 'legacy.example', subdomains=True) == []
+
+    assert backfill_reversed_domains(session, batch_size=2) == 3
+    assert backfill_reversed_domains(session) == 0
+    assert len(find_domain_ids(session, 'legacy.example', subdomains=True)) == 3
+    Session.remove()
+
+
+def test_long_urls_sharing_a_prefix_are_separate_documents():
+    """ MySQL could only index the first 255 characters of a url """
+    init_db()
+    session = Session()
+    prefix = 'https://long.example.com/' + 'a' * 300
+    citations = [
+        dict(citation_data(400 + n), cited_url=prefix + '/%s' % n, cited_text='Same text')
+        for n in range(2)
+    ]
+    saved = save_citations(session, citations, request_id=None)
+
+    rows = session.query(Citation).filter(Citation.sha256.in_(saved)).all()
+    assert len(set(row.cited_document for row in rows)) == 2
+    assert session.query(Document).filter(Document.url_hash == url_hash(prefix + '/1')).one().url == prefix + '/1'
+    Session.remove()
+
+
+def test_backfill_url_hashes():
+    """ Documents saved before url_hash existed; the index it replaces is dropped """
+    init_db()
+    session = Session()
+    session.execute('CREATE UNIQUE INDEX document_url_content_hash_unique ON document (url, content_hash)')
+    session.execute(Document.__table__.insert(), [
+        {'domain_id': 1, 'url': 'https://legacy.example/%s' % n, 'url_hash': None, 'content_type': 'text/html',
+         'encoding': 'utf-8', 'language': 'en', 'word_count': 0, 'content_hash': 'legacy'}
+        for n in range(3)
+    ])
+    session.commit()
+
+    assert backfill_url_hashes(session, batch_size=2) == 3
+    assert backfill_url_hashes(session) == 0
+    assert session.query(Document).filter(Document.url_hash == url_hash('https://legacy.example/2')).count() == 1
+    assert 'document_url_content_hash_unique' not in [index['name'] for index in inspect(engine).get_indexes('document')]
+    Session.remove()
+
+
+def test_citations_with_errors_keep_their_stored_context():
+    """ A cited document that was rate limited doesn't overwrite good context """
+    init_db()
+    session = Session()
+    sha256 = save_citations(session, [citation_data(300)], request_id=None)[0]
+
+    failed = dict(citation_data(300, cited_text=''), cited_context_before='', error="Cited document: Rate limited")
+    save_citation_results(session, [failed], request_id=None)
+
+    assert stored_citations(session, [sha256])[sha256]['cited_context_before'] == 'before'
+    Session.remove()
+
+
+def test_stored_citations_freshness():
+    """ URL.citations() reuses stored context until it is CITATION_CACHE_TTL old """
+    init_db()
+    session = Session()
+    sha256 = save_citations(session, [citation_data(200)], request_id=None)[0]
+
+    stored = stored_citations(session, [sha256, 'f' * 64])
+    assert list(stored.keys()) == [sha256]
+    assert stored[sha256]['fresh']
+    assert stored[sha256]['citing_context_before'] == 'before'
+    assert stored[sha256]['cited_content_hash'] == content_hash('Text of the cited source')
+
+    session.query(Citation).filter_by(sha256=sha256) \
+        .update({Citation.update_date: datetime.utcnow() - timedelta(days=30)})
+    session.commit()
+    assert not stored_citations(session, [sha256])[sha256]['fresh']
+
+    touch_citations(session, [sha256])
+    assert stored_citations(session, [sha256])[sha256]['fresh']
+    Session.remove()
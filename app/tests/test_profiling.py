@@ -0,0 +1,59 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import os
+
+import profiling
+
+
+def slow_function():
+    return sum(n * n for n in range(10000))
+
+
+def test_requested_only_with_admin_token(monkeypatch):
+    monkeypatch.setattr(profiling.settings, 'PROFILE_ADMIN_TOKEN', 'secret')
+
+    assert profiling.requested_mode({'profile': '1'}, {'X-Admin-Token': 'secret'}) == 'save'
+    assert profiling.requested_mode({'profile': 'text'}, {'X-Admin-Token': 'secret'}) == 'text'
+    assert profiling.requested_mode({}, {'X-Profile': '1', 'X-Admin-Token': 'secret'}) == 'save'
+    assert profiling.requested_mode({'profile': '1'}, {'X-Admin-Token': 'wrong'}) is None
+    assert profiling.requested_mode({'profile': '1'}, {}) is None
+
+    monkeypatch.setattr(profiling.settings, 'PROFILE_ADMIN_TOKEN', '')
+    assert profiling.requested_mode({'profile': '1'}, {'X-Admin-Token': ''}) is None
+
+
+def test_sampling(monkeypatch):
+    monkeypatch.setattr(profiling.settings, 'PROFILE_SAMPLE_RATE', 0)
+    assert not any(profiling.sampled() for n in range(100))
+
+    monkeypatch.setattr(profiling.settings, 'PROFILE_SAMPLE_RATE', 1)
+    assert all(profiling.sampled() for n in range(100))
+
+
+def test_save_and_report(monkeypatch, tmpdir):
+    monkeypatch.setattr(profiling.settings, 'PROFILE_DIR', str(tmpdir))
+    monkeypatch.setattr(profiling.settings, 'PROFILE_MAX_FILES', 2)
+
+    for request_id in ('first', 'second', 'third'):
+        profiler = profiling.start()
+        slow_function()
+        profiler.disable()
+        profiling.save(profiler, request_id)
+        os.utime(profiling.profile_path(request_id), (0, len(os.listdir(str(tmpdir)))))
+
+    # The oldest profile was dropped
+    assert sorted(os.listdir(str(tmpdir))) == ['second.prof', 'third.prof']
+    assert 'slow_function' in profiling.report(profiling.profile_path('third'))
+
+
+def test_profile_path_is_inside_profile_dir():
+    assert profiling.profile_path('../settings') is None
+    assert profiling.profile_path('a/b') is None
+    assert profiling.profile_path('4f0c1d2e').endswith('4f0c1d2e.prof')
@@ -0,0 +1,135 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from datetime import datetime, timedelta
+import pytest
+import os
+
+from models import Base, Citation, Document, Domain
+from persistence import reverse_domain
+from queries import posts_citing, posts_cited_by, citing_query, cited_by_query, keyset_query, encode_cursor
+
+# Seeded citations: set CITEIT_QUERY_PLAN_ROWS=1000000 for a full-size run
+SEED_ROWS = int(os.getenv('CITEIT_QUERY_PLAN_ROWS', '20000'))
+DOMAINS = ['plan.example', 'www.plan.example', 'blog.plan.example', 'other.example']
+
+
+@pytest.fixture(scope='module')
+def seeded_session(tmp_path_factory):
+    """ Separate database, so the row counts don't depend on other tests """
+    path = tmp_path_factory.mktemp('queries') / 'citeit-queries.db'
+    engine = create_engine('sqlite:///' + str(path))
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        connection.execute(Domain.__table__.insert(), [
+            {'id': n + 1, 'domain_url': domain, 'domain_reversed': reverse_domain(domain)}
+            for (n, domain) in enumerate(DOMAINS)
+        ])
+        connection.execute(Document.__table__.insert(), {
+            'id': 1, 'domain_id': 1, 'url': 'https://plan.example/', 'content_type': 'text/html',
+            'encoding': 'utf-8', 'language': 'en', 'word_count': 0, 'content_hash': '',
+        })
+
+        start = datetime(2020, 1, 1)
+        for offset in range(0, SEED_ROWS, 10000):
+            connection.execute(Citation.__table__.insert(), [
+                citation_row(n, start) for n in range(offset, min(offset + 10000, SEED_ROWS))
+            ])
+        connection.execute('ANALYZE')
+
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def citation_row(n, start):
+    return {
+        'id': n + 1,
+        'sha256': '%064x' % n,
+        'citing_domain_id': n % 4 + 1,
+        'citing_url': 'https://%s/post-%s' % (DOMAINS[n % 4], n % 500),
+        'citing_url_canonical': '%s/post-%s' % (DOMAINS[n % 4], n % 500),
+        'citing_quote': 'quote %s' % n,
+        'citing_document': 1,
+        'cited_domain_id': (n // 4) % 4 + 1,
+        'cited_url': 'https://%s/source-%s' % (DOMAINS[(n // 4) % 4], n % 50),
+        'cited_url_canonical': '%s/source-%s' % (DOMAINS[(n // 4) % 4], n % 50),
+        'cited_quote': 'quote %s' % n,
+        'cited_document': 1,
+        'create_date': start + timedelta(minutes=n // 3),   # ties on create_date
+    }
+
+
+def query_plan(session, query):
+    statement = query.statement.compile(
+        dialect=session.bind.dialect,
+        compile_kwargs={'literal_binds': True}
+    )
+    rows = session.execute('EXPLAIN QUERY PLAN ' + str(statement))
+    return ' | '.join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize('function, url, search_type, index', [
+    (citing_query, 'https://www.plan.example/source-7', 'url', 'citation_cited_url_canonical_create_date_index'),
+    (citing_query, 'https://plan.example/', 'domain', 'citation_cited_domain_id_create_date_index'),
+    (cited_by_query, 'https://blog.plan.example/post-1', 'url', 'citation_citing_url_canonical_create_date_index'),
+    (cited_by_query, 'https://other.example/', 'domain', 'citation_citing_domain_id_create_date_index'),
+])
+def test_query_plan_uses_composite_index(seeded_session, function, url, search_type, index):
+    """ Pages are read in index order: no table scan, no sort """
+    query = keyset_query(
+        function(seeded_session, url, search_type),
+        Citation.create_date, Citation.id,
+        after=encode_cursor(datetime(2020, 1, 5), 1000)
+    )
+    plan = query_plan(seeded_session, query.limit(21))
+
+    assert index in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_subdomain_search_uses_reversed_domain_prefix(seeded_session):
+    plan = query_plan(
+        seeded_session,
+        seeded_session.query(Domain.id).filter(Domain.domain_reversed.like('example.plan.%'))
+    )
+    assert 'domain_domain_reversed_index' in plan
+
+    page = posts_citing(seeded_session, 'https://plan.example/', search_type='domain-subdomains', max_results=100)
+    cited_domains = {row['cited_url_canonical'].split('/')[0] for row in page['results']}
+    assert cited_domains == {'plan.example', 'www.plan.example', 'blog.plan.example'}
+
+
+def test_keyset_pages_do_not_overlap(seeded_session):
+    url = 'https://www.plan.example/post-1'
+    seen = []
+    after = None
+    for page_number in range(SEED_ROWS):
+        page = posts_cited_by(seeded_session, url, max_results=7, after=after)
+        seen.extend(row['sha256'] for row in page['results'])
+        after = page['next']
+        if after is None:
+            break
+
+    assert len(seen) == len(set(seen))
+    assert len(seen) == cited_by_query(seeded_session, url).count()
+
+
+def test_date_range(seeded_session):
+    page = posts_citing(
+        seeded_session, 'https://www.plan.example/source-7',
+        start_date=datetime(2020, 1, 1), end_date=datetime(2020, 1, 2),
+        max_results=100
+    )
+    assert page['results']
+    assert all(row['create_date'] < '2020-01-02' for row in page['results'])
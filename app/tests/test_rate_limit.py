@@ -0,0 +1,76 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, RateLimited, client_key, host_limit
+
+
+@pytest.fixture
+def limiter(tmpdir, monkeypatch):
+    limiter = RateLimiter(str(tmpdir.join('rate-limit.db')))
+    monkeypatch.setattr(rate_limit, 'limiter', limiter)
+    return limiter
+
+
+def test_token_bucket(limiter):
+    assert [limiter.take('ip:1.2.3.4', rate=1, burst=3) for n in range(3)] == [0, 0, 0]
+
+    wait = limiter.take('ip:1.2.3.4', rate=1, burst=3)
+    assert 0 < wait <= 1
+    assert limiter.take('ip:5.6.7.8', rate=1, burst=3) == 0
+
+
+def test_concurrency_slots(limiter):
+    first = limiter.acquire('host:example.com', limit=2, lease=60)
+    second = limiter.acquire('host:example.com', limit=2, lease=60)
+
+    assert first and second
+    assert limiter.acquire('host:example.com', limit=2, lease=60) is None
+
+    limiter.release(first)
+    assert limiter.acquire('host:example.com', limit=2, lease=60)
+    assert limiter.acquire('host:expired.com', limit=1, lease=-1)
+    assert limiter.acquire('host:expired.com', limit=1, lease=-1)
+
+
+def test_host_limit_gives_up(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limit.settings, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(rate_limit.settings, 'RATE_LIMIT_HOST_CONCURRENCY', 1)
+    monkeypatch.setattr(rate_limit.settings, 'RATE_LIMIT_HOST_MAX_WAIT', 0.1)
+
+    with host_limit('https://example.com/a'):
+        with pytest.raises(RateLimited):
+            with host_limit('https://EXAMPLE.com/b'):
+                pass
+    with host_limit('https://example.com/c'):
+        pass
+
+    assert limiter.throttle_counts() == {'host_wait': 1, 'host_timeout': 1}
+
+
+def test_unknown_api_keys_limited_by_address(monkeypatch):
+    monkeypatch.setattr(rate_limit.settings, 'API_KEYS', ['known'])
+
+    assert client_key('1.2.3.4', 'known') == 'key:known'
+    assert client_key('1.2.3.4', 'made-up') == 'ip:1.2.3.4'
+
+
+def test_internal_endpoints_not_limited(limiter, monkeypatch):
+    import app as webservice
+    monkeypatch.setattr(rate_limit.settings, 'RATE_LIMIT_CLIENT_BURST', 1)
+    monkeypatch.setattr(rate_limit.settings, 'RATE_LIMIT_CLIENT_RATE', 0.001)
+    client = webservice.app.test_client()
+
+    assert [client.get('/metrics').status_code for n in range(3)] == [200, 200, 200]
+    assert client.get('/about').status_code == 200
+    assert client.get('/v0.4/url/batch/unknown').status_code == 404
+    assert client.get('/v0.4/url/batch/unknown').status_code == 429
+    assert limiter.throttle_counts() == {'client': 1}
@@ -0,0 +1,122 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import os
+import threading
+import time
+
+from database import Session, init_db
+from models import Request
+from request_log import RequestLog
+import request_log
+
+
+def request_row(n):
+    return {
+        'ip_address': '127.0.0.1',
+        'request_type': 'post-url',
+        'request_url': 'https://www.citeit.net/%s' % n,
+        'domain_id': None,
+        'user_agent': 'pytest',
+    }
+
+
+def test_rows_written_in_batches_on_stop():
+    init_db()
+    log = RequestLog(batch_size=100, flush_ms=50, max_queue=1000)
+    ids = [log.log(**request_row(n)) for n in range(250)]
+    log.stop()
+
+    session = Session()
+    assert log.written == 250
+    assert len(set(ids)) == 250
+    assert session.query(Request).filter(Request.id.in_(ids)).count() == 250
+    Session.remove()
+
+
+def test_full_queue_drops_rows():
+    init_db()
+    log = RequestLog(max_queue=2)
+    log._pid = os.getpid()   # don't start the writer thread
+
+    ids = [log.log(**request_row(n)) for n in range(5)]
+
+    assert ids[2:] == [None, None, None]
+    assert log.dropped == 3
+
+
+def test_flush_waits_only_for_rows_not_yet_written():
+    init_db()
+    log = RequestLog()
+    log._pid = os.getpid()   # don't start the writer thread
+
+    first = log.log(**request_row('first'))
+    log.flush(first)
+    assert log.written == 1
+
+    # Already written: the rows queued since are left to the writer thread
+    log.log(**request_row('second'))
+    log.flush(first)
+    assert log.written == 1
+    assert log.queue.qsize() == 1
+
+
+def test_ids_unique_across_processes():
+    init_db()
+    first, second = RequestLog(), RequestLog()     # as in two processes or hosts
+    first._pid = second._pid = os.getpid()
+    ids = [log.next_id() for n in range(3) for log in (first, second)]
+
+    # A forked process reserves its own block
+    first._id_block = (-1,) + first._id_block[1:]
+    ids.append(first.next_id())
+
+    assert len(set(ids)) == len(ids)
+    assert ids[0] // request_log.ID_BLOCK_SIZE != ids[-1] // request_log.ID_BLOCK_SIZE
+
+
+def test_flush_reports_rows_lost_to_database_errors():
+    init_db()
+    log = RequestLog()
+    log._pid = os.getpid()   # don't start the writer thread
+
+    lost = log.log(**dict(request_row('lost'), user_agent=None))   # fails its batch
+    dropped_with_it = log.log(**request_row('same batch'))
+    assert log.flush(lost) is False
+    assert log.flush(dropped_with_it) is False
+
+    written = log.log(**request_row('written'))
+    assert log.flush(written) is True
+    assert (log.written, log.failed) == (1, 2)
+
+    session = Session()
+    assert session.query(Request).filter(Request.id.in_([lost, dropped_with_it])).count() == 0
+    Session.remove()
+
+
+def test_flush_waits_for_a_row_the_writer_thread_holds():
+    init_db()
+    log = RequestLog()
+    log._pid = os.getpid()   # the writer thread is played below
+
+    held = log.log(**request_row('held'))
+    row = log.queue.get_nowait()      # taken from the queue, not yet in a batch
+
+    def writer():
+        time.sleep(0.1)
+        with log._write_lock:
+            log._pending.append(row)
+            if log._waiting:
+                log.write_pending()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert log.flush(held) is True
+    thread.join()
+    assert log.written == 1
@@ -0,0 +1,76 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from flask import Flask, request
+import pytest
+
+from response_cache import cached_response, dont_cache, response_cache
+
+calls = []
+app = Flask(__name__)
+
+
+@app.route('/url/text-version', methods=['GET', 'POST'])
+@cached_response
+def text_version():
+    calls.append(request.args.get('url'))
+    if request.args.get('url') == 'missing':
+        return 'Not found', 404
+    if request.args.get('url') == 'rate-limited':
+        dont_cache()
+        return ''
+    return 'Text of ' + request.args.get('url', '')
+
+
+@pytest.fixture
+def client():
+    response_cache.clear()
+    del calls[:]
+    return app.test_client()
+
+
+def test_repeat_requests_served_from_cache(client):
+    first = client.get('/url/text-version?url=https://www.citeit.net/%23a&separator=1')
+    second = client.get('/url/text-version?separator=1&url=https://www.citeit.net/')
+
+    assert calls == ['https://www.citeit.net/#a']
+    assert second.get_data() == first.get_data() == b'Text of https://www.citeit.net/#a'
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert 'public' in first.headers['Cache-Control']
+    assert 'max-age=' in first.headers['Cache-Control']
+
+
+def test_if_none_match(client):
+    etag = client.get('/url/text-version?url=a').headers['ETag']
+
+    not_modified = client.get('/url/text-version?url=a', headers={'If-None-Match': etag})
+    changed = client.get('/url/text-version?url=b', headers={'If-None-Match': etag})
+
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b''
+    assert changed.status_code == 200
+
+
+def test_errors_and_posts_not_cached(client):
+    assert client.get('/url/text-version?url=missing').status_code == 404
+    assert client.get('/url/text-version?url=missing').status_code == 404
+    client.post('/url/text-version?url=a')
+    client.post('/url/text-version?url=a')
+
+    assert len(calls) == 4
+
+
+def test_failed_downloads_not_cached(client):
+    first = client.get('/url/text-version?url=rate-limited')
+    client.get('/url/text-version?url=rate-limited')
+
+    assert len(calls) == 2
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-store'
+    assert 'ETag' not in first.headers
@@ -0,0 +1,109 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from sqlalchemy.dialects import mysql, postgresql
+import pytest
+
+from database import Session, init_db
+from persistence import save_citations
+from queries import search_citations, posts_cited_by
+from search import SEARCH_FIELDS, match, tsvector
+
+
+def citation_data(n, quote, context='', cited_text='Text of the cited source'):
+    return {
+        'sha256': 'f%063x' % n,
+        'citing_url': 'https://search.citeit.net/post/',
+        'citing_url_canonical': 'search.citeit.net/post',
+        'citing_quote': quote,
+        'citing_text': 'Text of the citing page',
+        'citing_raw': '<html>Text of the citing page</html>',
+        'citing_context_before': context,
+        'citing_context_after': '',
+        'cited_url': 'https://search-source.example.com/%s' % n,
+        'cited_quote': quote,
+        'cited_text': cited_text,
+        'cited_raw': '<html>%s</html>' % cited_text,
+        'cited_context_before': context,
+        'cited_context_after': '',
+    }
+
+
+@pytest.fixture(scope='module')
+def session():
+    init_db()
+    session = Session()
+    save_citations(session, [
+        citation_data(1, 'Zanzibar cloves are harvested twice a year'),
+        citation_data(2, 'Zanzibar Zanzibar: the spice islands of Zanzibar',
+                      cited_text='Quetzal feathers and cloves'),
+        citation_data(3, 'Nothing about islands', context='a note on Zanzibar'),
+    ], request_id=None)
+    yield session
+    Session.remove()
+
+
+def test_citation_terms_ranked(session):
+    results = search_citations(session, citation_terms='zanzibar')['results']
+
+    assert [row['sha256'] for row in results] == ['f%063x' % 2, 'f%063x' % 1]
+    assert results[0]['rank'] > results[1]['rank']
+
+
+def test_all_words_must_match(session):
+    results = search_citations(session, citation_terms='zanzibar cloves')['results']
+    assert [row['sha256'] for row in results] == ['f%063x' % 1]
+
+
+def test_context_and_document_terms(session):
+    context = search_citations(session, context_terms='Zanzibar')['results']
+    document = search_citations(session, document_terms='quetzal')['results']
+
+    assert [row['sha256'] for row in context] == ['f%063x' % 3]
+    assert [row['sha256'] for row in document] == ['f%063x' % 2]
+
+
+def test_index_updated_when_citation_replaced(session):
+    save_citations(session, [citation_data(1, 'Pemba cloves')], request_id=None)
+
+    assert search_citations(session, citation_terms='harvested')['results'] == []
+    assert len(search_citations(session, citation_terms='pemba')['results']) == 1
+
+
+def test_terms_filter_posts_cited_by(session):
+    page = posts_cited_by(session, 'https://search.citeit.net/post/', citation_terms='islands')
+    assert {row['sha256'] for row in page['results']} == {'f%063x' % 2, 'f%063x' % 3}
+
+
+def test_search_requires_terms(session):
+    with pytest.raises(ValueError):
+        search_citations(session)
+    with pytest.raises(ValueError):
+        search_citations(session, citation_terms='" -- ')
+
+
+def test_postgresql_query_matches_index_expression():
+    """ The GIN index is only used if the query repeats its expression """
+    (index_name, search_table, columns) = SEARCH_FIELDS['citation_terms']
+    dialect = postgresql.dialect()
+    indexed = str(tsvector(search_table, columns).compile(dialect=dialect))
+    condition = str(match('postgresql', 'citation_terms', 'free speech')[0].compile(dialect=dialect))
+
+    assert condition.startswith(indexed + ' @@ plainto_tsquery(')
+
+
+def test_mysql_match_uses_fulltext_columns():
+    condition = match('mysql', 'context_terms', "it's free speech")[0]
+    sql = str(condition.compile(dialect=mysql.dialect()))
+
+    assert sql == (
+        "MATCH (citation.citing_context_before, citation.citing_context_after, "
+        "citation.cited_context_before, citation.cited_context_after) "
+        "AGAINST ('+it +s +free +speech' IN BOOLEAN MODE)"
+    )
@@ -0,0 +1,70 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import json
+
+import pytest
+
+import app as webservice
+import worker_pool
+
+
+class FakeURL:
+    """ iter_citations() in the order the worker pool completes them """
+
+    url = 'https://www.citeit.net/stream/'
+
+    def __init__(self, positions, busy_after=None):
+        self.positions = positions
+        self.busy_after = busy_after
+
+    def iter_citations(self, lookup=None):
+        for (count, n) in enumerate(self.positions):
+            if count == self.busy_after:
+                raise worker_pool.WorkerPoolBusy("busy")
+            yield n, {'sha256': '%064x' % n, 'citing_quote': 'quote %s' % n}
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    batches = []
+    monkeypatch.setattr(webservice.settings, 'STREAM_SAVE_BATCH_SIZE', 2)
+    monkeypatch.setattr(webservice.Citation, 'publish_json', lambda self: dict(self.data))
+    monkeypatch.setattr(webservice, 'save_citation_results',
+                        lambda session, citations, request_id: batches.append(
+                            [c['citing_quote'] for c in citations]))
+    return batches
+
+
+def quotes(lines):
+    return [json.loads(line).get('citing_quote') for line in lines]
+
+
+def test_lines_in_the_order_computed(saved):
+    lines = list(webservice.stream_citations(None, FakeURL([3, 0, 4, 1, 2]), None, 1))
+
+    assert quotes(lines) == ['quote 3', 'quote 0', 'quote 4', 'quote 1', 'quote 2']
+    assert saved == [['quote 3', 'quote 0'], ['quote 4', 'quote 1'], ['quote 2']]
+
+
+def test_published_citations_saved_when_the_client_disconnects(saved):
+    stream = webservice.stream_citations(None, FakeURL([0, 1, 2, 3, 4]), None, 1)
+    lines = [next(stream) for n in range(3)]
+    stream.close()      # GeneratorExit at the third yield
+
+    assert quotes(lines) == ['quote 0', 'quote 1', 'quote 2']
+    assert saved == [['quote 0', 'quote 1'], ['quote 2']]
+
+
+def test_busy_pool_ends_the_stream_with_an_error_line(saved):
+    lines = list(webservice.stream_citations(None, FakeURL([0, 1, 2], busy_after=1), None, 1))
+
+    assert quotes(lines) == ['quote 0', None]
+    assert 'busy' in json.loads(lines[-1])['error']
+    assert saved == [['quote 0']]
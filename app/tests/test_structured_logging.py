@@ -0,0 +1,98 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from multiprocessing import get_context
+import io
+import json
+import logging
+
+from structured_logging import CorrelationFilter, DebugSampler, JsonFormatter
+from structured_logging import set_correlation_id, get_correlation_id
+
+
+class Formatted:
+    """ Counts how many times a message argument is converted to text """
+    count = 0
+
+    def __str__(self):
+        Formatted.count = Formatted.count + 1
+        return 'formatted'
+
+
+def make_logger(level, sample_rate=1):
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(DebugSampler(sample_rate))
+    handler.setFormatter(JsonFormatter())
+
+    logger = logging.getLogger('test_structured_logging.%s.%s' % (level, sample_rate))
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger, stream
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_json_lines_with_correlation_id():
+    logger, stream = make_logger(logging.DEBUG)
+    set_correlation_id('req-123')
+    logger.info("Downloaded %s", 'https://example.com/', extra={'fields': {'status': 200}})
+
+    [line] = lines(stream)
+    assert line['message'] == "Downloaded https://example.com/"
+    assert line['level'] == 'INFO'
+    assert line['correlation_id'] == 'req-123'
+    assert line['status'] == 200
+
+
+def test_invalid_correlation_id_is_replaced():
+    assert set_correlation_id('bad id\n') != 'bad id\n'
+    assert len(get_correlation_id()) == 16
+
+
+def test_disabled_debug_is_not_formatted():
+    logger, stream = make_logger(logging.INFO)
+    Formatted.count = 0
+    logger.debug("Text: %s", Formatted())
+
+    assert Formatted.count == 0
+    assert stream.getvalue() == ''
+
+
+def test_debug_sampling_keeps_other_levels():
+    logger, stream = make_logger(logging.DEBUG, sample_rate=0)
+    logger.debug("dropped")
+    logger.warning("kept")
+
+    assert [line['message'] for line in lines(stream)] == ["kept"]
+
+
+def log_in_child(logger):
+    logger.info("child")
+
+
+def test_forked_process_keeps_correlation_id(tmpdir):
+    logger, stream = make_logger(logging.INFO)
+    handler = logging.FileHandler(str(tmpdir.join('child.log')))
+    handler.addFilter(CorrelationFilter())
+    handler.setFormatter(JsonFormatter())
+    logger.handlers = [handler]
+
+    set_correlation_id('req-456')
+    child = get_context('fork').Process(target=log_in_child, args=(logger,))
+    child.start()
+    child.join()
+    handler.close()
+
+    [line] = [json.loads(line) for line in tmpdir.join('child.log').readlines()]
+    assert line['correlation_id'] == 'req-456'
@@ -0,0 +1,97 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import os
+import pickle
+
+import pytest
+
+from lib.citeit_quote_context import text_store
+from lib.citeit_quote_context.quote_context import QuoteContext
+
+
+TEXT = ''.join('Paragraph %s: naïve café — “quoted” 𝔘nicode. ' % n for n in range(2000))
+
+
+@pytest.fixture
+def stored(monkeypatch, tmpdir):
+    monkeypatch.setattr(text_store.settings, 'TEXT_STORE_DIR', str(tmpdir))
+    monkeypatch.setattr(text_store.settings, 'TEXT_STORE_MIN_LENGTH', 1000)
+    text_store.get.cache_clear()
+    text_store.decoded.cache_clear()
+    yield text_store.store(TEXT)
+    text_store.get.cache_clear()
+    text_store.decoded.cache_clear()
+
+
+def test_short_texts_are_not_stored(stored):
+    assert text_store.store('short') == 'short'
+
+
+def test_reads_like_a_str(stored):
+    assert isinstance(stored, text_store.StoredText)
+    assert len(stored) == len(TEXT)
+    assert str(stored) == TEXT
+    assert stored[100:250] == TEXT[100:250]
+    assert stored[-20:] == TEXT[-20:]
+    assert stored[37] == TEXT[37]
+    assert stored[5:5] == ''
+
+    for quote in ('café — “quoted”', 'Paragraph 1999', '𝔘nicode', 'not in the text'):
+        assert stored.find(quote) == TEXT.find(quote)
+        assert stored.find(quote, 5000) == TEXT.find(quote, 5000)
+
+
+def test_pickled_as_its_key(stored):
+    data = pickle.dumps(stored)
+    assert len(data) < 200
+    assert pickle.loads(data) is stored   # same mapping in this process
+
+
+def test_results_joined_into_one_str(stored):
+    from lib.citeit_quote_context.url import join_texts
+
+    # Results of the pool: each citation of the page returns its key
+    results = [pickle.dumps({'sha256': n, 'citing_text': stored, 'cited_text': 'short'}) for n in range(3)]
+    assert all(len(result) < 300 for result in results)
+
+    citations = [join_texts(pickle.loads(result)) for result in results]
+    assert citations[0]['citing_text'] == TEXT
+    assert all(c['citing_text'] is citations[0]['citing_text'] for c in citations)
+    assert citations[2]['cited_text'] == 'short'
+
+
+def test_same_context_as_the_str(stored):
+    quote = 'Paragraph 1200: naïve café'
+    assert QuoteContext(quote, stored).data() == dict(QuoteContext(quote, TEXT).data(), text=stored)
+
+
+def test_prune_removes_the_least_recently_stored(stored, monkeypatch):
+    monkeypatch.setattr(text_store.settings, 'TEXT_STORE_MIN_AGE', 3600)
+    monkeypatch.setattr(text_store.settings, 'TEXT_STORE_MAX_SIZE', 2 * len(TEXT) * text_store.CHAR_SIZE)
+    keys = [text_store.put(TEXT + str(n)) for n in range(4)]
+    for (age, key) in zip([7200, 5400, 9000, 0], keys):
+        mtime = os.path.getmtime(text_store.text_path(key)) - age
+        os.utime(text_store.text_path(key), (mtime, mtime))
+
+    # Stored again: now the most recent, though first written
+    assert text_store.put(TEXT + '2') == keys[2]
+    assert text_store.prune() == 2
+
+    kept = [os.path.exists(text_store.text_path(key)) for key in keys]
+    assert kept == [False, False, True, True]
+    assert os.path.exists(text_store.text_path(stored.key))
+    assert stored[:20] == TEXT[:20]     # still mapped
+
+
+def test_prune_keeps_texts_tasks_may_still_read(stored, monkeypatch):
+    monkeypatch.setattr(text_store.settings, 'TEXT_STORE_MAX_SIZE', 0)
+
+    assert text_store.prune() == 0
+    assert os.path.exists(text_store.text_path(stored.key))
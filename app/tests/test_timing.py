@@ -0,0 +1,32 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from lib.citeit_quote_context.misc.timing import Histograms, Timings
+
+
+def test_stages_add_up():
+    timings = Timings()
+    with timings.stage('match'):
+        pass
+    timings.add('fetch_ttfb', 0.25)
+    timings.add('fetch_ttfb', 0.5)
+
+    stages = timings.dict()
+    assert list(stages.keys()) == ['match', 'fetch_ttfb']
+    assert stages['fetch_ttfb'] == 0.75
+
+
+def test_histogram_buckets_are_cumulative():
+    histograms = Histograms(buckets=(0.1, 1, 10))
+    histograms.observe_all('document', {'fetch_ttfb': 0.5, 'html_parse': 0.05})
+    histograms.observe('document.fetch_ttfb', 20)
+
+    snapshot = histograms.snapshot()
+    assert snapshot['document.fetch_ttfb'] == {'buckets': [0, 1, 1], 'sum': 20.5, 'count': 2}
+    assert snapshot['document.html_parse']['buckets'] == [1, 1, 1]
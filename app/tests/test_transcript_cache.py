@@ -0,0 +1,120 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import requests
+
+from lib.citeit_quote_context import document
+from lib.citeit_quote_context.quote import Quote
+from lib.citeit_quote_context import transcript_cache
+
+VTT = """WEBVTT
+Kind: captions
+Language: en
+
+00:00:01.000 --> 00:00:04.000 align:start position:0%
+Four score and seven years ago
+
+00:00:04.000 --> 00:00:08.500 align:start position:0%
+Four score and seven years ago
+our fathers brought forth
+
+01:02:03.250 --> 01:02:05.000
+a new nation
+"""
+
+
+def test_caption_lines():
+    captions = transcript_cache.caption_lines(VTT)
+
+    assert captions == [
+        (0, 'WEBVTT'),
+        (0, 'Kind: captions'),
+        (0, 'Language: en'),
+        (1000, 'Four score and seven years ago'),
+        (4000, 'Four score and seven years ago'),
+        (4000, 'our fathers brought forth'),
+        (3723250, 'a new nation'),
+    ]
+
+
+def test_cached_with_the_time_of_each_line(monkeypatch, tmpdir):
+    monkeypatch.setattr(transcript_cache.settings, 'TRANSCRIPT_CACHE_DIR', str(tmpdir))
+    lines = ['Four score and seven years ago', 'our fathers brought forth', 'a new nation']
+    text = ' '.join(lines)
+
+    cues = transcript_cache.index_lines(text, lines, transcript_cache.caption_lines(VTT))
+    assert cues == [(0, 1000), (31, 4000), (57, 3723250)]
+
+    assert transcript_cache.load('youtube.com', 'abc') is None
+    transcript_cache.save('youtube.com', 'abc', text, cues)
+    transcript = transcript_cache.load('youtube.com', 'abc')
+
+    assert transcript.text == text
+    assert transcript.seconds(text.find('seven')) == 1.0
+    assert transcript.seconds(text.find('fathers')) == 4.0
+    assert transcript.seconds(text.find('nation')) == 3723.25
+
+
+def test_only_downloaded_captions_are_cached(monkeypatch, tmpdir):
+    class FakeYoutubeDL:
+        def __init__(self, options):
+            pass
+
+        def extract_info(self, url, download=False):
+            return {'requested_subtitles': subtitles, 'subtitles': {}}
+
+    class FakeResponse:
+        def __init__(self, status_code, text):
+            self.status_code = status_code
+            self.text = text
+
+        def raise_for_status(self):
+            if self.status_code >= 400:
+                raise requests.HTTPError(str(self.status_code))
+
+    responses = []
+    monkeypatch.setattr(transcript_cache.settings, 'TRANSCRIPT_CACHE_DIR', str(tmpdir))
+    monkeypatch.setattr(document.settings, 'SAVE_DOWNLOADS_TO_FILE', False)
+    monkeypatch.setattr(document.youtube_dl, 'YoutubeDL', FakeYoutubeDL)
+    monkeypatch.setattr(document.requests, 'get', lambda url, stream=False: responses.pop(0))
+    url = 'https://www.youtube.com/watch?v=abc'
+
+    subtitles = None    # no english captions
+    assert document.youtube_transcript(url) == ''
+    assert transcript_cache.load('youtube.com', 'abc') is None
+
+    subtitles = {'en': {'url': 'https://captions.example.com/abc.vtt'}}
+    responses.append(FakeResponse(503, 'Service Unavailable'))
+    assert document.youtube_transcript(url) == ''
+    assert transcript_cache.load('youtube.com', 'abc') is None
+
+    responses.append(FakeResponse(200, VTT))
+    text = document.youtube_transcript(url, '<br>')
+    assert text == 'Four score and seven years ago <br>our fathers brought forth <br>a new nation <br>'
+    assert transcript_cache.load('youtube.com', 'abc').text == \
+        'Four score and seven years ago our fathers brought forth a new nation'
+
+    # Formatted from the cache as each caller asks
+    assert document.youtube_transcript(url) == transcript_cache.load('youtube.com', 'abc').text
+    assert document.youtube_transcript(url, '<br>') == text
+    lines = document.youtube_transcript(url, '\n', timesplits=True).splitlines()
+    assert [line.strip() for line in lines] == [
+        '[0:00:01] Four score and seven years ago',
+        '[0:00:04] our fathers brought forth',
+        '[1:02:03] a new nation',
+    ]
+    assert responses == []
+
+
+def test_quote_documents_keep_their_line_separator():
+    quote = Quote('a quote', 'https://www.citeit.net/', 'https://www.youtube.com/watch?v=abc', request_id=7)
+
+    assert quote.cited_doc().line_separater == ''
+    assert quote.cited_doc().request_id == 7
+    assert quote.citing_doc().line_separater == ''
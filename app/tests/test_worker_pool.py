@@ -0,0 +1,66 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+import math
+import os
+import threading
+import time
+
+import pytest
+
+import worker_pool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(worker_pool.settings, 'NUM_DOWNLOAD_PROCESSES', 2)
+    monkeypatch.setattr(worker_pool.settings, 'WORKER_POOL_MAX_PENDING', 2)
+    worker_pool.shutdown()
+    yield worker_pool.start()
+    worker_pool.shutdown()
+
+
+def pid(n):
+    return os.getpid()
+
+
+def test_results_as_they_complete(pool):
+    assert sorted(worker_pool.imap_unordered(abs, range(-10, 0))) == list(range(1, 11))
+    assert worker_pool.pending() == 0
+
+    # The same processes serve every call
+    first = set(worker_pool.imap_unordered(pid, range(10)))
+    second = set(worker_pool.imap_unordered(pid, range(10)))
+    assert worker_pool.start() is pool
+    assert len(first | second) <= 2
+    assert os.getpid() not in first
+
+
+def test_task_errors_are_raised(pool):
+    with pytest.raises(ValueError):
+        list(worker_pool.imap_unordered(math.sqrt, [4, -1, 9]))
+
+
+def test_busy_when_saturated(pool):
+    # 2 tasks sleeping fill the pool: the third can't be sent in time
+    with pytest.raises(worker_pool.WorkerPoolBusy):
+        list(worker_pool.imap_unordered(time.sleep, [0.5, 0.5, 0.5], wait=0.1))
+
+    # Without a limit, it waits for room
+    assert list(worker_pool.imap_unordered(time.sleep, [0.1, 0.1, 0.1], wait=None)) == [None] * 3
+
+
+def test_batch_jobs_have_their_own_budget(pool):
+    # A batch job filling its own slots leaves room for requests
+    job = threading.Thread(target=lambda: list(
+        worker_pool.imap_unordered(time.sleep, [0.3] * 4, wait=None, batch=True)))
+    job.start()
+    time.sleep(0.05)
+    assert list(worker_pool.imap_unordered(abs, [-1, -2], wait=0.1)) in ([1, 2], [2, 1])
+    job.join()
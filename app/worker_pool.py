@@ -0,0 +1,175 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from structured_logging import get_correlation_id
+from structured_logging import set_correlation_id
+from multiprocessing import Pool
+import atexit
+import logging
+import os
+import queue
+import signal
+import threading
+import settings
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Worker processes computing quotes, shared by every request and batch
+    job of a server process
+
+        for n, quote_data in worker_pool.imap_unordered(load_numbered_quote_data, tasks):
+            ...
+
+    The pool of NUM_DOWNLOAD_PROCESSES processes is started once per
+    server process: by gunicorn's post_worker_init hook (gunicorn.conf.py),
+    otherwise on first use.  Its processes are forked from a server
+    process that has imported the app, and live until it exits, so
+    imports and per-process caches (text_store mappings) are kept from
+    one task to the next.
+
+    At most WORKER_POOL_MAX_PENDING tasks of requests are queued or
+    running at once.  When the pool is saturated, a request waits up to
+    WORKER_POOL_WAIT seconds for room, then fails with WorkerPoolBusy (503).
+    Batch jobs have a budget of their own, WORKER_POOL_BATCH_MAX_PENDING,
+    and wait as long as it takes: a large job doesn't fill the room
+    requests need.
+
+    A caller that stops early (client disconnected) leaves its started
+    tasks to finish: their results are dropped.
+"""
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None        # a forked process can't use its parent's pool
+_slots = None           # room for WORKER_POOL_MAX_PENDING tasks of requests
+_batch_slots = None     # room for WORKER_POOL_BATCH_MAX_PENDING tasks of batch jobs
+_pending = 0            # tasks queued or running
+
+
+class WorkerPoolBusy(Exception):
+    """ No room in the pool within WORKER_POOL_WAIT seconds """
+
+
+def start(processes=None):
+    """ The pool of this process, started with processes (default:
+        NUM_DOWNLOAD_PROCESSES) if it isn't running yet
+    """
+    global _pool, _pool_pid, _slots, _batch_slots, _pending
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pending = 0
+            processes = processes or settings.NUM_DOWNLOAD_PROCESSES
+            _pool = Pool(processes=processes, initializer=init_worker)
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(settings.WORKER_POOL_MAX_PENDING or processes * 4)
+            _batch_slots = threading.BoundedSemaphore(settings.WORKER_POOL_BATCH_MAX_PENDING or processes)
+            logger.info("Started worker pool: %s processes", processes)
+        return _pool
+
+
+def init_worker():
+    """ Runs once in each pool process """
+    # Stopped by shutdown() with the server, not by Ctrl-C in its terminal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def imap_unordered(function, items, wait=-1, batch=False):
+    """ Yield function(item) for each item, in the order they complete
+        wait: seconds to wait for room in the pool before WorkerPoolBusy
+              (default: WORKER_POOL_WAIT, None: as long as it takes)
+        batch: tasks of a batch job, counted against WORKER_POOL_BATCH_MAX_PENDING
+    """
+    if wait == -1:
+        wait = settings.WORKER_POOL_WAIT
+    pool = start()
+    slots = _batch_slots if batch else _slots
+    results = queue.Queue()
+
+    # Called by the pool's result thread
+    def done(result):
+        finished(slots)
+        results.put((True, result))
+
+    def failed(error):
+        finished(slots)
+        results.put((False, error))
+
+    # Log messages of the tasks carry the id of the request that sent them
+    correlation_id = get_correlation_id()
+
+    sent = 0
+    for item in items:
+        if not slots.acquire(timeout=wait):
+            raise WorkerPoolBusy("Worker pool busy: no room within %s seconds" % wait)
+        count_pending(1)
+        pool.apply_async(call, (function, correlation_id, item), callback=done, error_callback=failed)
+        sent = sent + 1
+
+        # Results that are ready, without waiting for the rest to be sent
+        while not results.empty():
+            sent = sent - 1
+            yield result(results.get())
+
+    while sent:
+        sent = sent - 1
+        yield result(results.get())
+
+
+def call(function, correlation_id, item):
+    """ Runs in the pool process """
+    set_correlation_id(correlation_id)
+    return function(item)
+
+
+def finished(slots):
+    count_pending(-1)
+    slots.release()
+
+
+def count_pending(change):
+    global _pending
+    with _lock:
+        _pending = _pending + change
+
+
+def result(outcome):
+    succeeded, value = outcome
+    if not succeeded:
+        raise value
+    return value
+
+
+def pending():
+    """ Tasks queued or running in this process's pool """
+    if _pool_pid != os.getpid():
+        return 0
+    return _pending
+
+
+def shutdown():
+    """ Let the tasks sent finish, then stop the pool's processes """
+    global _pool
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            return
+        pool = _pool
+        _pool = None
+    pool.close()
+    pool.join()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,26 @@
+# Copyright (C) 2015-2020 Tim Langeman and contributors
+# <see AUTHORS.txt file>
+#
+# This library is part of the CiteIt project:
+# http://www.citeit.net/
+
+# The code for this server library is released under the MIT License:
+# http://www.opensource.org/licenses/mit-license
+
+from app import app as application
+from langdetect.detector_factory import init_factory
+
+__author__ = 'Tim Langeman'
+__email__ = "timlangeman@gmail.com"
+__copyright__ = "Copyright (C) 2015-2020 Tim Langeman"
+__license__ = "MIT"
+__version__ = "0.4"
+
+
+"""
+    WSGI entry point of the production server: see gunicorn.conf.py
+"""
+
+# Load the language profiles before the workers are forked,
+# rather than on the first request of each worker
+init_factory()